@@ -1,4 +1,4 @@
-from flask import Flask, render_template, session, redirect, url_for, flash, jsonify
+from flask import Flask, abort, render_template, session, redirect, url_for, flash
 import json
 from flask_migrate import Migrate
 from config.database import Config
@@ -12,9 +12,37 @@ def create_app():
     # Création du dossier uploads s'il n'existe pas
     import os
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-    # Initialiser la base de données
+    # Sérialiseur JSON (Decimal et dates natifs, orjson s'il est installé)
+    from app.utils.json_provider import AffectiaJSONProvider
+    app.json = AffectiaJSONProvider(app)
+    # Initialiser la base de données (pool de connexions et délais d'après la configuration DB_*)
+    from app.utils.base_donnees import delai_requetes, options_moteur
+    from app.utils.routage_lecture import CLE_REPLICA, lecture_seule
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        **options_moteur(app.config),
+        **app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {})
+    }
+    # Réplica en lecture seule (voir app.utils.routage_lecture)
+    if app.config.get('DATABASE_REPLICA_URL'):
+        app.config['SQLALCHEMY_BINDS'] = {
+            **app.config.get('SQLALCHEMY_BINDS', {}),
+            CLE_REPLICA: {
+                'url': app.config['DATABASE_REPLICA_URL'],
+                **options_moteur(app.config, app.config['DATABASE_REPLICA_URL'])
+            }
+        }
     db.init_app(app)
 
+    # Cache de couverture des règles (dashboard, statistiques)
+    from app.services.coverage_cache import coverage_cache
+    coverage_cache.init_app(app)
+    from app.services.index_libelles import index_libelles_cache
+    index_libelles_cache.init_app(app)
+    from app.services.suggestion_cache import suggestion_cache
+    suggestion_cache.init_app(app)
+    from app.services.identite import identite_cache
+    identite_cache.init_app(app)
+
     # Initialiser les migrations
     migrate = Migrate(app, db)
 
@@ -53,11 +81,8 @@ def create_app():
         if 'user_id' not in session:
             return redirect(url_for('auth.login'))
 
-        # Récupérer l'organisation de l'utilisateur
-        organization_id = session['organization_id']
-
-        # Récupérer toutes les sociétés de l'organisation
-        societes = Societe.query.filter_by(organization_id=organization_id).all()
+        # Récupérer toutes les sociétés de l'organisation de l'utilisateur
+        societes = identite_cache.societes()
 
         if not societes:
             # Aucune société - rediriger vers l'import FEC
@@ -72,6 +97,8 @@ def create_app():
         return render_template('dashboard_selector.html', societes=societes)
 
     @app.route('/societe/<int:societe_id>')
+    @lecture_seule
+    @delai_requetes('DB_STATEMENT_TIMEOUT_ANALYSE_MS')
     def societe_dashboard(societe_id):
         """Dashboard d'une société spécifique avec données dynamiques"""
         if 'user_id' not in session:
@@ -79,14 +106,12 @@ def create_app():
 
         try:
             # Vérifier que l'utilisateur a accès à cette société
-            organization_id = session['organization_id']
-            societe = Societe.query.filter_by(
-                id=societe_id,
-                organization_id=organization_id
-            ).first_or_404()
+            societe = identite_cache.societe(societe_id)
+            if societe is None:
+                abort(404)
 
             # Récupérer toutes les sociétés pour le dropdown
-            societes = Societe.query.filter_by(organization_id=organization_id).all()
+            societes = identite_cache.societes()
 
             # Chercher le FEC le plus récent pour cette société
             fec_actif = FecFile.query.filter_by(
@@ -99,78 +124,24 @@ def create_app():
                 return render_template('societe_dashboard.html',
                                        societe=societe,
                                        societes=societes,
-                                       ecritures_json='[]',
                                        comptes_statistiques='[]',
                                        journaux='[]',
                                        automatisation_globale=0)
 
-            # Récupérer les écritures bancaires
-            ecritures = EcritureBancaire.query.filter_by(fec_file_id=fec_actif.id).all()
-
             # Récupérer les règles existantes
             regles_existantes = RegleAffectation.query.filter_by(societe_id=societe.id).all()
 
-            # Calculer les statistiques
-            from app.routes.regles import calculer_statistiques_comptes, calculer_automatisation_globale
-
-            comptes_statistiques = calculer_statistiques_comptes(ecritures, regles_existantes)
-            automatisation_globale = calculer_automatisation_globale(ecritures, regles_existantes)
+            # Même instantané que l'API du dashboard, sans les écritures (chargées par pages)
+            from app.routes.api import _construire_dashboard_data
+            instantane = _construire_dashboard_data(
+                fec_actif, regles_existantes, ('comptes_statistiques', 'automatisation_globale', 'journaux')
+            )
+            automatisation_globale = instantane['automatisation_globale']
 
             # Trier par "% à faire" décroissant comme demandé
-            comptes_statistiques.sort(key=lambda x: x['pourcentage_a_faire'], reverse=True)
-
-            # Préparer les écritures pour JavaScript
-            from app.services.regle_tester import RegleTester
-            tester = RegleTester()
-
-            ecritures_couvertes = set()
-            for regle in regles_existantes:
-                if regle.is_active:
-                    matches = tester.test_regle_object(regle, ecritures)
-                    for match in matches:
-                        ecritures_couvertes.add(match.id)
-
-            ecritures_json = []
-            for ecriture in ecritures:
-                # CORRECTION : Utiliser les nouveaux champs compte_contrepartie et libelle_contrepartie
-                if hasattr(ecriture, 'compte_contrepartie') and ecriture.compte_contrepartie:
-                    compte_contrepartie = ecriture.compte_contrepartie
-                else:
-                    # Fallback vers l'ancienne logique
-                    if not ecriture.compte_final.startswith('512'):
-                        compte_contrepartie = ecriture.compte_final
-                    else:
-                        compte_contrepartie = "AUTRE"
-
-                ecritures_json.append({
-                    'id': ecriture.id,
-                    'ecriture_lib': ecriture.ecriture_lib,
-                    'journal_code': ecriture.journal_code,
-                    'journal_lib': ecriture.journal_lib,
-                    'ecriture_date': ecriture.ecriture_date.strftime('%d/%m/%Y'),
-                    'ecriture_num': ecriture.ecriture_num,
-                    'piece_ref': ecriture.piece_ref,
-                    'montant': float(ecriture.montant) if ecriture.sens == 'D' else -float(ecriture.montant),
-                    'sens': ecriture.sens,
-                    'compte_final': ecriture.compte_final,
-                    'libelle_final': ecriture.libelle_final,
-                    'compte_contrepartie': compte_contrepartie,
-                    'couverte_par_regle': ecriture.id in ecritures_couvertes
-                })
-
-            # Récupérer les journaux
-            journaux = db.session.query(
-                EcritureBancaire.journal_code,
-                EcritureBancaire.journal_lib
-            ).filter_by(fec_file_id=fec_actif.id).distinct().all()
-
-            journaux_json = [
-                {
-                    'journal_code': j.journal_code,
-                    'journal_lib': j.journal_lib
-                }
-                for j in journaux
-            ]
+            comptes_statistiques = sorted(instantane['comptes_statistiques'],
+                                          key=lambda x: x['pourcentage_a_faire'], reverse=True)
+            journaux_json = instantane['journaux']
 
             return render_template('societe_dashboard.html',
                                    societe=societe,
@@ -178,7 +149,6 @@ def create_app():
                                    fec_actif=fec_actif,
                                    comptes_statistiques=json.dumps(comptes_statistiques),
                                    automatisation_globale=automatisation_globale,
-                                   ecritures_json=json.dumps(ecritures_json),
                                    journaux=json.dumps(journaux_json))
 
         except Exception as e:
@@ -193,8 +163,7 @@ def create_app():
             return redirect(url_for('auth.login'))
 
         # Récupérer toutes les sociétés de l'organisation
-        organization_id = session['organization_id']
-        societes = Societe.query.filter_by(organization_id=organization_id).all()
+        societes = identite_cache.societes()
         
         # Pour la sidebar, utiliser la première société ou None
         societe_active = societes[0] if societes else None
@@ -208,94 +177,7 @@ def create_app():
     # Fonction pour rendre l'utilisateur disponible dans tous les templates
     @app.context_processor
     def inject_user():
-        current_user = None
-        if 'user_id' in session:
-            from app.models.user import User
-            current_user = User.query.get(session['user_id'])
-        return dict(current_user=current_user)
-
-    @app.route('/api/societe/<int:societe_id>/dashboard-data')
-    def get_dashboard_data(societe_id):
-        """API pour récupérer les données du dashboard en AJAX"""
-        if 'user_id' not in session:
-            return jsonify({'success': False, 'error': 'Non connecté'}), 401
-
-        try:
-            # Vérifier les permissions
-            organization_id = session['organization_id']
-            societe = Societe.query.filter_by(
-                id=societe_id,
-                organization_id=organization_id
-            ).first()
-
-            if not societe:
-                return jsonify({'success': False, 'error': 'Société non trouvée'}), 403
-
-            # Récupérer le FEC le plus récent
-            fec_actif = FecFile.query.filter_by(
-                societe_id=societe_id,
-                is_active=True
-            ).order_by(FecFile.date_import.desc()).first()
-
-            if not fec_actif:
-                return jsonify({
-                    'success': True,
-                    'ecritures': [],
-                    'comptes_statistiques': [],
-                    'journaux': [],
-                    'automatisation_globale': 0
-                })
-
-            # Récupérer les écritures
-            ecritures = EcritureBancaire.query.filter_by(fec_file_id=fec_actif.id).all()
-
-            # Récupérer les règles
-            regles_existantes = RegleAffectation.query.filter_by(societe_id=societe_id).all()
-
-            # Calculer les statistiques
-            from app.routes.regles import calculer_statistiques_comptes, calculer_automatisation_globale
-            comptes_statistiques = calculer_statistiques_comptes(ecritures, regles_existantes)
-            automatisation_globale = calculer_automatisation_globale(ecritures, regles_existantes)
-
-            # Préparer les écritures pour JavaScript
-            ecritures_json = []
-            for ecriture in ecritures:
-                # CORRECTION : Utiliser les nouveaux champs
-                if hasattr(ecriture, 'compte_contrepartie') and ecriture.compte_contrepartie:
-                    compte_contrepartie = ecriture.compte_contrepartie
-                else:
-                    compte_contrepartie = "AUTRE"
-
-                ecritures_json.append({
-                    'id': ecriture.id,
-                    'ecriture_lib': ecriture.ecriture_lib,
-                    'journal_code': ecriture.journal_code,
-                    'ecriture_date': ecriture.ecriture_date.strftime('%d/%m/%Y'),
-                    'ecriture_num': ecriture.ecriture_num,
-                    'piece_ref': ecriture.piece_ref,
-                    'montant': float(ecriture.montant) if ecriture.sens == 'D' else -float(ecriture.montant),
-                    'compte_contrepartie': compte_contrepartie,
-                    'couverte_par_regle': False
-                })
-
-            # Récupérer les journaux
-            journaux = db.session.query(
-                EcritureBancaire.journal_code,
-                EcritureBancaire.journal_lib
-            ).filter_by(fec_file_id=fec_actif.id).distinct().all()
-
-            journaux_json = [{'journal_code': j.journal_code, 'journal_lib': j.journal_lib} for j in journaux]
-
-            return jsonify({
-                'success': True,
-                'ecritures': ecritures_json,
-                'comptes_statistiques': comptes_statistiques,
-                'journaux': journaux_json,
-                'automatisation_globale': automatisation_globale
-            })
-
-        except Exception as e:
-            print(f"Erreur API dashboard: {e}")
-            return jsonify({'success': False, 'error': 'Erreur interne'}), 500
+        # Chargé une seule fois par requête (et gardé entre les requêtes si IDENTITE_CACHE_TTL > 0)
+        return dict(current_user=identite_cache.utilisateur())
 
     return app
\ No newline at end of file
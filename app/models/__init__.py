@@ -1,4 +1,7 @@
 from flask_sqlalchemy import SQLAlchemy
 
+from app.utils.routage_lecture import SessionRoutee
+
 # Instance SQLAlchemy pour gérer notre base de données
-db = SQLAlchemy()
\ No newline at end of file
+# (lectures des routes en lecture seule envoyées au réplica s'il est configuré)
+db = SQLAlchemy(session_options={'class_': SessionRoutee})
\ No newline at end of file
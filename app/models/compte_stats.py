@@ -0,0 +1,26 @@
+from app.models import db
+
+
+class CompteStats(db.Model):
+    """Agrégats par compte de contrepartie d'un FEC (table des comptes du dashboard)"""
+    __tablename__ = 'compte_stats'
+    __table_args__ = (
+        db.UniqueConstraint('fec_file_id', 'compte', name='uq_compte_stats_fec_compte'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    fec_file_id = db.Column(db.Integer, db.ForeignKey('fec_files.id'), nullable=False, index=True)
+
+    compte = db.Column(db.String(20), nullable=False)
+    libelle = db.Column(db.String(200), nullable=False)
+
+    nb_transactions = db.Column(db.Integer, nullable=False, default=0)
+    montant_debit = db.Column(db.Numeric(18, 2), nullable=False, default=0)
+    montant_credit = db.Column(db.Numeric(18, 2), nullable=False, default=0)
+
+    # Écritures du compte couvertes par les règles actives, et empreinte de ces règles
+    nb_couvertes = db.Column(db.Integer, nullable=False, default=0)
+    empreinte_regles = db.Column(db.String(40), nullable=True)
+
+    def __repr__(self):
+        return f'<CompteStats {self.compte} ({self.nb_couvertes}/{self.nb_transactions})>'
@@ -4,6 +4,13 @@ from app.models import db
 class EcritureBancaire(db.Model):
     """Table des écritures bancaires extraites des FEC (comptes 512*)"""
     __tablename__ = 'ecritures_bancaires'
+    # Index de la pagination par curseur (filtre FEC + compte/journal, tri, puis id)
+    __table_args__ = (
+        db.Index('ix_ecritures_fec_date', 'fec_file_id', 'ecriture_date', 'id'),
+        db.Index('ix_ecritures_fec_compte_date', 'fec_file_id', 'compte_contrepartie', 'ecriture_date', 'id'),
+        db.Index('ix_ecritures_fec_journal_date', 'fec_file_id', 'journal_code', 'ecriture_date', 'id'),
+        db.Index('ix_ecritures_fec_montant', 'fec_file_id', 'montant', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
 
@@ -28,6 +35,7 @@ class EcritureBancaire(db.Model):
     id_devise = db.Column(db.String(3), nullable=True)
 
     # Champs calculés pour les règles
+    ecriture_lib_norm = db.Column(db.Text, nullable=True)  # Libellé normalisé à l'import (majuscules, sans accents)
     compte_final = db.Column(db.String(20), nullable=False)
     libelle_final = db.Column(db.String(200), nullable=False)
     montant = db.Column(db.Numeric(15, 2), nullable=False)
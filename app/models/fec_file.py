@@ -19,6 +19,9 @@ class FecFile(db.Model):
     encodage_detecte = db.Column(db.String(50), nullable=True)
     separateur_detecte = db.Column(db.String(5), nullable=True)
 
+    # Index des libellés normalisés (tableau des suffixes sérialisé), construit à la première recherche
+    index_libelles = db.deferred(db.Column(db.LargeBinary, nullable=True))
+
     # Lien vers la société
     societe_id = db.Column(db.Integer, db.ForeignKey('societes.id'), nullable=False)
 
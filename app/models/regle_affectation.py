@@ -14,6 +14,9 @@ class RegleAffectation(db.Model):
     criteres_montant = db.Column(db.JSON, nullable=True)  # {"operateur": ">=", "valeur": 100.0}
     journal_code = db.Column(db.String(10), nullable=True)  # Optionnel
 
+    # Ordre d'évaluation : la règle de plus haute priorité l'emporte sur une écriture
+    priorite = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
     # Compte de destination
     compte_destination = db.Column(db.String(20), nullable=False)
     libelle_destination = db.Column(db.String(200), nullable=False)
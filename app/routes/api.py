@@ -1,25 +1,61 @@
-from flask import Blueprint, jsonify, session, request
+from flask import Blueprint, Response, jsonify, session, request, current_app, stream_with_context, url_for
 from app.models import db
 from app.models.societe import Societe
 from app.models.fec_file import FecFile
 from app.models.ecriture_bancaire import EcritureBancaire
 from app.models.regle_affectation import RegleAffectation
-import json
+from app.services.compte_stats import statistiques_comptes_fec
+from app.services.contreparties import completer_contreparties_fec, resoudre_contreparties
+from app.services.identite import identite_cache
+from app.services.index_libelles import index_libelles_cache
+from app.services.lecture_ecritures import ecritures_lecture
+from app.services.coverage_cache import coverage_cache, requete_non_modifiee, reponse_json_avec_etag
+from app.services.suggestion_cache import suggestion_cache
+from app.services.format_colonnes import dashboard_en_colonnes
+from app.utils.base_donnees import delai_requetes, metriques_pool
+from app.utils.compression import corps_json, encodage_negocie, reponse_json_compressee
+from app.utils.routage_lecture import lecture_seule, noter_ecriture_utilisateur
 
 api_bp = Blueprint('api', __name__, url_prefix='/api')
 
 
 
+# Champs d'un instantané du dashboard ; ceux servis par défaut par dashboard-data
+CHAMPS_DASHBOARD = ('ecritures', 'comptes_statistiques', 'automatisation_globale', 'collisions', 'journaux', 'fec_actif')
+CHAMPS_DASHBOARD_DEFAUT = ('ecritures', 'comptes_statistiques', 'automatisation_globale', 'journaux', 'fec_actif')
+
+
+@api_bp.route('/societe/<int:societe_id>/dashboard')
 @api_bp.route('/societe/<int:societe_id>/dashboard-data')
+@lecture_seule
+@delai_requetes('DB_STATEMENT_TIMEOUT_ANALYSE_MS')
 def get_dashboard_data(societe_id):
-    """API pour récupérer les données du dashboard d'une société"""
+    """
+    API pour récupérer un instantané du dashboard d'une société
+
+    Paramètre champs : liste séparée par des virgules parmi CHAMPS_DASHBOARD (défaut :
+    CHAMPS_DASHBOARD_DEFAUT). Les champs demandés sont calculés en une seule passe, avec
+    une seule évaluation des règles partagée entre écritures couvertes et collisions.
+
+    Paramètre format : 'lignes' (défaut, une liste de dictionnaires par écriture) ou
+    'colonnes' (écritures en colonnes parallèles, voir ecritures_en_colonnes). La réponse
+    est compressée en gzip ou brotli selon l'en-tête Accept-Encoding.
+    """
     if 'user_id' not in session:
         return jsonify({'success': False, 'error': 'Non connecté'}), 401
 
+    format_reponse = request.args.get('format', 'lignes')
+    if format_reponse not in ('lignes', 'colonnes'):
+        return jsonify({'success': False, 'error': 'Format invalide'}), 400
+
+    champs = _champs_dashboard(request.args.get('champs'))
+    if champs is None:
+        return jsonify({'success': False, 'error': 'Champs invalides'}), 400
+
     try:
         # Vérifier que l'utilisateur a accès à cette société
-        societe = Societe.query.get_or_404(societe_id)
-        if societe.organization_id != session['organization_id']:
+        societe = identite_cache.societe(societe_id)
+        if societe is None:
             return jsonify({'success': False, 'error': 'Accès non autorisé'}), 403
 
         # Récupérer le FEC le plus récent et actif
@@ -29,76 +65,132 @@ def get_dashboard_data(societe_id):
         ).order_by(FecFile.date_import.desc()).first()
 
         if not fec_actif:
-            return jsonify({
-                'success': True,
-                'ecritures': [],
-                'comptes_statistiques': [],
-                'journaux': [],
-                'automatisation_globale': 0,
-                'fec_actif': None
-            })
-
-        # Récupérer les écritures bancaires
-        ecritures = EcritureBancaire.query.filter_by(fec_file_id=fec_actif.id).all()
+            return jsonify(_dashboard_vide(champs))
 
-        # Récupérer les règles existantes
+        # Récupérer les règles existantes (leur empreinte sert de clé de cache et d'ETag)
         regles_existantes = RegleAffectation.query.filter_by(societe_id=societe_id).all()
+        empreinte = coverage_cache.empreinte_regles(regles_existantes)
+
+        # Chaque représentation (champs, format, encodage) a son ETag et son corps en cache
+        nature_lignes = 'dashboard-' + '+'.join(champs)
+        nature = nature_lignes if format_reponse == 'lignes' else f"{nature_lignes}-colonnes"
+        encodage = encodage_negocie()
+        etag = coverage_cache.etag(fec_actif.id, empreinte, nature)
+        if encodage:
+            etag = f"{etag}-{encodage}"
+
+        # Rien n'a changé depuis le dernier appel : le navigateur réutilise sa copie
+        non_modifiee = requete_non_modifiee(etag)
+        if non_modifiee:
+            non_modifiee.vary.add('Accept-Encoding')
+            return non_modifiee
+
+        payload = coverage_cache.get_or_compute(
+            societe_id, fec_actif.id, empreinte, nature_lignes,
+            lambda: _construire_dashboard_data(fec_actif, regles_existantes, champs)
+        )
+        if format_reponse == 'colonnes':
+            lignes = payload
+            payload = coverage_cache.get_or_compute(
+                societe_id, fec_actif.id, empreinte, nature,
+                lambda: dashboard_en_colonnes(lignes)
+            )
+
+        corps, encodage = coverage_cache.get_or_compute(
+            societe_id, fec_actif.id, empreinte, f"{nature}-{encodage or 'identity'}",
+            lambda: corps_json(payload, encodage)
+        )
+        return reponse_json_compressee(corps, encodage, etag)
 
-        # Calculer les statistiques
-        from app.routes.regles import calculer_statistiques_comptes, calculer_automatisation_globale
+    except Exception as e:
+        print(f"Erreur API dashboard: {e}")
+        return jsonify({'success': False, 'error': 'Erreur interne du serveur'}), 500
 
-        comptes_statistiques = calculer_statistiques_comptes(ecritures, regles_existantes)
-        automatisation_globale = calculer_automatisation_globale(ecritures, regles_existantes)
 
-        # Préparer les écritures pour JavaScript
+def _champs_dashboard(valeur):
+    """Champs demandés, dans l'ordre de CHAMPS_DASHBOARD (None si un champ est inconnu)"""
+    if not valeur:
+        return CHAMPS_DASHBOARD_DEFAUT
+    demandes = {champ.strip() for champ in valeur.split(',') if champ.strip()}
+    if not demandes or demandes - set(CHAMPS_DASHBOARD):
+        return None
+    return tuple(champ for champ in CHAMPS_DASHBOARD if champ in demandes)
+
+
+def _dashboard_vide(champs):
+    """Instantané d'une société sans FEC actif"""
+    vides = {
+        'ecritures': [],
+        'comptes_statistiques': [],
+        'automatisation_globale': 0,
+        'collisions': 0,
+        'journaux': [],
+        'fec_actif': None
+    }
+    payload = {'success': True}
+    payload.update((champ, vides[champ]) for champ in champs)
+    return payload
+
+
+def _construire_dashboard_data(fec_actif, regles_existantes, champs=CHAMPS_DASHBOARD_DEFAUT):
+    """
+    Calcule les champs demandés de l'instantané du dashboard en une seule passe
+
+    Les écritures ne sont lues, et les règles évaluées, qu'une fois et seulement si les
+    écritures ou les collisions sont demandées ; statistiques par compte et automatisation
+    viennent de compte_stats.
+    """
+    payload = {'success': True}
+
+    affectation = None
+    if 'ecritures' in champs or 'collisions' in champs:
+        # Une seule évaluation ordonnée des règles pour les écritures couvertes et les collisions
         from app.services.regle_tester import RegleTester
-        tester = RegleTester()
-
-        ecritures_couvertes = set()
-        for regle in regles_existantes:
-            if regle.is_active:
-                matches = tester.test_regle_object(regle, ecritures)
-                for match in matches:
-                    ecritures_couvertes.add(match.id)
-
-        ecritures_json = []
-        for ecriture in ecritures:
-            if not ecriture.compte_final.startswith('512'):
-                compte_contrepartie = ecriture.compte_final
-            else:
-                autres_ecritures = EcritureBancaire.query.filter_by(
-                    fec_file_id=fec_actif.id,
-                    ecriture_num=ecriture.ecriture_num
-                ).filter(~EcritureBancaire.compte_num.startswith('512')).first()
-
-                if autres_ecritures:
-                    compte_contrepartie = autres_ecritures.compte_final
-                else:
-                    compte_contrepartie = "AUTRE"
+        ecritures = ecritures_lecture(fec_actif.id)
+        affectation = RegleTester().affecter_ecritures(regles_existantes, ecritures)
 
-            ecritures_json.append({
-                'id': ecriture.id,
-                'ecriture_lib': ecriture.ecriture_lib,
-                'journal_code': ecriture.journal_code,
-                'journal_lib': ecriture.journal_lib,
-                'ecriture_date': ecriture.ecriture_date.strftime('%d/%m/%Y'),
-                'ecriture_num': ecriture.ecriture_num,
-                'piece_ref': ecriture.piece_ref,
-                'montant': float(ecriture.montant) if ecriture.sens == 'D' else -float(ecriture.montant),
-                'sens': ecriture.sens,
-                'compte_final': ecriture.compte_final,
-                'libelle_final': ecriture.libelle_final,
-                'compte_contrepartie': compte_contrepartie,
-                'couverte_par_regle': ecriture.id in ecritures_couvertes
-            })
+    if 'ecritures' in champs:
+        # Préparer les écritures pour JavaScript
+        ecritures_couvertes = affectation.ecritures_couvertes
+        contreparties = resoudre_contreparties(fec_actif.id, ecritures)
+
+        payload['ecritures'] = [{
+            'id': ecriture.id,
+            'ecriture_lib': ecriture.ecriture_lib,
+            'journal_code': ecriture.journal_code,
+            'journal_lib': ecriture.journal_lib,
+            'ecriture_date': ecriture.ecriture_date,
+            'ecriture_num': ecriture.ecriture_num,
+            'piece_ref': ecriture.piece_ref,
+            'montant': ecriture.montant if ecriture.sens == 'D' else -ecriture.montant,
+            'sens': ecriture.sens,
+            'compte_final': ecriture.compte_final,
+            'libelle_final': ecriture.libelle_final,
+            'compte_contrepartie': contreparties[ecriture.id][0],
+            'couverte_par_regle': ecriture.id in ecritures_couvertes
+        } for ecriture in ecritures]
+
+    if 'comptes_statistiques' in champs or 'automatisation_globale' in champs:
+        # Statistiques par compte et automatisation globale (agrégats précalculés, compte_stats)
+        comptes_statistiques, automatisation_globale = statistiques_comptes_fec(fec_actif.id, regles_existantes)
+        if 'comptes_statistiques' in champs:
+            payload['comptes_statistiques'] = comptes_statistiques
+        if 'automatisation_globale' in champs:
+            payload['automatisation_globale'] = automatisation_globale
+
+    if 'collisions' in champs:
+        payload['collisions'] = calculer_collisions_totales(
+            [regle for regle in regles_existantes if regle.is_active], ecritures, affectation
+        )
 
+    if 'journaux' in champs:
         # Récupérer les journaux
         journaux = db.session.query(
             EcritureBancaire.journal_code,
             EcritureBancaire.journal_lib
         ).filter_by(fec_file_id=fec_actif.id).distinct().all()
 
-        journaux_json = [
+        payload['journaux'] = [
             {
                 'journal_code': j.journal_code,
                 'journal_lib': j.journal_lib
@@ -106,26 +198,228 @@ def get_dashboard_data(societe_id):
             for j in journaux
         ]
 
+    if 'fec_actif' in champs:
+        payload['fec_actif'] = {
+            'id': fec_actif.id,
+            'nom_original': fec_actif.nom_original,
+            'date_import': fec_actif.date_import,
+            'nb_lignes_bancaires': fec_actif.nb_lignes_bancaires
+        }
+
+    return payload
+
+
+def _ecritures_du_compte(fec_actif, ecritures, compte):
+    """Écritures du FEC dont la contrepartie est le compte (déduite pour les lignes anciennes, voir contreparties)"""
+    ecritures_compte = []
+
+    print(f"🔍 Recherche d'écritures pour le compte: '{compte}'")
+    print(f"🔍 Total écritures à analyser: {len(ecritures)}")
+
+    contreparties = resoudre_contreparties(fec_actif.id, ecritures)
+
+    for i, ecriture in enumerate(ecritures):
+        compte_contrepartie = contreparties[ecriture.id][0]
+
+        # Debug : afficher quelques exemples
+        if i < 10:
+            print(
+                f"🔍 Écriture {ecriture.id}: compte_final={ecriture.compte_final}, contrepartie={compte_contrepartie}")
+
+        # Ne garder que les écritures pour le compte sélectionné
+        if compte_contrepartie == compte:
+            ecritures_compte.append(ecriture)
+
+    return ecritures_compte
+
+
+def _couverture_compte(societe_id, fec_actif, compte, empreinte, ecritures_compte):
+    """Identifiants des écritures du compte couvertes par les règles existantes"""
+    # Couverture par les règles existantes : recalculée seulement si les règles de la société ont changé
+    regles_existantes = RegleAffectation.query.filter_by(societe_id=societe_id).all()
+    empreinte_regles = coverage_cache.empreinte_regles(regles_existantes)
+    ecritures_couvertes = suggestion_cache.couverture(fec_actif.id, compte, empreinte, empreinte_regles)
+    if ecritures_couvertes is None:
+        from app.services.regle_tester import RegleTester
+        affectation = RegleTester().affecter_ecritures(regles_existantes, ecritures_compte)
+        ecritures_couvertes = affectation.ecritures_couvertes
+        regles_couvrantes = {regle.id for regle in affectation.affectations.values()}
+        regles_couvrantes.update(regle.id for regles in affectation.masquees.values() for regle in regles)
+        suggestion_cache.enregistrer_couverture(
+            societe_id, fec_actif.id, compte, empreinte, empreinte_regles,
+            [ecriture.id for ecriture in ecritures_compte], ecritures_couvertes, regles_couvrantes
+        )
+    return ecritures_couvertes
+
+
+def _ecriture_compte_dict(ecriture, compte, ecritures_couvertes):
+    """Écriture d'un compte au format attendu par l'interface des groupements"""
+    return {
+        'id': ecriture.id,
+        'ecriture_lib': ecriture.ecriture_lib,
+        'ecriture_lib_norm': ecriture.ecriture_lib_norm,
+        'journal_code': ecriture.journal_code,
+        'journal_lib': ecriture.journal_lib,
+        'ecriture_date': ecriture.ecriture_date,
+        'ecriture_num': ecriture.ecriture_num,
+        'piece_ref': ecriture.piece_ref,
+        'montant': float(ecriture.montant) if ecriture.sens == 'D' else -float(ecriture.montant),
+        'sens': ecriture.sens,
+        'compte_final': ecriture.compte_final,
+        'libelle_final': ecriture.libelle_final,
+        'compte_contrepartie': compte,
+        'couverte_par_regle': ecriture.id in ecritures_couvertes
+    }
+
+
+def _ecritures_pour_collisions(ecritures):
+    """Toutes les écritures du FEC, réduites aux champs utiles à la vérification des collisions"""
+    toutes_ecritures = []
+    for ecriture in ecritures:
+        if hasattr(ecriture, 'compte_contrepartie') and ecriture.compte_contrepartie:
+            compte_contrepartie = ecriture.compte_contrepartie
+        else:
+            compte_contrepartie = "AUTRE"
+
+        toutes_ecritures.append({
+            'id': ecriture.id,
+            'ecriture_lib': ecriture.ecriture_lib,
+            'ecriture_lib_norm': ecriture.ecriture_lib_norm,
+            'journal_code': ecriture.journal_code,
+            'montant': float(ecriture.montant) if ecriture.sens == 'D' else -float(ecriture.montant),
+            'compte_contrepartie': compte_contrepartie
+        })
+    return toutes_ecritures
+
+
+def _parse_date_filtre(valeur):
+    """Date d'un filtre (AAAA-MM-JJ ou JJ/MM/AAAA), None si absente"""
+    from datetime import datetime
+
+    if not valeur:
+        return None
+    for format_date in ('%Y-%m-%d', '%d/%m/%Y'):
+        try:
+            return datetime.strptime(valeur, format_date).date()
+        except ValueError:
+            continue
+    raise ValueError(f'Date invalide : {valeur}')
+
+
+@api_bp.route('/societe/<int:societe_id>/ecritures')
+@lecture_seule
+def get_ecritures_paginees(societe_id):
+    """
+    Écritures du FEC actif par pages, filtrées et triées côté serveur
+
+    Paramètres : fec_id (FEC actif par défaut), compte, journal, date_debut, date_fin,
+    couverture (couvertes / non_couvertes), recherche (mots contenus dans le libellé),
+    tri (date, montant, libelle, id), ordre (asc / desc), limite et curseur (valeur
+    `curseur_suivant` de la page précédente).
+    """
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'error': 'Non connecté'}), 401
+
+    from app.services.pagination_ecritures import COLONNES_TRI, CurseurInvalide, page_ecritures
+    from app.utils.texte import normaliser_libelle
+
+    try:
+        societe = identite_cache.societe(societe_id)
+        if societe is None:
+            return jsonify({'success': False, 'error': 'Accès non autorisé'}), 403
+
+        fec_id = request.args.get('fec_id', type=int)
+        if fec_id:
+            fec_actif = FecFile.query.filter_by(id=fec_id, societe_id=societe_id).first()
+        else:
+            fec_actif = FecFile.query.filter_by(
+                societe_id=societe_id,
+                is_active=True
+            ).order_by(FecFile.date_import.desc()).first()
+
+        if not fec_actif:
+            return jsonify({'success': True, 'ecritures': [], 'curseur_suivant': None})
+
+        tri = request.args.get('tri', 'date')
+        ordre = request.args.get('ordre', 'asc')
+        if tri not in COLONNES_TRI or ordre not in ('asc', 'desc'):
+            return jsonify({'success': False, 'error': 'Tri invalide'}), 400
+
+        try:
+            filtres = {
+                'compte': request.args.get('compte'),
+                'journal': request.args.get('journal'),
+                'date_debut': _parse_date_filtre(request.args.get('date_debut')),
+                'date_fin': _parse_date_filtre(request.args.get('date_fin')),
+                'couverture': request.args.get('couverture')
+            }
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+
+        # Contreparties des lignes anciennes enregistrées avant de filtrer par compte en SQL
+        completer_contreparties_fec(fec_actif.id)
+
+        # Écritures couvertes par les règles actives (calculées une fois par jeu de règles)
+        regles_existantes = RegleAffectation.query.filter_by(societe_id=societe_id).all()
+        empreinte = coverage_cache.empreinte_regles(regles_existantes)
+
+        def calculer_couverture():
+            from app.services.regle_tester import RegleTester
+            ecritures = ecritures_lecture(fec_actif.id)
+            return frozenset(RegleTester().affecter_ecritures(regles_existantes, ecritures).ecritures_couvertes)
+
+        ecritures_couvertes = coverage_cache.get_or_compute(
+            societe_id, fec_actif.id, empreinte, 'ecritures-couvertes', calculer_couverture)
+
+        # Recherche : chaque mot doit apparaître dans le libellé normalisé (index des libellés du FEC)
+        identifiants = None
+        recherche = normaliser_libelle(request.args.get('recherche', ''))
+        if recherche:
+            index = index_libelles_cache.index_pour_fec(fec_actif.id)
+            for mot in recherche.split():
+                trouves = set(index.identifiants_contenant(mot))
+                identifiants = trouves if identifiants is None else identifiants & trouves
+
+        try:
+            ecritures, curseur_suivant = page_ecritures(
+                fec_actif.id, filtres, tri=tri, ordre=ordre,
+                curseur=request.args.get('curseur'),
+                limite=request.args.get('limite', 100, type=int),
+                ecritures_couvertes=ecritures_couvertes,
+                identifiants=identifiants
+            )
+        except CurseurInvalide as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+
         return jsonify({
             'success': True,
-            'ecritures': ecritures_json,
-            'comptes_statistiques': comptes_statistiques,
-            'journaux': journaux_json,
-            'automatisation_globale': automatisation_globale,
-            'fec_actif': {
-                'id': fec_actif.id,
-                'nom_original': fec_actif.nom_original,
-                'date_import': fec_actif.date_import.strftime('%d/%m/%Y %H:%M'),
-                'nb_lignes_bancaires': fec_actif.nb_lignes_bancaires
-            }
+            'ecritures': [{
+                'id': ecriture.id,
+                'ecriture_lib': ecriture.ecriture_lib,
+                'journal_code': ecriture.journal_code,
+                'journal_lib': ecriture.journal_lib,
+                'ecriture_date': ecriture.ecriture_date,
+                'ecriture_num': ecriture.ecriture_num,
+                'piece_ref': ecriture.piece_ref,
+                'montant': ecriture.montant if ecriture.sens == 'D' else -ecriture.montant,
+                'sens': ecriture.sens,
+                'compte_final': ecriture.compte_final,
+                'libelle_final': ecriture.libelle_final,
+                'compte_contrepartie': ecriture.compte_contrepartie,
+                'libelle_contrepartie': ecriture.libelle_contrepartie,
+                'couverte_par_regle': ecriture.id in ecritures_couvertes
+            } for ecriture in ecritures],
+            'curseur_suivant': curseur_suivant
         })
 
     except Exception as e:
-        print(f"Erreur API dashboard: {e}")
+        print(f"Erreur API écritures paginées: {e}")
         return jsonify({'success': False, 'error': 'Erreur interne du serveur'}), 500
 
 
 @api_bp.route('/groupements-intelligents', methods=['POST'])
+@lecture_seule
+@delai_requetes('DB_STATEMENT_TIMEOUT_ANALYSE_MS')
 def groupements_intelligents():
     """API pour récupérer les groupements intelligents d'un compte"""
     if 'user_id' not in session:
@@ -136,12 +430,14 @@ def groupements_intelligents():
         societe_id = data.get('societe_id')
         compte_selectionne = data.get('compte_selectionne')
         show_covered = data.get('show_covered', False)
+        # Budget de temps de la recherche (ms) : demandé par le client ou fixé par la configuration
+        budget_ms = data.get('budget_ms', current_app.config.get('SUGGESTION_BUDGET_MS', 0))
 
         print(f"🧠 API Groupements - Société: {societe_id}, Compte: {compte_selectionne}")
 
         # Vérifier l'accès à la société
-        societe = Societe.query.get_or_404(societe_id)
-        if societe.organization_id != session['organization_id']:
+        societe = identite_cache.societe(societe_id)
+        if societe is None:
             return jsonify({'success': False, 'error': 'Accès non autorisé'}), 403
 
         # Trouver le FEC actif pour cette société
@@ -154,75 +450,21 @@ def groupements_intelligents():
             return jsonify({'success': False, 'error': 'Aucun FEC actif'})
 
         # Récupérer toutes les écritures bancaires
-        ecritures = EcritureBancaire.query.filter_by(fec_file_id=fec_actif.id).all()
+        ecritures = ecritures_lecture(fec_actif.id)
         print(f"📊 Trouvé {len(ecritures)} écritures pour FEC {fec_actif.id}")
-
-        # Récupérer les règles pour déterminer la couverture
-        regles_existantes = RegleAffectation.query.filter_by(societe_id=societe_id).all()
-        from app.services.regle_tester import RegleTester
-        tester = RegleTester()
-
-        ecritures_couvertes = set()
-        for regle in regles_existantes:
-            if regle.is_active:
-                matches = tester.test_regle_object(regle, ecritures)
-                for match in matches:
-                    ecritures_couvertes.add(match.id)
+        empreinte = suggestion_cache.empreinte_corpus(ecritures)
 
         # Convertir en format dict et déterminer les comptes de contrepartie
         ecritures_data = []
         ecritures_pour_compte = 0
 
-        print(f"🔍 Recherche d'écritures pour le compte: '{compte_selectionne}'")
-        print(f"🔍 Total écritures à analyser: {len(ecritures)}")
-
-        debug_count = 0
-        for ecriture in ecritures:
-            # Essayer d'utiliser le champ compte_contrepartie s'il existe, sinon recalculer
-            if hasattr(ecriture, 'compte_contrepartie') and ecriture.compte_contrepartie:
-                compte_contrepartie = ecriture.compte_contrepartie
-                print(f"✅ Utilisation contrepartie sauvegardée: {compte_contrepartie}")
-            else:
-                # Fallback : recalculer la contrepartie
-                if not ecriture.compte_final.startswith('512'):
-                    compte_contrepartie = ecriture.compte_final
-                else:
-                    # Trouver la contrepartie (ligne non 512*)
-                    autres_ecritures = EcritureBancaire.query.filter_by(
-                        fec_file_id=fec_actif.id,
-                        ecriture_num=ecriture.ecriture_num
-                    ).filter(~EcritureBancaire.compte_num.startswith('512')).first()
-
-                    if autres_ecritures:
-                        compte_contrepartie = autres_ecritures.compte_final
-                    else:
-                        compte_contrepartie = "AUTRE"
-
-            # Debug : afficher quelques exemples
-            if debug_count < 10:
-                print(
-                    f"🔍 Écriture {ecriture.id}: compte_final={ecriture.compte_final}, contrepartie={compte_contrepartie}")
-                debug_count += 1
-
-            # Ne garder que les écritures pour le compte sélectionné
-            if compte_contrepartie == compte_selectionne:
-                ecriture_dict = {
-                    'id': ecriture.id,
-                    'ecriture_lib': ecriture.ecriture_lib,
-                    'journal_code': ecriture.journal_code,
-                    'journal_lib': ecriture.journal_lib,
-                    'ecriture_date': ecriture.ecriture_date.strftime('%d/%m/%Y'),
-                    'ecriture_num': ecriture.ecriture_num,
-                    'piece_ref': ecriture.piece_ref,
-                    'montant': float(ecriture.montant) if ecriture.sens == 'D' else -float(ecriture.montant),
-                    'sens': ecriture.sens,
-                    'compte_final': ecriture.compte_final,
-                    'libelle_final': ecriture.libelle_final,
-                    'compte_contrepartie': compte_contrepartie,
-                    'couverte_par_regle': ecriture.id in ecritures_couvertes
-                }
-                ecritures_data.append(ecriture_dict)
-                ecritures_pour_compte += 1
+        ecritures_compte = _ecritures_du_compte(fec_actif, ecritures, compte_selectionne)
+
+        ecritures_couvertes = _couverture_compte(societe_id, fec_actif, compte_selectionne, empreinte, ecritures_compte)
+
+        for ecriture in ecritures_compte:
+            ecritures_data.append(_ecriture_compte_dict(ecriture, compte_selectionne, ecritures_couvertes))
+            ecritures_pour_compte += 1
 
         print(f"📋 Préparé {len(ecritures_data)} écritures pour le compte {compte_selectionne}")
         print(f"📊 Écritures trouvées pour ce compte: {ecritures_pour_compte}")
@@ -231,37 +473,41 @@ def groupements_intelligents():
         print(f"📋 Création des groupements avec {len(ecritures_data)} écritures")
 
         groupements_compte = []
+        exhaustif = True
 
         if len(ecritures_data) > 0:
             try:
-                from app.services.rule_suggester import RuleSuggester
+                from app.services.rule_suggester import BudgetRecherche, RuleSuggester
 
                 print(f"🚀 AFFECTIA : Utilisation du système de suggestion de règles")
 
-                suggester = RuleSuggester(debug=True)
-
-                # Récupérer TOUTES les écritures pour la vérification des collisions
-                toutes_ecritures_compte = []
-                for ecriture in ecritures:
-                    if hasattr(ecriture, 'compte_contrepartie') and ecriture.compte_contrepartie:
-                        compte_contrepartie = ecriture.compte_contrepartie
-                    else:
-                        compte_contrepartie = "AUTRE"
-
-                    toutes_ecritures_compte.append({
-                        'id': ecriture.id,
-                        'ecriture_lib': ecriture.ecriture_lib,
-                        'journal_code': ecriture.journal_code,
-                        'montant': float(ecriture.montant) if ecriture.sens == 'D' else -float(ecriture.montant),
-                        'compte_contrepartie': compte_contrepartie
-                    })
-
-                # Suggérer des règles pour le compte sélectionné
-                suggested_rules = suggester.suggest_rules_for_account(
-                    compte_selectionne,
-                    ecritures_data,
-                    toutes_ecritures_compte
-                )
+                suggester = RuleSuggester(
+                    debug=True, taille_echantillon=current_app.config.get('SUGGESTION_ECHANTILLON', 0))
+
+                # Suggestions déjà calculées pour ce compte tant que les écritures du FEC sont inchangées
+                suggested_rules = suggestion_cache.suggestions(fec_actif.id, compte_selectionne, empreinte)
+
+                if suggested_rules is None:
+                    # Récupérer TOUTES les écritures pour la vérification des collisions
+                    toutes_ecritures_compte = _ecritures_pour_collisions(ecritures)
+
+                    # Suggérer des règles pour le compte sélectionné (dans le budget de temps éventuel)
+                    budget = BudgetRecherche(float(budget_ms) / 1000) if budget_ms else None
+                    suggested_rules = suggester.suggest_rules_for_account(
+                        compte_selectionne,
+                        ecritures_data,
+                        toutes_ecritures_compte,
+                        budget=budget
+                    )
+                    exhaustif = budget is None or budget.exhaustif
+                    # Un résultat partiel n'est pas mis en cache : la prochaine demande reprend la recherche
+                    if exhaustif:
+                        suggestion_cache.enregistrer_suggestions(
+                            societe_id, fec_actif.id, compte_selectionne, empreinte,
+                            suggested_rules, [ecriture.id for ecriture in ecritures_compte]
+                        )
+                else:
+                    print(f"♻️ AFFECTIA : Suggestions du compte {compte_selectionne} reprises du cache")
 
                 # Convertir les règles en format compatible avec l'interface
                 groupements_compte = []
@@ -276,7 +522,7 @@ def groupements_intelligents():
                     # Trouver les transactions correspondantes
                     matching_transactions = []
                     for trans in ecritures_data:
-                        libelle_norm = suggester.normalize_text(trans['ecriture_lib'])
+                        libelle_norm = suggester.libelle_norm(trans)
                         if all(part in libelle_norm for part in pattern_parts):
                             matching_transactions.append(trans)
 
@@ -335,6 +581,7 @@ def groupements_intelligents():
             'groupements': groupements_compte,
             'compte': compte_selectionne,
             'total_transactions_compte': ecritures_pour_compte,
+            'exhaustif': exhaustif,
             'debug_info': {
                 'ecritures_total': len(ecritures),
                 'ecritures_pour_compte': ecritures_pour_compte,
@@ -347,6 +594,276 @@ def groupements_intelligents():
         import traceback
         traceback.print_exc()
         return jsonify({'success': False, 'error': str(e)})
+
+
+def _ecritures_suggestion(fec_actif, ecritures_compte, mots_cles):
+    """Écritures du compte dont le libellé normalisé contient tous les mots-clés (via l'index du FEC)"""
+    index = index_libelles_cache.index_pour_fec(fec_actif.id)
+    identifiants = None
+    for mot_cle in mots_cles:
+        contenant = set(index.identifiants_contenant(mot_cle))
+        identifiants = contenant if identifiants is None else identifiants & contenant
+    if identifiants is None:
+        return list(ecritures_compte)
+    return [ecriture for ecriture in ecritures_compte if ecriture.id in identifiants]
+
+
+def _evenement_sse(evenement, donnees):
+    """Message Server-Sent Events (nom d'événement + données JSON)"""
+    return f"event: {evenement}\ndata: {current_app.json.dumps(donnees, ensure_ascii=False)}\n\n"
+
+
+@api_bp.route('/groupements-intelligents/flux')
+@lecture_seule
+def groupements_intelligents_flux():
+    """
+    Variante en flux (Server-Sent Events) des groupements intelligents d'un compte
+
+    Chaque règle suggérée est envoyée dès qu'elle est validée (événement `suggestion`), avec
+    son nombre de transactions et une référence paginée vers celles-ci au lieu de la liste
+    complète. Sans suggestions en cache, une première recherche bornée par
+    SUGGESTION_FLUX_PREMIER_MS fournit rapidement des règles, puis la recherche complète
+    envoie les règles supplémentaires ; l'événement `fin` donne l'ordre final des motifs.
+    """
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'error': 'Non connecté'}), 401
+
+    societe_id = request.args.get('societe_id', type=int)
+    compte_selectionne = request.args.get('compte_selectionne')
+    par_page = min(max(request.args.get('par_page', 50, type=int), 1), 500)
+
+    societe = identite_cache.societe(societe_id)
+    if societe is None:
+        return jsonify({'success': False, 'error': 'Accès non autorisé'}), 403
+
+    fec_actif = FecFile.query.filter_by(
+        societe_id=societe_id,
+        is_active=True
+    ).order_by(FecFile.date_import.desc()).first()
+
+    if not fec_actif:
+        return jsonify({'success': False, 'error': 'Aucun FEC actif'})
+
+    premier_ms = current_app.config.get('SUGGESTION_FLUX_PREMIER_MS', 0)
+    taille_echantillon = current_app.config.get('SUGGESTION_ECHANTILLON', 0)
+
+    def generer():
+        try:
+            from app.services.rule_suggester import BudgetRecherche, RuleSuggester
+
+            ecritures = ecritures_lecture(fec_actif.id)
+            empreinte = suggestion_cache.empreinte_corpus(ecritures)
+            ecritures_compte = _ecritures_du_compte(fec_actif, ecritures, compte_selectionne)
+            yield _evenement_sse('debut', {
+                'compte': compte_selectionne,
+                'total_transactions_compte': len(ecritures_compte)
+            })
+            if not ecritures_compte:
+                yield _evenement_sse('fin', {'patterns': [], 'nb_suggestions': 0, 'exhaustif': True})
+                return
+
+            ecritures_couvertes = _couverture_compte(
+                societe_id, fec_actif, compte_selectionne, empreinte, ecritures_compte)
+            envoyees = set()
+
+            def suggestions_a_envoyer(regles):
+                for rule in regles:
+                    pattern_parts = [rule['mot_cle_1']]
+                    if 'mot_cle_2' in rule:
+                        pattern_parts.append(rule['mot_cle_2'])
+                    pattern = ' & '.join(pattern_parts)
+                    if pattern in envoyees:
+                        continue
+                    envoyees.add(pattern)
+
+                    correspondantes = _ecritures_suggestion(fec_actif, ecritures_compte, pattern_parts)
+                    if not correspondantes:
+                        continue
+                    yield _evenement_sse('suggestion', {
+                        'type': 'rule_suggestion',
+                        'pattern': pattern,
+                        'count': len(correspondantes),
+                        'count_non_couvertes': sum(
+                            1 for ecriture in correspondantes if ecriture.id not in ecritures_couvertes),
+                        'transactions': {
+                            'url': url_for('api.groupements_intelligents_transactions', societe_id=societe_id,
+                                           compte_selectionne=compte_selectionne, mots_cles=pattern_parts,
+                                           par_page=par_page),
+                            'total': len(correspondantes),
+                            'par_page': par_page,
+                            'pages': -(-len(correspondantes) // par_page)
+                        },
+                        'rule_data': rule,
+                        'suggested_keywords': pattern_parts
+                    })
+
+            suggested_rules = suggestion_cache.suggestions(fec_actif.id, compte_selectionne, empreinte)
+            if suggested_rules is None:
+                suggester = RuleSuggester(taille_echantillon=taille_echantillon)
+                ecritures_data = [_ecriture_compte_dict(ecriture, compte_selectionne, ecritures_couvertes)
+                                  for ecriture in ecritures_compte]
+                toutes_ecritures = _ecritures_pour_collisions(ecritures)
+
+                # Première passe bornée dans le temps : règles disponibles en quelques centaines de ms
+                budget = BudgetRecherche(premier_ms / 1000) if premier_ms else None
+                suggested_rules = suggester.suggest_rules_for_account(
+                    compte_selectionne, ecritures_data, toutes_ecritures, budget=budget)
+                yield from suggestions_a_envoyer(suggested_rules)
+
+                # Recherche complète si la première passe n'a pas été exhaustive
+                if budget is not None and not budget.exhaustif:
+                    suggested_rules = suggester.suggest_rules_for_account(
+                        compte_selectionne, ecritures_data, toutes_ecritures)
+                suggestion_cache.enregistrer_suggestions(
+                    societe_id, fec_actif.id, compte_selectionne, empreinte,
+                    suggested_rules, [ecriture.id for ecriture in ecritures_compte]
+                )
+            yield from suggestions_a_envoyer(suggested_rules)
+
+            patterns = [' & '.join([rule['mot_cle_1']] + ([rule['mot_cle_2']] if 'mot_cle_2' in rule else []))
+                        for rule in suggested_rules]
+            yield _evenement_sse('fin', {'patterns': patterns, 'nb_suggestions': len(patterns), 'exhaustif': True})
+
+        except Exception as e:
+            print(f"❌ Erreur flux groupements intelligents: {e}")
+            import traceback
+            traceback.print_exc()
+            yield _evenement_sse('erreur', {'success': False, 'error': str(e)})
+
+    return Response(
+        stream_with_context(generer()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+@api_bp.route('/groupements-intelligents/transactions')
+@lecture_seule
+def groupements_intelligents_transactions():
+    """Page des transactions d'un compte correspondant aux mots-clés d'une règle suggérée"""
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'error': 'Non connecté'}), 401
+
+    try:
+        societe_id = request.args.get('societe_id', type=int)
+        compte_selectionne = request.args.get('compte_selectionne')
+        mots_cles = [mot for mot in request.args.getlist('mots_cles') if mot]
+        page = max(request.args.get('page', 1, type=int), 1)
+        par_page = min(max(request.args.get('par_page', 50, type=int), 1), 500)
+
+        societe = identite_cache.societe(societe_id)
+        if societe is None:
+            return jsonify({'success': False, 'error': 'Accès non autorisé'}), 403
+
+        fec_actif = FecFile.query.filter_by(
+            societe_id=societe_id,
+            is_active=True
+        ).order_by(FecFile.date_import.desc()).first()
+
+        if not fec_actif:
+            return jsonify({'success': False, 'error': 'Aucun FEC actif'})
+
+        ecritures = ecritures_lecture(fec_actif.id)
+        empreinte = suggestion_cache.empreinte_corpus(ecritures)
+        ecritures_compte = _ecritures_du_compte(fec_actif, ecritures, compte_selectionne)
+        correspondantes = _ecritures_suggestion(fec_actif, ecritures_compte, mots_cles)
+        ecritures_couvertes = _couverture_compte(
+            societe_id, fec_actif, compte_selectionne, empreinte, ecritures_compte)
+
+        debut = (page - 1) * par_page
+        return jsonify({
+            'success': True,
+            'transactions': [_ecriture_compte_dict(ecriture, compte_selectionne, ecritures_couvertes)
+                             for ecriture in correspondantes[debut:debut + par_page]],
+            'page': page,
+            'par_page': par_page,
+            'total': len(correspondantes),
+            'pages': -(-len(correspondantes) // par_page)
+        })
+
+    except Exception as e:
+        print(f"❌ Erreur transactions de suggestion: {e}")
+        return jsonify({'success': False, 'error': str(e)})
+
+
+@api_bp.route('/groupements-intelligents/tous', methods=['POST'])
+@lecture_seule
+@delai_requetes('DB_STATEMENT_TIMEOUT_ANALYSE_MS')
+def groupements_intelligents_tous():
+    """API pour suggérer des règles sur tous les comptes d'une société en une seule passe"""
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'error': 'Non connecté'}), 401
+
+    try:
+        data = request.get_json()
+        societe_id = data.get('societe_id')
+
+        # Vérifier l'accès à la société
+        societe = identite_cache.societe(societe_id)
+        if societe is None:
+            return jsonify({'success': False, 'error': 'Accès non autorisé'}), 403
+
+        fec_actif = FecFile.query.filter_by(
+            societe_id=societe_id,
+            is_active=True
+        ).order_by(FecFile.date_import.desc()).first()
+
+        if not fec_actif:
+            return jsonify({'success': False, 'error': 'Aucun FEC actif'})
+
+        ecritures = ecritures_lecture(fec_actif.id)
+
+        toutes_ecritures = [{
+            'id': ecriture.id,
+            'ecriture_lib': ecriture.ecriture_lib,
+            'ecriture_lib_norm': ecriture.ecriture_lib_norm,
+            'journal_code': ecriture.journal_code,
+            'montant': float(ecriture.montant) if ecriture.sens == 'D' else -float(ecriture.montant),
+            'compte_contrepartie': ecriture.compte_contrepartie or "AUTRE"
+        } for ecriture in ecritures]
+
+        comptes = sorted({e['compte_contrepartie'] for e in toutes_ecritures} - {"AUTRE"})
+
+        # Seuls les comptes sans suggestions en cache (ou dont le corpus a changé) sont analysés
+        empreinte = suggestion_cache.empreinte_corpus(ecritures)
+        suggestions = {}
+        for compte in comptes:
+            en_cache = suggestion_cache.suggestions(fec_actif.id, compte, empreinte)
+            if en_cache is not None:
+                suggestions[compte] = en_cache
+        comptes_a_analyser = [compte for compte in comptes if compte not in suggestions]
+
+        if comptes_a_analyser:
+            from app.services.rule_suggester import RuleSuggester
+            suggester = RuleSuggester(taille_echantillon=current_app.config.get('SUGGESTION_ECHANTILLON', 0))
+            nouvelles = suggester.suggest_rules_for_all_accounts(
+                toutes_ecritures,
+                comptes=comptes_a_analyser,
+                workers=current_app.config.get('SUGGESTION_WORKERS', 0)
+            )
+            ids_par_compte = {}
+            for e in toutes_ecritures:
+                ids_par_compte.setdefault(e['compte_contrepartie'], []).append(e['id'])
+            for compte, regles in nouvelles.items():
+                suggestion_cache.enregistrer_suggestions(
+                    societe_id, fec_actif.id, compte, empreinte, regles, ids_par_compte.get(compte, [])
+                )
+            suggestions.update(nouvelles)
+        suggestions = {compte: suggestions[compte] for compte in comptes}
+
+        return jsonify({
+            'success': True,
+            'suggestions': suggestions,
+            'comptes_analyses': len(comptes_a_analyser),
+            'comptes_en_cache': len(comptes) - len(comptes_a_analyser),
+            'nb_regles': sum(len(regles) for regles in suggestions.values())
+        })
+
+    except Exception as e:
+        print(f"❌ Erreur suggestions tous comptes: {e}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({'success': False, 'error': str(e)})
     
 @api_bp.route('/societes', methods=['POST'])
 def create_societe():
@@ -379,6 +896,8 @@ def create_societe():
         
         db.session.add(nouvelle_societe)
         db.session.commit()
+        identite_cache.invalider_organisation(organization_id)
+        noter_ecriture_utilisateur()
 
         return jsonify({
             'success': True, 
@@ -394,7 +913,22 @@ def create_societe():
         print(f"Erreur création société: {e}")
         return jsonify({'success': False, 'error': 'Erreur interne du serveur'}), 500
     
+@api_bp.route('/metriques/pool')
+def get_metriques_pool():
+    """API des métriques du pool de connexions (taille, connexions utilisées, temps d'attente), réservée aux administrateurs"""
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'error': 'Non connecté'}), 401
+
+    utilisateur = identite_cache.utilisateur()
+    if utilisateur is None or not utilisateur.is_admin_org:
+        return jsonify({'success': False, 'error': 'Accès non autorisé'}), 403
+
+    return jsonify({'success': True, 'metriques': metriques_pool()})
+
+
 @api_bp.route('/societe/<int:societe_id>/statistiques')
+@lecture_seule
+@delai_requetes('DB_STATEMENT_TIMEOUT_ANALYSE_MS')
 def get_societe_statistiques(societe_id):
     """API pour récupérer les statistiques d'une société (automatisation + collisions)"""
     if 'user_id' not in session:
@@ -402,8 +936,8 @@ def get_societe_statistiques(societe_id):
 
     try:
         # Vérifier que l'utilisateur a accès à cette société
-        societe = Societe.query.get_or_404(societe_id)
-        if societe.organization_id != session['organization_id']:
+        societe = identite_cache.societe(societe_id)
+        if societe is None:
             return jsonify({'success': False, 'error': 'Accès non autorisé'}), 403
 
         # Récupérer le FEC le plus récent et actif
@@ -420,27 +954,31 @@ def get_societe_statistiques(societe_id):
                 'dernier_import': None
             })
 
-        # Récupérer les écritures bancaires
-        ecritures = EcritureBancaire.query.filter_by(fec_file_id=fec_actif.id).all()
-        
         # Récupérer les règles existantes
-        regles_existantes = RegleAffectation.query.filter_by(
-            societe_id=societe_id,
-            is_active=True
-        ).all()
+        regles_existantes = RegleAffectation.query.filter_by(societe_id=societe_id).all()
+        empreinte = coverage_cache.empreinte_regles(regles_existantes)
+        etag = coverage_cache.etag(fec_actif.id, empreinte, 'statistiques')
+
+        non_modifiee = requete_non_modifiee(etag)
+        if non_modifiee:
+            return non_modifiee
+
+        def calculer_statistiques():
+            # Mêmes calculs (et même passe sur les règles) que l'instantané du dashboard
+            instantane = _construire_dashboard_data(
+                fec_actif, regles_existantes, ('automatisation_globale', 'collisions')
+            )
+            return {
+                'success': True,
+                'automatisation': instantane['automatisation_globale'],
+                'collisions': instantane['collisions'],
+                'dernier_import': fec_actif.date_import.isoformat() if fec_actif else None
+            }
 
-        # Calculer l'automatisation globale
-        automatisation = calculer_automatisation_globale(ecritures, regles_existantes)
-        
-        # Calculer les collisions
-        collisions_totales = calculer_collisions_totales(regles_existantes, ecritures)
-        
-        return jsonify({
-            'success': True,
-            'automatisation': round(automatisation, 1),
-            'collisions': collisions_totales,
-            'dernier_import': fec_actif.date_import.isoformat() if fec_actif else None
-        })
+        payload = coverage_cache.get_or_compute(
+            societe_id, fec_actif.id, empreinte, 'statistiques', calculer_statistiques
+        )
+        return reponse_json_avec_etag(payload, etag)
 
     except Exception as e:
         print(f"Erreur API statistiques société {societe_id}: {e}")
@@ -448,67 +986,31 @@ def get_societe_statistiques(societe_id):
 
 
 
-def calculer_automatisation_globale(ecritures, regles_existantes):
+def calculer_automatisation_globale(ecritures, regles_existantes, affectation=None):
     """Calcule le pourcentage d'automatisation global"""
     if not ecritures:
         return 0
-    
-    from app.services.regle_tester import RegleTester
-    tester = RegleTester()
-    
-    ecritures_couvertes = set()
-    
-    for regle in regles_existantes:
-        if regle.is_active:
-            matches = tester.test_regle_object(regle, ecritures)
-            for match in matches:
-                ecritures_couvertes.add(match.id)
-    
+
+    if affectation is None:
+        from app.services.regle_tester import RegleTester
+        affectation = RegleTester().affecter_ecritures(regles_existantes, ecritures)
+
     total_ecritures = len(ecritures)
-    ecritures_automatisees = len(ecritures_couvertes)
-    
+    ecritures_automatisees = len(affectation.affectations)
+
     return (ecritures_automatisees / total_ecritures * 100) if total_ecritures > 0 else 0
 
 
-def calculer_collisions_totales(regles_existantes, ecritures):
-    """Calcule le nombre total de collisions entre toutes les règles actives"""
+def calculer_collisions_totales(regles_existantes, ecritures, affectation=None):
+    """
+    Calcule le nombre de collisions entre règles actives : écritures couvertes
+    par plusieurs règles qui ne visent pas le même compte de destination
+    """
     if not regles_existantes or len(regles_existantes) < 2:
         return 0
-    
-    from app.services.regle_tester import RegleTester
-    tester = RegleTester()
-    
-    # Grouper les écritures par compte pour chaque règle
-    regles_matches = {}
-    
-    for regle in regles_existantes:
-        if regle.is_active:
-            matches = tester.test_regle_object(regle, ecritures)
-            regles_matches[regle.id] = {}
-            
-            for match in matches:
-                compte = match.compte_contrepartie
-                if compte not in regles_matches[regle.id]:
-                    regles_matches[regle.id][compte] = []
-                regles_matches[regle.id][compte].append(match)
-    
-    # Détecter les collisions : même compte touché par plusieurs règles
-    comptes_avec_collisions = {}
-    
-    for regle_id, comptes_matches in regles_matches.items():
-        for compte, matches in comptes_matches.items():
-            if compte not in comptes_avec_collisions:
-                comptes_avec_collisions[compte] = []
-            comptes_avec_collisions[compte].append({
-                'regle_id': regle_id,
-                'nb_matches': len(matches)
-            })
-    
-    # Compter les collisions : comptes touchés par plus d'une règle
-    nb_collisions = 0
-    for compte, regles_impliquees in comptes_avec_collisions.items():
-        if len(regles_impliquees) > 1:
-            # Une collision = le nombre total de transactions en conflit
-            nb_collisions += sum(r['nb_matches'] for r in regles_impliquees)
-    
-    return nb_collisions
\ No newline at end of file
+
+    if affectation is None:
+        from app.services.regle_tester import RegleTester
+        affectation = RegleTester().affecter_ecritures(regles_existantes, ecritures)
+
+    return len(affectation.conflits)
@@ -4,6 +4,9 @@ import os
 from app.models import db
 from app.models.societe import Societe
 from app.models.fec_file import FecFile
+from app.services.coverage_cache import coverage_cache
+from app.services.identite import identite_cache
+from app.utils.routage_lecture import lecture_seule, noter_ecriture_utilisateur
 
 # Blueprint pour les routes d'import FEC
 fec_bp = Blueprint('fec', __name__)
@@ -128,6 +131,10 @@ def upload_fec():
         if result['success']:
             print("✅ Traitement réussi, commit en cours...")
             db.session.commit()
+            coverage_cache.invalidate_societe(societe.id)
+            # La société a pu être créée par cet import
+            identite_cache.invalider_organisation(organization_id)
+            noter_ecriture_utilisateur()
             print("✅ Commit terminé")
             flash(
                 f'✅ Import réussi ! {result["stats"]["nb_lignes_bancaires"]} écritures bancaires extraites sur {result["stats"]["nb_lignes_total"]} lignes.',
@@ -159,6 +166,7 @@ def upload_fec():
 
 
 @fec_bp.route('/fec/<int:fec_id>')
+@lecture_seule
 def view_fec(fec_id):
     """Visualisation d'un fichier FEC importé"""
     if 'user_id' not in session:
@@ -168,9 +176,8 @@ def view_fec(fec_id):
     fec_file = FecFile.query.get_or_404(fec_id)
 
     # Vérifier que l'utilisateur a accès à ce FEC (même organisation)
-    from app.models.societe import Societe
-    societe = Societe.query.get(fec_file.societe_id)
-    if societe.organization_id != session['organization_id']:
+    societe = identite_cache.societe(fec_file.societe_id)
+    if societe is None:
         flash('Accès non autorisé', 'error')
         return redirect(url_for('dashboard'))
 
@@ -5,10 +5,20 @@ from app.models.fec_file import FecFile
 from app.models.ecriture_bancaire import EcritureBancaire
 from app.models.regle_affectation import RegleAffectation
 from app.models.societe import Societe
+from app.services.compte_stats import mettre_a_jour_couverture, statistiques_comptes_fec
+from app.services.contreparties import completer_contreparties_fec
+from app.services.coverage_cache import coverage_cache
+from app.services.identite import identite_cache
+from app.services.lecture_ecritures import ecritures_lecture
+from app.services.suggestion_cache import suggestion_cache
+from app.utils.routage_lecture import noter_ecriture_utilisateur
 
 # Blueprint pour les routes de règles
 regles_bp = Blueprint('regles', __name__)
 
+# Nombre maximum de règles candidates testées par appel batch
+MAX_REGLES_BATCH = 50
+
 @regles_bp.route('/regles/nouvelle')
 def nouvelle_regle():
     """Page de création d'une nouvelle règle avec interface avancée"""
@@ -16,7 +26,7 @@ def nouvelle_regle():
         return redirect(url_for('auth.login'))
 
     fec_id = request.args.get('fec_id')
-    societe_id = request.args.get('societe_id')
+    societe_id = request.args.get('societe_id', type=int)
 
     if not fec_id:
         flash('ID du fichier FEC manquant', 'error')
@@ -25,87 +35,20 @@ def nouvelle_regle():
     # Récupérer le fichier FEC
     fec_file = FecFile.query.get_or_404(fec_id)
 
-    # Déterminer la société
-    if societe_id:
-        societe = Societe.query.get_or_404(societe_id)
-    else:
-        societe = Societe.query.get(fec_file.societe_id)
-
-    # Vérifier que l'utilisateur a accès (même organisation)
-    if societe.organization_id != session['organization_id']:
+    # Déterminer la société, parmi celles de l'organisation de l'utilisateur (accès vérifié)
+    societe = identite_cache.societe(societe_id or fec_file.societe_id)
+    if societe is None:
         flash('Accès non autorisé', 'error')
         return redirect(url_for('dashboard'))
 
     # Récupérer toutes les sociétés de l'organisation pour le sélecteur
-    societes = Societe.query.filter_by(organization_id=session['organization_id']).all()
-
-    # Récupérer les écritures bancaires pour la société
-    ecritures = EcritureBancaire.query.filter_by(fec_file_id=fec_id).all()
+    societes = identite_cache.societes()
 
     # Récupérer les règles existantes pour détecter les collisions
     regles_existantes = RegleAffectation.query.filter_by(societe_id=societe.id).all()
 
-    # Calculer les statistiques par compte de contrepartie
-    comptes_statistiques = calculer_statistiques_comptes(ecritures, regles_existantes)
-
-    # Calculer l'automatisation globale
-    automatisation_globale = calculer_automatisation_globale(ecritures, regles_existantes)
-
-    # Préparer les écritures pour JavaScript avec info de couverture
-    ecritures_json = []
-    ecritures_couvertes = set()
-
-    # Identifier les écritures couvertes par les règles existantes
-    from app.services.regle_tester import RegleTester
-    tester = RegleTester()
-
-    for regle in regles_existantes:
-        if regle.is_active:
-            matches = tester.test_regle_object(regle, ecritures)
-            for match in matches:
-                ecritures_couvertes.add(match.id)
-
-    for ecriture in ecritures:
-        # Calculer le compte de contrepartie (tous les comptes sauf 512*)
-        compte_contrepartie = None
-        libelle_contrepartie = None
-
-        # Dans le FEC, on doit chercher les autres lignes de la même écriture
-        # Pour simplifier, on prend le compte_final si ce n'est pas un 512*
-        if not ecriture.compte_final.startswith('512'):
-            compte_contrepartie = ecriture.compte_final
-            libelle_contrepartie = ecriture.libelle_final
-        else:
-            # Logique plus complexe pour trouver la contrepartie
-            # Pour l'instant, on utilise une logique simplifiée
-            autres_ecritures = EcritureBancaire.query.filter_by(
-                fec_file_id=fec_id,
-                ecriture_num=ecriture.ecriture_num
-            ).filter(~EcritureBancaire.compte_num.startswith('512')).first()
-
-            if autres_ecritures:
-                compte_contrepartie = autres_ecritures.compte_final
-                libelle_contrepartie = autres_ecritures.libelle_final
-            else:
-                compte_contrepartie = "AUTRE"
-                libelle_contrepartie = "Compte non identifié"
-
-        ecritures_json.append({
-            'id': ecriture.id,
-            'ecriture_lib': ecriture.ecriture_lib,
-            'journal_code': ecriture.journal_code,
-            'journal_lib': ecriture.journal_lib,
-            'ecriture_date': ecriture.ecriture_date.strftime('%d/%m/%Y'),
-            'ecriture_num': ecriture.ecriture_num,
-            'piece_ref': ecriture.piece_ref,
-            'montant': float(ecriture.montant) if ecriture.sens == 'D' else -float(ecriture.montant),
-            'sens': ecriture.sens,
-            'compte_final': ecriture.compte_final,
-            'libelle_final': ecriture.libelle_final,
-            'compte_contrepartie': compte_contrepartie,
-            'libelle_contrepartie': libelle_contrepartie,
-            'couverte_par_regle': ecriture.id in ecritures_couvertes
-        })
+    # Statistiques par compte de contrepartie et automatisation globale (agrégats précalculés)
+    comptes_statistiques, automatisation_globale = statistiques_comptes_fec(fec_file.id, regles_existantes)
 
     # Récupérer la liste des journaux
     journaux = db.session.query(
@@ -122,14 +65,14 @@ def nouvelle_regle():
             'mots_cles': regle.mots_cles,
             'journal_code': regle.journal_code,
             'criteres_montant': regle.criteres_montant,
-            'compte_destination': regle.compte_destination
+            'compte_destination': regle.compte_destination,
+            'priorite': regle.priorite
         })
 
     return render_template('create_regle.html',
                            fec_file=fec_file,
                            societe=societe,
                            societes=societes,
-                           ecritures_json=json.dumps(ecritures_json),
                            regles_existantes=json.dumps(regles_json),
                            journaux=journaux,
                            comptes_statistiques=comptes_statistiques,
@@ -155,8 +98,8 @@ def create_regle():
         if not fec_file:
             return jsonify({'success': False, 'error': 'Fichier FEC introuvable'})
 
-        societe = Societe.query.get(fec_file.societe_id)
-        if societe.organization_id != session['organization_id']:
+        societe = identite_cache.societe(fec_file.societe_id)
+        if societe is None:
             return jsonify({'success': False, 'error': 'Accès non autorisé'})
 
         # Vérifier qu'une règle avec ce nom n'existe pas déjà
@@ -187,6 +130,7 @@ def create_regle():
             journal_code=data.get('journal_code'),
             compte_destination=data['compte_destination'],
             libelle_destination=data['libelle_destination'],
+            priorite=int(data.get('priorite') or 0),
             nb_transactions_couvertes=nb_transactions_couvertes,
             pourcentage_couverture_total=round(pourcentage_couverture_total, 2),
             societe_id=societe.id
@@ -194,6 +138,10 @@ def create_regle():
 
         db.session.add(regle)
         db.session.commit()
+        coverage_cache.invalidate_societe(societe.id)
+        suggestion_cache.invalider_regles(societe.id, [(regle.id, regle.mots_cles)])
+        mettre_a_jour_couverture(societe.id, [(regle.id, regle.mots_cles)])
+        noter_ecriture_utilisateur()
 
         return jsonify({
             'success': True,
@@ -228,8 +176,8 @@ def liste_regles():
         # Société spécifiée dans l'URL
         try:
             societe_id = int(societe_id)
-            societe_active = Societe.query.get_or_404(societe_id)
-            if societe_active.organization_id != session['organization_id']:
+            societe_active = identite_cache.societe(societe_id)
+            if societe_active is None:
                 flash('Accès non autorisé', 'error')
                 return redirect(url_for('dashboard'))
         except (ValueError, TypeError):
@@ -238,7 +186,7 @@ def liste_regles():
     else:
         # Pas de société spécifiée - prendre la première société de l'organisation
         print("🔍 DEBUG Liste règles - Aucune société spécifiée, recherche de la première...")
-        societe_active = Societe.query.filter_by(organization_id=session['organization_id']).first()
+        societe_active = identite_cache.premiere_societe()
         if not societe_active:
             flash('Aucune société trouvée', 'error')
             return redirect(url_for('dashboard'))
@@ -267,8 +215,8 @@ def liste_regles():
         # Société spécifiée dans l'URL
         try:
             societe_id = int(societe_id)
-            societe_active = Societe.query.get_or_404(societe_id)
-            if societe_active.organization_id != session['organization_id']:
+            societe_active = identite_cache.societe(societe_id)
+            if societe_active is None:
                 flash('Accès non autorisé', 'error')
                 return redirect(url_for('dashboard'))
         except (ValueError, TypeError):
@@ -276,7 +224,7 @@ def liste_regles():
             return redirect(url_for('dashboard'))
     else:
         # Prendre la première société de l'organisation
-        societe_active = Societe.query.filter_by(organization_id=session['organization_id']).first()
+        societe_active = identite_cache.premiere_societe()
         if not societe_active:
             flash('Aucune société trouvée', 'error')
             return redirect(url_for('dashboard'))
@@ -289,7 +237,7 @@ def liste_regles():
     ).order_by(FecFile.date_import.desc()).first()
 
     # Récupérer toutes les sociétés pour le dropdown
-    societes = Societe.query.filter_by(organization_id=session['organization_id']).all()
+    societes = identite_cache.societes()
 
     # Récupérer les règles pour cette société
     regles = RegleAffectation.query.filter_by(societe_id=societe_id).all()
@@ -299,17 +247,14 @@ def liste_regles():
     comptes_statistiques = []
     journaux = []
     automatisation_globale = 0
-    ecritures_json = []
 
     if fec_file:
-        # Récupérer les écritures bancaires
-        ecritures = EcritureBancaire.query.filter_by(fec_file_id=fec_file.id).all()
+        # Contreparties des lignes anciennes enregistrées une fois, puis écritures en lecture seule
+        completer_contreparties_fec(fec_file.id)
+        ecritures = ecritures_lecture(fec_file.id)
 
-        # Calculer les statistiques par compte
-        comptes_statistiques = calculer_statistiques_comptes(ecritures, regles)
-
-        # Calculer l'automatisation globale
-        automatisation_globale = calculer_automatisation_globale(ecritures, regles)
+        # Statistiques par compte et automatisation globale (agrégats précalculés)
+        comptes_statistiques, automatisation_globale = statistiques_comptes_fec(fec_file.id, regles)
 
         # Récupérer les journaux
         journaux_query = db.session.query(
@@ -319,65 +264,14 @@ def liste_regles():
 
         journaux = [{'journal_code': j.journal_code, 'journal_lib': j.journal_lib} for j in journaux_query]
 
-        # Préparer les écritures pour JavaScript (comme dans le dashboard)
-        from app.services.regle_tester import RegleTester
-        tester = RegleTester()
-        ecritures_couvertes = set()
-
-        for regle in regles:
-            if regle.is_active:
-                matches = tester.test_regle_object(regle, ecritures)
-                for match in matches:
-                    ecritures_couvertes.add(match.id)
-
-        for ecriture in ecritures:
-            # Calculer le compte de contrepartie
-            compte_contrepartie = None
-            libelle_contrepartie = None
-
-            if hasattr(ecriture, 'compte_contrepartie') and ecriture.compte_contrepartie:
-                compte_contrepartie = ecriture.compte_contrepartie
-                libelle_contrepartie = ecriture.libelle_contrepartie
-            elif not ecriture.compte_final.startswith('512'):
-                compte_contrepartie = ecriture.compte_final
-                libelle_contrepartie = ecriture.libelle_final
-            else:
-                # Trouver la contrepartie dans la même écriture
-                autres_ecritures = EcritureBancaire.query.filter_by(
-                    fec_file_id=fec_file.id,
-                    ecriture_num=ecriture.ecriture_num
-                ).filter(~EcritureBancaire.compte_num.startswith('512')).first()
-
-                if autres_ecritures:
-                    compte_contrepartie = autres_ecritures.compte_final
-                    libelle_contrepartie = autres_ecritures.libelle_final
-                else:
-                    compte_contrepartie = "AUTRE"
-                    libelle_contrepartie = "Compte non identifié"
-
-            ecritures_json.append({
-                'id': ecriture.id,
-                'ecriture_lib': ecriture.ecriture_lib,
-                'journal_code': ecriture.journal_code,
-                'journal_lib': ecriture.journal_lib,
-                'ecriture_date': ecriture.ecriture_date.strftime('%d/%m/%Y'),
-                'ecriture_num': ecriture.ecriture_num,
-                'piece_ref': ecriture.piece_ref,
-                'montant': float(ecriture.montant) if ecriture.sens == 'D' else -float(ecriture.montant),
-                'sens': ecriture.sens,
-                'compte_final': ecriture.compte_final,
-                'libelle_final': ecriture.libelle_final,
-                'compte_contrepartie': compte_contrepartie,
-                'libelle_contrepartie': libelle_contrepartie,
-                'couverte_par_regle': ecriture.id in ecritures_couvertes
-            })
-
         # CALCULS RÉELS : Impact et Collision pour chaque règle
         regles_json = []
 
         # Import du tester une seule fois
         from app.services.regle_tester import RegleTester
         tester = RegleTester()
+        # Compte de contrepartie de chaque écriture et total par compte, calculés une seule fois
+        index_comptes = tester.index_comptes(ecritures)
 
         for regle in regles:
             print(f"🔍 Calcul pour règle: {regle.nom}")
@@ -420,25 +314,8 @@ def liste_regles():
                         matches_autres_comptes = []
 
                         for ecriture in ecritures_matchees:
-                            # Déterminer le compte de contrepartie
-                            if hasattr(ecriture, 'compte_contrepartie') and ecriture.compte_contrepartie:
-                                compte_contrepartie = ecriture.compte_contrepartie
-                            elif not ecriture.compte_final.startswith('512'):
-                                compte_contrepartie = ecriture.compte_final
-                            else:
-                                # Logique pour trouver la contrepartie
-                                autres_ecritures = EcritureBancaire.query.filter_by(
-                                    fec_file_id=fec_file.id,
-                                    ecriture_num=ecriture.ecriture_num
-                                ).filter(~EcritureBancaire.compte_num.startswith('512')).first()
-
-                                if autres_ecritures:
-                                    compte_contrepartie = autres_ecritures.compte_final
-                                else:
-                                    compte_contrepartie = "AUTRE"
-
-                            # Classer l'écriture
-                            if compte_contrepartie == regle.compte_destination:
+                            # Classer l'écriture selon son compte de contrepartie
+                            if index_comptes.compte_de(ecriture) == regle.compte_destination:
                                 matches_compte_regle.append(ecriture)
                             else:
                                 matches_autres_comptes.append(ecriture)
@@ -448,11 +325,7 @@ def liste_regles():
 
                         # CALCUL DE L'IMPACT
                         # Impact = (matches dans le compte / total transactions du compte) × 100
-                        total_transactions_compte = len([e for e in ecritures
-                                                         if (hasattr(e,
-                                                                     'compte_contrepartie') and e.compte_contrepartie == regle.compte_destination)
-                                                         or (not e.compte_final.startswith(
-                                '512') and e.compte_final == regle.compte_destination)])
+                        total_transactions_compte = index_comptes.total(regle.compte_destination)
 
                         if total_transactions_compte > 0:
                             impact_reel = (len(matches_compte_regle) / total_transactions_compte) * 100
@@ -497,6 +370,7 @@ def liste_regles():
                 'collision': round(collision_reelle, 1),  # VRAI calcul
                 'nb_transactions': nb_transactions_reel,  # VRAI nombre
                 'nb_collisions': nb_collisions_reel,  # VRAI nombre
+                'priorite': regle.priorite,
                 'active': bool(regle.is_active),
                 'created_at': regle.created_at.isoformat() if regle.created_at else ''
             }
@@ -534,14 +408,14 @@ def liste_regles():
 
     # Déterminer la société active pour la header_bar
     if fec_file:
-        societe_active = Societe.query.get(fec_file.societe_id)
+        societe_active = identite_cache.societe(fec_file.societe_id)
     else:
         # Prendre la première société de l'organisation
-        societe_active = Societe.query.filter_by(organization_id=session['organization_id']).first()
+        societe_active = identite_cache.premiere_societe()
 
     # Récupérer toutes les sociétés pour le dropdown de la header_bar
     if 'societes' not in locals():
-        societes = Societe.query.filter_by(organization_id=session['organization_id']).all()
+        societes = identite_cache.societes()
 
     return render_template('liste_regles.html',
                            regles=regles,
@@ -550,7 +424,6 @@ def liste_regles():
                            regles_json=regles_json_string,
                            societe=societe_active,
                            societes=societes,
-                           ecritures_json=json.dumps(ecritures_json),
                            comptes_statistiques=comptes_statistiques,
                            journaux=journaux,
                            automatisation_globale=automatisation_globale,
@@ -570,8 +443,8 @@ def delete_regle(regle_id):
             return jsonify({'success': False, 'error': 'Règle introuvable'}), 404
 
         # Vérifier les permissions strictement
-        societe = Societe.query.get(regle.societe_id)
-        if not societe or societe.organization_id != session['organization_id']:
+        societe = identite_cache.societe(regle.societe_id)
+        if societe is None:
             return jsonify({'success': False, 'error': 'Accès non autorisé'}), 403
 
         # Log pour debug
@@ -579,8 +452,13 @@ def delete_regle(regle_id):
         print(f"🗑️ DEBUG Suppression - Société: {societe.nom} (ID: {societe.id})")
 
         # Suppression effective
+        regle_supprimee = (regle.id, list(regle.mots_cles or []))
         db.session.delete(regle)
         db.session.commit()
+        coverage_cache.invalidate_societe(societe.id)
+        suggestion_cache.invalider_regles(societe.id, [regle_supprimee])
+        mettre_a_jour_couverture(societe.id, [regle_supprimee])
+        noter_ecriture_utilisateur()
 
         print(f"✅ DEBUG Suppression - Règle {regle_id} supprimée avec succès")
         return jsonify({'success': True, 'message': 'Règle supprimée avec succès'})
@@ -606,13 +484,17 @@ def toggle_regle_active(regle_id):
             return jsonify({'success': False, 'error': 'Règle introuvable'}), 404
 
         # Vérifier les permissions
-        societe = Societe.query.get(regle.societe_id)
-        if not societe or societe.organization_id != session['organization_id']:
+        societe = identite_cache.societe(regle.societe_id)
+        if societe is None:
             return jsonify({'success': False, 'error': 'Accès non autorisé'}), 403
 
         # Inverser le statut
         regle.is_active = not regle.is_active
         db.session.commit()
+        coverage_cache.invalidate_societe(societe.id)
+        suggestion_cache.invalider_regles(societe.id, [(regle.id, regle.mots_cles)])
+        mettre_a_jour_couverture(societe.id, [(regle.id, regle.mots_cles)])
+        noter_ecriture_utilisateur()
 
         print(f"🔄 Règle {regle_id} {'activée' if regle.is_active else 'désactivée'}")
 
@@ -628,138 +510,6 @@ def toggle_regle_active(regle_id):
         return jsonify({'success': False, 'error': 'Erreur interne du serveur'}), 500
 
 
-# CORRECTION MAJEURE : Fonction de calcul des statistiques comptes
-def calculer_statistiques_comptes(ecritures, regles_existantes):
-    """Calcule les statistiques par compte de contrepartie - VERSION CORRIGÉE"""
-    from collections import defaultdict
-    from app.services.regle_tester import RegleTester
-
-    print(f"📊 DEBUG Stats - Début calcul avec {len(ecritures)} écritures et {len(regles_existantes)} règles")
-
-    tester = RegleTester()
-
-    # Grouper par compte de contrepartie
-    comptes_stats = defaultdict(lambda: {
-        'compte': '',
-        'libelle': '',
-        'nb_transactions': 0,
-        'transactions': [],
-        'pourcentage_total': 0,
-        'pourcentage_traite': 0,
-        'pourcentage_a_faire': 0
-    })
-
-    total_ecritures = len(ecritures)
-    if total_ecritures == 0:
-        return []
-
-    # Identifier TOUTES les écritures couvertes par TOUTES les règles actives
-    ecritures_couvertes_globales = set()
-    for regle in regles_existantes:
-        if regle.is_active:
-            try:
-                matches = tester.test_regle_object(regle, ecritures)
-                for match in matches:
-                    ecritures_couvertes_globales.add(match.id)
-                print(f"📋 Règle '{regle.nom}' couvre {len(matches)} écritures")
-            except Exception as e:
-                print(f"❌ Erreur test règle {regle.nom}: {e}")
-
-    print(f"🎯 Total écritures couvertes: {len(ecritures_couvertes_globales)}/{total_ecritures}")
-
-    # Analyser chaque écriture
-    for ecriture in ecritures:
-        # Utiliser les champs compte_contrepartie et libelle_contrepartie
-        if hasattr(ecriture, 'compte_contrepartie') and ecriture.compte_contrepartie:
-            compte_contrepartie = ecriture.compte_contrepartie
-            libelle_contrepartie = ecriture.libelle_contrepartie or "Libellé non défini"
-        else:
-            # Fallback vers l'ancienne logique
-            if not ecriture.compte_final.startswith('512'):
-                compte_contrepartie = ecriture.compte_final
-                libelle_contrepartie = ecriture.libelle_final
-            else:
-                continue  # Ignorer les comptes 512
-
-        comptes_stats[compte_contrepartie]['compte'] = compte_contrepartie
-        comptes_stats[compte_contrepartie]['libelle'] = libelle_contrepartie
-        comptes_stats[compte_contrepartie]['nb_transactions'] += 1
-        comptes_stats[compte_contrepartie]['transactions'].append(ecriture)
-
-    # Fonction pour formater les pourcentages avec précision adaptative
-    def format_pourcentage_precis(valeur):
-        if valeur == 0:
-            return 0
-        elif valeur < 0.1:
-            return round(valeur, 2)
-        else:
-            return round(valeur, 1)
-
-    # Calculer les pourcentages POUR CHAQUE COMPTE
-    result = []
-    for compte, stats in comptes_stats.items():
-        nb_transactions = stats['nb_transactions']
-
-        # % total = part de ce compte dans toutes les écritures
-        pourcentage_total_brut = (nb_transactions / total_ecritures * 100) if total_ecritures > 0 else 0
-
-        # % traité = écritures de ce compte qui sont couvertes par des règles
-        ecritures_compte_couvertes = [t for t in stats['transactions'] if t.id in ecritures_couvertes_globales]
-        nb_couvertes = len(ecritures_compte_couvertes)
-        pourcentage_traite_brut = (nb_couvertes / nb_transactions * 100) if nb_transactions > 0 else 0
-
-        # % à faire = 100% - % traité pour ce compte spécifiquement
-        pourcentage_a_faire_brut = 100 - pourcentage_traite_brut
-
-        # Appliquer le formatage précis
-        pourcentage_total = format_pourcentage_precis(pourcentage_total_brut)
-        pourcentage_traite = format_pourcentage_precis(pourcentage_traite_brut)
-        pourcentage_a_faire = format_pourcentage_precis(max(0, pourcentage_a_faire_brut))
-
-        result.append({
-            'compte': compte,
-            'libelle': stats['libelle'],
-            'nb_transactions': nb_transactions,
-            'pourcentage_total': pourcentage_total,
-            'pourcentage_traite': pourcentage_traite,
-            'pourcentage_a_faire': pourcentage_a_faire,
-            'pourcentage_impact': 0  # Sera calculé en temps réel côté client
-        })
-
-        print(
-            f"📊 Compte {compte}: {nb_transactions} trans, {pourcentage_traite}% traité, {pourcentage_a_faire}% à faire")
-
-    # Trier par nombre de transactions décroissant
-    result_sorted = sorted(result, key=lambda x: x['nb_transactions'], reverse=True)
-    print(f"✅ Statistiques calculées pour {len(result_sorted)} comptes")
-
-    return result_sorted
-
-
-def calculer_automatisation_globale(ecritures, regles_existantes):
-    """Calcule le pourcentage global d'automatisation - VERSION CORRIGÉE"""
-    if not ecritures:
-        return 0
-
-    from app.services.regle_tester import RegleTester
-    tester = RegleTester()
-
-    ecritures_couvertes = set()
-    for regle in regles_existantes:
-        if regle.is_active:  # Seulement les règles ACTIVES
-            try:
-                matches = tester.test_regle_object(regle, ecritures)
-                for match in matches:
-                    ecritures_couvertes.add(match.id)
-            except Exception as e:
-                print(f"❌ Erreur calcul automatisation pour règle {regle.nom}: {e}")
-
-    automatisation = round((len(ecritures_couvertes) / len(ecritures) * 100), 1)
-    print(f"🎯 Automatisation globale: {automatisation}% ({len(ecritures_couvertes)}/{len(ecritures)})")
-
-    return automatisation
-
-
 @regles_bp.route('/regles/test-collision', methods=['POST'])
 def test_collision():
     """API pour tester une règle et calculer la collision en temps réel"""
@@ -777,10 +527,9 @@ def test_collision():
         fec_id = data['fec_id']
         compte_selectionne = data['compte_selectionne']
 
-        ecritures = EcritureBancaire.query.filter_by(fec_file_id=fec_id).all()
-
         # Récupérer les règles existantes actives
         fec_file = FecFile.query.get(fec_id)
+        ecritures = ecritures_lecture(fec_file.id)
         societe = Societe.query.get(fec_file.societe_id)
 
         regles_existantes = RegleAffectation.query.filter_by(
@@ -813,36 +562,80 @@ def test_collision():
         print(f"Erreur test collision: {e}")
         return jsonify({'success': False, 'error': 'Erreur interne du serveur'})
 
+@regles_bp.route('/regles/test-collision/batch', methods=['POST'])
+def test_collision_batch():
+    """API pour tester plusieurs règles candidates en une seule passe (comparaisons dans l'interface)"""
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'error': 'Non connecté'}), 401
+
+    try:
+        data = request.get_json()
+
+        # Validation des données
+        candidates = data.get('regles') or []
+        if not candidates or not data.get('fec_id') or not data.get('compte_selectionne'):
+            return jsonify({'success': False, 'error': 'Paramètres manquants'})
+
+        if len(candidates) > MAX_REGLES_BATCH:
+            return jsonify({'success': False, 'error': f'Maximum {MAX_REGLES_BATCH} règles par appel'}), 400
+
+        fec_file = FecFile.query.get(data['fec_id'])
+        if not fec_file:
+            return jsonify({'success': False, 'error': 'Fichier FEC introuvable'})
+
+        societe = identite_cache.societe(fec_file.societe_id)
+        if societe is None:
+            return jsonify({'success': False, 'error': 'Accès non autorisé'}), 403
+
+        # Préparer les règles candidates (mots-clés en liste ou séparés par des virgules)
+        regles_data = []
+        for candidate in candidates:
+            mots_cles = candidate.get('mots_cles') or []
+            if isinstance(mots_cles, str):
+                mots_cles = mots_cles.split(',')
+            regles_data.append({
+                'mots_cles': [mot.strip() for mot in mots_cles if mot.strip()],
+                'journal_code': candidate.get('journal_code'),
+                'criteres_montant': candidate.get('criteres_montant')
+            })
+
+        # Les écritures ne sont chargées qu'une fois pour toutes les candidates
+        ecritures = ecritures_lecture(fec_file.id)
+
+        from app.services.regle_tester import RegleTester
+        tester = RegleTester()
+
+        resultats = tester.test_regles_batch(regles_data, ecritures, data['compte_selectionne'])
+
+        return jsonify({
+            'success': True,
+            'resultats': resultats
+        })
+
+    except Exception as e:
+        print(f"Erreur test collision batch: {e}")
+        return jsonify({'success': False, 'error': 'Erreur interne du serveur'})
+
 # Fonctions utilitaires
 def calculer_statistiques_comptes(ecritures, regles_existantes):
-    """Calcule les statistiques par compte de contrepartie"""
-    from collections import defaultdict
+    """
+    Calcule les statistiques par compte de contrepartie d'une liste d'écritures
+
+    Pour la table des comptes d'un FEC, statistiques_comptes_fec lit les agrégats
+    précalculés (compte_stats) au lieu de parcourir les écritures.
+    """
+    from decimal import Decimal
+    from app.models.compte_stats import CompteStats
+    from app.services.compte_stats import statistiques_depuis_agregats
     from app.services.regle_tester import RegleTester
 
     tester = RegleTester()
 
-    # Grouper par compte de contrepartie
-    comptes_stats = defaultdict(lambda: {
-        'compte': '',
-        'libelle': '',
-        'nb_transactions': 0,
-        'transactions': [],
-        'pourcentage_total': 0,
-        'pourcentage_traite': 0,
-        'pourcentage_a_faire': 0
-    })
-
-    total_ecritures = len(ecritures)
-
-    # Identifier les écritures couvertes
-    ecritures_couvertes = set()
-    for regle in regles_existantes:
-        if regle.is_active:
-            matches = tester.test_regle_object(regle, ecritures)
-            for match in matches:
-                ecritures_couvertes.add(match.id)
+    # Identifier les écritures couvertes (une règle gagnante par écriture)
+    ecritures_couvertes = tester.affecter_ecritures(regles_existantes, ecritures).ecritures_couvertes
 
-    # Analyser chaque écriture
+    # Grouper par compte de contrepartie (ordre de première apparition)
+    agregats = {}
     for ecriture in ecritures:
         # CORRECTION : Utiliser les nouveaux champs compte_contrepartie et libelle_contrepartie
         if hasattr(ecriture, 'compte_contrepartie') and ecriture.compte_contrepartie:
@@ -857,51 +650,22 @@ def calculer_statistiques_comptes(ecritures, regles_existantes):
                 compte_contrepartie = "AUTRE"
                 libelle_contrepartie = "Compte non identifié"
 
-        comptes_stats[compte_contrepartie]['compte'] = compte_contrepartie
-        comptes_stats[compte_contrepartie]['libelle'] = libelle_contrepartie
-        comptes_stats[compte_contrepartie]['nb_transactions'] += 1
-        comptes_stats[compte_contrepartie]['transactions'].append(ecriture)
-
-    # Fonction pour formater les pourcentages avec précision adaptative
-    def format_pourcentage_precis(valeur):
-        if valeur == 0:
-            return 0
-        elif valeur < 0.1:
-            return round(valeur, 2)
+        agregat = agregats.get(compte_contrepartie)
+        if agregat is None:
+            agregat = agregats[compte_contrepartie] = CompteStats(
+                compte=compte_contrepartie, nb_transactions=0, nb_couvertes=0,
+                montant_debit=Decimal(0), montant_credit=Decimal(0)
+            )
+        agregat.libelle = libelle_contrepartie
+        agregat.nb_transactions += 1
+        if ecriture.sens == 'D':
+            agregat.montant_debit += ecriture.montant
         else:
-            return round(valeur, 1)
-
-    # Calculer les pourcentages
-    result = []
-    for compte, stats in comptes_stats.items():
-        nb_transactions = stats['nb_transactions']
-        pourcentage_total_brut = (nb_transactions / total_ecritures * 100) if total_ecritures > 0 else 0
-
-        # Calculer le pourcentage traité (écritures couvertes)
-        nb_couvertes = sum(1 for t in stats['transactions'] if t.id in ecritures_couvertes)
-        pourcentage_traite_brut = (nb_couvertes / nb_transactions * 100) if nb_transactions > 0 else 0
-
-        # À faire = Total - Traité (en valeurs brutes)
-        pourcentage_a_faire_brut = pourcentage_total_brut - (
-                    nb_couvertes / total_ecritures * 100) if total_ecritures > 0 else 0
-
-        # Appliquer le formatage précis
-        pourcentage_total = format_pourcentage_precis(pourcentage_total_brut)
-        pourcentage_traite = format_pourcentage_precis(pourcentage_traite_brut)
-        pourcentage_a_faire = format_pourcentage_precis(max(0, pourcentage_a_faire_brut))
-
-        result.append({
-            'compte': compte,
-            'libelle': stats['libelle'],
-            'nb_transactions': nb_transactions,
-            'pourcentage_total': pourcentage_total,
-            'pourcentage_traite': pourcentage_traite,
-            'pourcentage_a_faire': pourcentage_a_faire,
-            'pourcentage_impact': 0  # Sera calculé en temps réel côté client
-        })
+            agregat.montant_credit += ecriture.montant
+        if ecriture.id in ecritures_couvertes:
+            agregat.nb_couvertes += 1
 
-    # Trier par nombre de transactions décroissant
-    return sorted(result, key=lambda x: x['nb_transactions'], reverse=True)
+    return statistiques_depuis_agregats(list(agregats.values()))
 
 def calculer_automatisation_globale(ecritures, regles_existantes):
     """Calcule le pourcentage global d'automatisation"""
@@ -911,12 +675,7 @@ def calculer_automatisation_globale(ecritures, regles_existantes):
     from app.services.regle_tester import RegleTester
     tester = RegleTester()
 
-    ecritures_couvertes = set()
-    for regle in regles_existantes:
-        if regle.is_active:
-            matches = tester.test_regle_object(regle, ecritures)
-            for match in matches:
-                ecritures_couvertes.add(match.id)
+    ecritures_couvertes = tester.affecter_ecritures(regles_existantes, ecritures).ecritures_couvertes
 
     return round((len(ecritures_couvertes) / len(ecritures) * 100), 1)
 
@@ -942,7 +701,7 @@ def import_regles():
 
         if not societe_id:
             # Fallback: récupérer la première société de l'organisation
-            premiere_societe = Societe.query.filter_by(organization_id=session['organization_id']).first()
+            premiere_societe = identite_cache.premiere_societe()
             if premiere_societe:
                 societe_id = str(premiere_societe.id)
                 print(f"🔍 DEBUG Import - Utilisation fallback: {societe_id}")
@@ -955,8 +714,8 @@ def import_regles():
             return jsonify({'success': False, 'error': 'Format ID société invalide'}), 400
 
         # Vérifier les permissions
-        societe = Societe.query.get_or_404(societe_id)
-        if societe.organization_id != session['organization_id']:
+        societe = identite_cache.societe(societe_id)
+        if societe is None:
             return jsonify({'success': False, 'error': 'Accès non autorisé'}), 403
 
         print(f"✅ DEBUG Import - Société validée: {societe.nom}")
@@ -1082,6 +841,7 @@ def import_regles():
 
             # Traiter chaque ligne
             imported_count = 0
+            regles_importees = []
             errors = []
 
             for index, row in df.iterrows():
@@ -1138,6 +898,7 @@ def import_regles():
                     )
 
                     db.session.add(regle)
+                    regles_importees.append(regle)
                     imported_count += 1
                     print(f"✅ DEBUG Import - Règle ajoutée: {nom} (mots-clés: {mots_cles})")
 
@@ -1154,6 +915,10 @@ def import_regles():
             if imported_count > 0:
                 print("💾 DEBUG Import - Sauvegarde en base de données...")
                 db.session.commit()
+                coverage_cache.invalidate_societe(societe_id)
+                suggestion_cache.invalider_regles(societe_id, [(r.id, r.mots_cles) for r in regles_importees])
+                mettre_a_jour_couverture(societe_id, [(r.id, r.mots_cles) for r in regles_importees])
+                noter_ecriture_utilisateur()
                 print("✅ DEBUG Import - Sauvegarde réussie")
             else:
                 print("⚠️ DEBUG Import - Aucune règle à sauvegarder")
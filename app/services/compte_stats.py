@@ -0,0 +1,226 @@
+from collections import Counter
+from decimal import Decimal
+
+from app.models import db
+from app.models.compte_stats import CompteStats
+from app.models.ecriture_bancaire import EcritureBancaire
+from app.models.fec_file import FecFile
+from app.models.regle_affectation import RegleAffectation
+from app.services.contreparties import completer_contreparties_fec
+from app.services.coverage_cache import coverage_cache
+from app.services.lecture_ecritures import ecritures_lecture
+from app.utils.texte import normaliser_libelle
+
+LIBELLE_NON_DEFINI = "Libellé non défini"
+# Taille des lots d'identifiants des requêtes IN
+TAILLE_LOT_IDENTIFIANTS = 900
+
+
+def _format_pourcentage_precis(valeur):
+    """Pourcentage arrondi avec une précision adaptée aux petites valeurs"""
+    if valeur == 0:
+        return 0
+    elif valeur < 0.1:
+        return round(valeur, 2)
+    else:
+        return round(valeur, 1)
+
+
+def statistiques_depuis_agregats(agregats):
+    """
+    Lignes de la table des comptes à partir des agrégats par compte
+
+    Args:
+        agregats (list): objets ou CompteStats (compte, libelle, nb_transactions, nb_couvertes,
+            montant_debit, montant_credit), dans l'ordre de première apparition des comptes
+
+    Returns:
+        list: statistiques par compte, par nombre de transactions décroissant
+    """
+    total_ecritures = sum(agregat.nb_transactions for agregat in agregats)
+
+    result = []
+    for agregat in agregats:
+        nb_transactions = agregat.nb_transactions
+        nb_couvertes = agregat.nb_couvertes
+        pourcentage_total_brut = (nb_transactions / total_ecritures * 100) if total_ecritures > 0 else 0
+        pourcentage_traite_brut = (nb_couvertes / nb_transactions * 100) if nb_transactions > 0 else 0
+
+        # À faire = Total - Traité (en valeurs brutes)
+        pourcentage_a_faire_brut = pourcentage_total_brut - (
+                    nb_couvertes / total_ecritures * 100) if total_ecritures > 0 else 0
+
+        result.append({
+            'compte': agregat.compte,
+            'libelle': agregat.libelle,
+            'nb_transactions': nb_transactions,
+            'montant_debit': float(agregat.montant_debit),
+            'montant_credit': float(agregat.montant_credit),
+            'pourcentage_total': _format_pourcentage_precis(pourcentage_total_brut),
+            'pourcentage_traite': _format_pourcentage_precis(pourcentage_traite_brut),
+            'pourcentage_a_faire': _format_pourcentage_precis(max(0, pourcentage_a_faire_brut)),
+            'pourcentage_impact': 0  # Sera calculé en temps réel côté client
+        })
+
+    # Trier par nombre de transactions décroissant
+    return sorted(result, key=lambda x: x['nb_transactions'], reverse=True)
+
+
+def _agreger_comptes(fec_file_id, regles):
+    """
+    Agrégats de tous les comptes de contrepartie d'un FEC, dans l'ordre de première
+    apparition des comptes
+
+    Returns:
+        list: lignes CompteStats, hors session
+    """
+    from app.services.regle_tester import RegleTester
+
+    completer_contreparties_fec(fec_file_id)
+    ecritures = ecritures_lecture(fec_file_id)
+    ecritures_couvertes = RegleTester().affecter_ecritures(regles, ecritures).ecritures_couvertes
+    empreinte = coverage_cache.empreinte_regles(regles)
+
+    lignes = {}
+    for ecriture in ecritures:
+        ligne = lignes.get(ecriture.compte_contrepartie)
+        if ligne is None:
+            ligne = lignes[ecriture.compte_contrepartie] = CompteStats(
+                fec_file_id=fec_file_id, compte=ecriture.compte_contrepartie,
+                nb_transactions=0, montant_debit=Decimal(0), montant_credit=Decimal(0),
+                nb_couvertes=0, empreinte_regles=empreinte
+            )
+        ligne.libelle = ecriture.libelle_contrepartie or LIBELLE_NON_DEFINI
+        ligne.nb_transactions += 1
+        if ecriture.sens == 'D':
+            ligne.montant_debit += ecriture.montant
+        else:
+            ligne.montant_credit += ecriture.montant
+        if ecriture.id in ecritures_couvertes:
+            ligne.nb_couvertes += 1
+
+    return list(lignes.values())
+
+
+def reconstruire_compte_stats(fec_file_id, regles):
+    """
+    Recalcule et enregistre les agrégats de tous les comptes de contrepartie d'un FEC
+
+    Appelée à l'import, et à la modification des règles quand la table est absente
+    (FEC importé avant elle). La transaction n'est pas validée.
+
+    Returns:
+        list: lignes CompteStats du FEC
+    """
+    lignes = _agreger_comptes(fec_file_id, regles)
+    CompteStats.query.filter_by(fec_file_id=fec_file_id).delete()
+    db.session.add_all(lignes)
+    db.session.flush()
+    return lignes
+
+
+def statistiques_comptes_fec(fec_file_id, regles):
+    """
+    Statistiques par compte et taux d'automatisation d'un FEC, lus dans compte_stats
+
+    Une seule lecture indexée quand la table est à jour des règles ; sinon les agrégats
+    sont recalculés en mémoire, sans écriture : les routes de lecture (parfois servies par
+    le réplica) ne valident pas de transaction. La table n'est écrite qu'à l'import et à la
+    modification des règles (mettre_a_jour_couverture).
+
+    Returns:
+        tuple: (statistiques par compte, pourcentage d'automatisation global)
+    """
+    empreinte = coverage_cache.empreinte_regles(regles)
+    lignes = CompteStats.query.filter_by(fec_file_id=fec_file_id).order_by(CompteStats.id).all()
+
+    if not lignes or any(ligne.empreinte_regles != empreinte for ligne in lignes):
+        lignes = _agreger_comptes(fec_file_id, regles)
+
+    total = sum(ligne.nb_transactions for ligne in lignes)
+    couvertes = sum(ligne.nb_couvertes for ligne in lignes)
+    automatisation = round(couvertes / total * 100, 1) if total else 0
+    return statistiques_depuis_agregats(lignes), automatisation
+
+
+def _comptes_des_ecritures(fec_file_id, identifiants):
+    """Comptes de contrepartie d'un ensemble d'écritures (requêtes IN par lots)"""
+    identifiants = sorted(identifiants)
+    comptes = set()
+    for debut in range(0, len(identifiants), TAILLE_LOT_IDENTIFIANTS):
+        lot = identifiants[debut:debut + TAILLE_LOT_IDENTIFIANTS]
+        comptes.update(compte for (compte,) in db.session.query(EcritureBancaire.compte_contrepartie).filter(
+            EcritureBancaire.fec_file_id == fec_file_id,
+            EcritureBancaire.id.in_(lot)
+        ).distinct())
+    return comptes
+
+
+def mettre_a_jour_couverture(societe_id, regles_modifiees):
+    """
+    Met à jour les écritures couvertes des comptes touchés par des règles créées,
+    supprimées, activées ou désactivées
+
+    Seules les écritures contenant un mot-clé de ces règles peuvent changer de couverture :
+    les comptes auxquels elles appartiennent sont recalculés, les autres lignes ne reçoivent
+    que la nouvelle empreinte des règles. Les FEC sans agrégats sont reconstruits entièrement.
+    En cas d'échec, les agrégats des FEC de la société sont supprimés : recalculés en mémoire
+    à la lecture, puis reconstruits à la modification suivante.
+
+    Args:
+        societe_id (int): Société des règles
+        regles_modifiees (list): Tuples (regle_id, mots_cles), comme SuggestionCache.invalider_regles
+    """
+    from app.services.index_libelles import index_libelles_cache
+    from app.services.regle_tester import RegleTester
+
+    try:
+        regles = RegleAffectation.query.filter_by(societe_id=societe_id).all()
+        empreinte = coverage_cache.empreinte_regles(regles)
+
+        mots_cles = set()
+        for _, mots in regles_modifiees:
+            if isinstance(mots, str):
+                mots = mots.split(',')
+            mots_cles.update(normaliser_libelle(mot) for mot in mots or [] if mot and mot.strip())
+
+        fec_ids = [fec_id for (fec_id,) in db.session.query(FecFile.id).filter_by(
+            societe_id=societe_id, is_active=True)]
+
+        for fec_file_id in fec_ids:
+            lignes = {ligne.compte: ligne for ligne in CompteStats.query.filter_by(fec_file_id=fec_file_id)}
+            if not lignes:
+                reconstruire_compte_stats(fec_file_id, regles)
+                continue
+
+            index = index_libelles_cache.index_pour_fec(fec_file_id)
+            touchees = set()
+            for mot_cle in mots_cles:
+                touchees.update(index.identifiants_contenant(mot_cle))
+
+            comptes = _comptes_des_ecritures(fec_file_id, touchees) if touchees else set()
+            if comptes:
+                ecritures = ecritures_lecture(fec_file_id, comptes)
+                ecritures_couvertes = RegleTester().affecter_ecritures(regles, ecritures).ecritures_couvertes
+                nb_couvertes = Counter(ecriture.compte_contrepartie for ecriture in ecritures
+                                       if ecriture.id in ecritures_couvertes)
+                for compte in comptes:
+                    if compte in lignes:
+                        lignes[compte].nb_couvertes = nb_couvertes.get(compte, 0)
+
+            for ligne in lignes.values():
+                ligne.empreinte_regles = empreinte
+
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"⚠️ Mise à jour de compte_stats impossible (reconstruite à la prochaine modification): {e}")
+        # Des agrégats restés à l'ancienne empreinte ne doivent pas servir de base à la mise à jour suivante
+        try:
+            fec_ids = db.session.query(FecFile.id).filter_by(societe_id=societe_id)
+            CompteStats.query.filter(CompteStats.fec_file_id.in_(fec_ids.scalar_subquery())).delete(
+                synchronize_session=False)
+            db.session.commit()
+        except Exception as suppression_error:
+            db.session.rollback()
+            print(f"⚠️ Suppression de compte_stats impossible: {suppression_error}")
@@ -0,0 +1,111 @@
+from sqlalchemy import bindparam
+
+from app.models import db
+from app.models.ecriture_bancaire import EcritureBancaire
+from app.utils.routage_lecture import marquer_ecriture
+
+COMPTE_INCONNU = "AUTRE"
+LIBELLE_INCONNU = "Compte non identifié"
+
+
+def carte_contreparties(fec_file_id):
+    """
+    Carte ecriture_num -> (compte, libellé) des lignes hors banque (512*) d'un FEC, en une requête
+
+    Pour chaque numéro d'écriture, la première ligne (par identifiant) est retenue, comme
+    le faisait la recherche ligne par ligne.
+    """
+    lignes = db.session.query(
+        EcritureBancaire.ecriture_num,
+        EcritureBancaire.compte_final,
+        EcritureBancaire.libelle_final
+    ).filter(
+        EcritureBancaire.fec_file_id == fec_file_id,
+        ~EcritureBancaire.compte_num.startswith('512')
+    ).order_by(EcritureBancaire.id).all()
+
+    carte = {}
+    for ecriture_num, compte_final, libelle_final in lignes:
+        carte.setdefault(ecriture_num, (compte_final, libelle_final))
+    return carte
+
+
+def resoudre_contreparties(fec_file_id, ecritures, backfill=True):
+    """
+    Compte et libellé de contrepartie de chaque écriture d'un FEC : {ecriture.id: (compte, libellé)}
+
+    La contrepartie calculée à l'import (compte_contrepartie) est lue directement. Pour les
+    lignes importées avant l'ajout de la colonne, elle est déduite du compte final ou de la
+    carte des lignes hors banque (une seule requête pour tout le FEC), puis enregistrée en
+    base une fois pour toutes si `backfill` est vrai : le nombre de requêtes ne dépend pas
+    du nombre d'écritures.
+    """
+    contreparties = {}
+    a_completer = []
+    for ecriture in ecritures:
+        if ecriture.compte_contrepartie:
+            contreparties[ecriture.id] = (ecriture.compte_contrepartie, ecriture.libelle_contrepartie)
+        else:
+            a_completer.append(ecriture)
+
+    if not a_completer:
+        return contreparties
+
+    carte = None
+    for ecriture in a_completer:
+        if not ecriture.compte_final.startswith('512'):
+            contreparties[ecriture.id] = (ecriture.compte_final, ecriture.libelle_final)
+        else:
+            if carte is None:
+                carte = carte_contreparties(fec_file_id)
+            contreparties[ecriture.id] = carte.get(ecriture.ecriture_num, (COMPTE_INCONNU, LIBELLE_INCONNU))
+
+    if backfill:
+        _enregistrer_contreparties(a_completer, contreparties)
+    return contreparties
+
+
+def completer_contreparties_fec(fec_file_id):
+    """Enregistre la contrepartie des lignes anciennes d'un FEC qui n'en ont pas (une requête si aucune)"""
+    a_completer = EcritureBancaire.query.filter(
+        EcritureBancaire.fec_file_id == fec_file_id,
+        EcritureBancaire.compte_contrepartie.is_(None)
+    ).all()
+    if a_completer:
+        resoudre_contreparties(fec_file_id, a_completer)
+
+
+def _enregistrer_contreparties(ecritures, contreparties):
+    """
+    Enregistre les contreparties déduites (une instruction UPDATE exécutée en lot)
+
+    La mise à jour passe par une connexion distincte de la session : les écritures déjà
+    chargées ne sont pas expirées (pas de rechargement ligne par ligne) et reçoivent
+    directement les nouvelles valeurs. Les écritures en lecture seule (EcritureLecture)
+    sont simplement mises à jour.
+    """
+    from sqlalchemy.orm.attributes import set_committed_value
+
+    table = EcritureBancaire.__table__
+    parametres = [
+        {'b_id': ecriture.id, 'b_compte': contreparties[ecriture.id][0], 'b_libelle': contreparties[ecriture.id][1]}
+        for ecriture in ecritures
+    ]
+    with db.engine.begin() as connexion:
+        connexion.execute(
+            table.update()
+            .where(table.c.id == bindparam('b_id'))
+            .values(compte_contrepartie=bindparam('b_compte'), libelle_contrepartie=bindparam('b_libelle')),
+            parametres
+        )
+    # Les lectures suivantes de la requête doivent voir ces contreparties
+    marquer_ecriture()
+
+    for ecriture in ecritures:
+        compte, libelle = contreparties[ecriture.id]
+        if isinstance(ecriture, EcritureBancaire):
+            set_committed_value(ecriture, 'compte_contrepartie', compte)
+            set_committed_value(ecriture, 'libelle_contrepartie', libelle)
+        else:
+            ecriture.compte_contrepartie = compte
+            ecriture.libelle_contrepartie = libelle
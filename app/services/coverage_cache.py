@@ -0,0 +1,109 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+from flask import request, jsonify, make_response
+
+
+class CoverageCache:
+    """Cache LRU des calculs de couverture et de statistiques, indexé par (FEC, empreinte des règles actives)"""
+
+    def __init__(self, max_entries=64):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def init_app(self, app):
+        """Lit la taille maximale du cache depuis la configuration"""
+        self.max_entries = app.config.get('COVERAGE_CACHE_MAX_ENTRIES', self.max_entries)
+
+    @staticmethod
+    def empreinte_regles(regles):
+        """
+        Calcule une empreinte stable des règles actives
+
+        Seuls les champs qui influencent la couverture et la règle gagnante de chaque
+        écriture (priorité) sont pris en compte : deux jeux de règles équivalents donnent
+        la même empreinte.
+        """
+        definitions = sorted(
+            (
+                regle.id,
+                regle.mots_cles,
+                regle.journal_code,
+                regle.criteres_montant,
+                regle.compte_destination,
+                regle.priorite
+            )
+            for regle in regles
+            if regle.is_active
+        )
+        contenu = json.dumps(definitions, sort_keys=True, default=str, ensure_ascii=False)
+        return hashlib.sha1(contenu.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def etag(fec_file_id, empreinte, nature):
+        """ETag d'une réponse calculée pour un FEC et un jeu de règles donnés"""
+        return f"{nature}-{fec_file_id}-{empreinte[:20]}"
+
+    def get_or_compute(self, societe_id, fec_file_id, empreinte, nature, calcul):
+        """Retourne la valeur en cache ou la calcule via `calcul()` puis la mémorise"""
+        cle = (fec_file_id, empreinte, nature)
+
+        with self._lock:
+            if cle in self._entries:
+                self._entries.move_to_end(cle)
+                self.hits += 1
+                return self._entries[cle][1]
+            self.misses += 1
+
+        valeur = calcul()
+
+        with self._lock:
+            self._entries[cle] = (societe_id, valeur)
+            self._entries.move_to_end(cle)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+        return valeur
+
+    def invalidate_societe(self, societe_id):
+        """Supprime toutes les entrées d'une société (règle modifiée, FEC importé)"""
+        with self._lock:
+            for cle in [c for c, (sid, _) in self._entries.items() if sid == societe_id]:
+                del self._entries[cle]
+
+    def invalidate_fec(self, fec_file_id):
+        """Supprime toutes les entrées calculées pour un FEC"""
+        with self._lock:
+            for cle in [c for c in self._entries if c[0] == fec_file_id]:
+                del self._entries[cle]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def requete_non_modifiee(etag):
+    """Réponse 304 si le navigateur possède déjà la version correspondant à l'ETag, sinon None"""
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+    return None
+
+
+def reponse_json_avec_etag(payload, etag):
+    """Sérialise le payload en JSON en y attachant l'ETag (revalidation obligatoire côté navigateur)"""
+    response = jsonify(payload)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+# Instance partagée par toute l'application
+coverage_cache = CoverageCache()
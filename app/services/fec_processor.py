@@ -5,6 +5,10 @@ from datetime import datetime
 from app.models import db
 from app.models.fec_file import FecFile
 from app.models.ecriture_bancaire import EcritureBancaire
+from app.models.regle_affectation import RegleAffectation
+from app.services.compte_stats import reconstruire_compte_stats
+from app.services.index_libelles import index_libelles_cache
+from app.utils.texte import normaliser_libelle
 
 
 class FecProcessor:
@@ -88,6 +92,12 @@ class FecProcessor:
             try:
                 self._save_ecritures_bancaires(ecritures_bancaires, fec_file.id)
                 print("✅ Sauvegarde terminée avec succès")
+
+                # 8. Agrégats par compte de contrepartie (table des comptes du dashboard).
+                # L'index des libellés n'est pas construit ici mais à la première recherche
+                regles = RegleAffectation.query.filter_by(societe_id=societe_id).all()
+                with index_libelles_cache.sans_construction():
+                    reconstruire_compte_stats(fec_file.id, regles)
             except Exception as save_error:
                 print(f"❌ Erreur lors de la sauvegarde: {save_error}")
                 raise save_error
@@ -287,6 +297,7 @@ class FecProcessor:
                     piece_ref=row['PieceRef'] if row['PieceRef'] else None,
                     piece_date=piece_date,
                     ecriture_lib=row['EcritureLib'],
+                    ecriture_lib_norm=normaliser_libelle(row['EcritureLib']),
                     debit=debit if debit > 0 else None,
                     credit=credit if credit > 0 else None,
                     ecriture_let=row['EcritureLet'] if row['EcritureLet'] else None,
@@ -324,49 +335,49 @@ class FecProcessor:
             return None
         
     def _apply_pennylane_formatting(self, df):
-    print("🔧 Application du format Pennylane...")
+        print("🔧 Application du format Pennylane...")
     
-    # Suffixes à détecter et supprimer
-    pennylane_suffixes = [
-        '(Import/Export)',
-        '(Pas de TVA)',
-        '(TVA 20%)',
-        '(TVA 5.5%)',
-        '(TVA 10%)',
-        '(TVA 2.1%)',
-        '(Intracom)'
-    ]
+        # Suffixes à détecter et supprimer
+        pennylane_suffixes = [
+            '(Import/Export)',
+            '(Pas de TVA)',
+            '(TVA 20%)',
+            '(TVA 5.5%)',
+            '(TVA 10%)',
+            '(TVA 2.1%)',
+            '(Intracom)'
+        ]
     
-    modifications_count = 0
+        modifications_count = 0
     
-    for index, row in df.iterrows():
-        compte_num = str(row['CompteNum']) if pd.notna(row['CompteNum']) else ''
-        compte_lib = str(row['CompteLib']) if pd.notna(row['CompteLib']) else ''
+        for index, row in df.iterrows():
+            compte_num = str(row['CompteNum']) if pd.notna(row['CompteNum']) else ''
+            compte_lib = str(row['CompteLib']) if pd.notna(row['CompteLib']) else ''
         
-        # Vérifier si le libellé contient un des suffixes (insensible à la casse)
-        suffix_found = False
-        for suffix in pennylane_suffixes:
-            if suffix.lower() in compte_lib.lower():
-                suffix_found = True
-                break
+            # Vérifier si le libellé contient un des suffixes (insensible à la casse)
+            suffix_found = False
+            for suffix in pennylane_suffixes:
+                if suffix.lower() in compte_lib.lower():
+                    suffix_found = True
+                    break
         
-        if suffix_found and len(compte_num) > 0:
-            # Modifier le dernier caractère de CompteNum par "0"
-            new_compte_num = compte_num[:-1] + '0'
-            df.at[index, 'CompteNum'] = new_compte_num
-            modifications_count += 1
+            if suffix_found and len(compte_num) > 0:
+                # Modifier le dernier caractère de CompteNum par "0"
+                new_compte_num = compte_num[:-1] + '0'
+                df.at[index, 'CompteNum'] = new_compte_num
+                modifications_count += 1
             
-        # Nettoyer le libellé en supprimant tous les suffixes
-        new_compte_lib = compte_lib
-        for suffix in pennylane_suffixes:
-            # Suppression insensible à la casse
-            import re
-            pattern = re.escape(suffix)
-            new_compte_lib = re.sub(pattern, '', new_compte_lib, flags=re.IGNORECASE)
+            # Nettoyer le libellé en supprimant tous les suffixes
+            new_compte_lib = compte_lib
+            for suffix in pennylane_suffixes:
+                # Suppression insensible à la casse
+                import re
+                pattern = re.escape(suffix)
+                new_compte_lib = re.sub(pattern, '', new_compte_lib, flags=re.IGNORECASE)
         
-        # Nettoyer les espaces en trop
-        new_compte_lib = new_compte_lib.strip()
-        df.at[index, 'CompteLib'] = new_compte_lib
+            # Nettoyer les espaces en trop
+            new_compte_lib = new_compte_lib.strip()
+            df.at[index, 'CompteLib'] = new_compte_lib
     
-    print(f"✅ Format Pennylane appliqué : {modifications_count} comptes modifiés")
-    return df
\ No newline at end of file
+        print(f"✅ Format Pennylane appliqué : {modifications_count} comptes modifiés")
+        return df
\ No newline at end of file
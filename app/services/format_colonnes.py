@@ -0,0 +1,75 @@
+from datetime import date
+
+# Colonnes à faible cardinalité : valeurs distinctes + codes entiers
+COLONNES_DICTIONNAIRE = (
+    'journal_code', 'journal_lib', 'sens',
+    'compte_final', 'libelle_final', 'compte_contrepartie', 'libelle_contrepartie'
+)
+# Colonnes de dates (date ou texte JJ/MM/AAAA) : décalage en jours depuis la plus ancienne
+COLONNES_DATE = ('ecriture_date',)
+# Colonnes booléennes : 0 / 1
+COLONNES_BOOLEENNES = ('couverte_par_regle',)
+
+
+def _jour(valeur):
+    if isinstance(valeur, date):
+        return valeur.toordinal()
+    jour, mois, annee = valeur.split('/')
+    return date(int(annee), int(mois), int(jour)).toordinal()
+
+
+def _colonne_dictionnaire(valeurs):
+    distinctes = {}
+    codes = [distinctes.setdefault(valeur, len(distinctes)) for valeur in valeurs]
+    return {'valeurs': list(distinctes), 'codes': codes}
+
+
+def _colonne_dates(valeurs):
+    jours = [_jour(valeur) if valeur else None for valeur in valeurs]
+    presents = [j for j in jours if j is not None]
+    origine = min(presents, default=date.today().toordinal())
+    return {
+        'origine': date.fromordinal(origine).isoformat(),
+        'jours': [j - origine if j is not None else None for j in jours]
+    }
+
+
+def ecritures_en_colonnes(ecritures):
+    """
+    Encode une liste d'écritures (dictionnaires de même forme) en colonnes parallèles
+
+    Chaque champ devient une colonne : liste simple, ou objet {'valeurs', 'codes'} pour les
+    colonnes encodées par dictionnaire (journaux, comptes, libellés de comptes), ou objet
+    {'origine', 'jours'} pour les dates (décalage en jours depuis la date d'origine, ISO).
+    Les noms de champs n'apparaissent qu'une fois au lieu d'une fois par écriture.
+
+    Returns:
+        dict: {'nb': nombre d'écritures, 'colonnes': {champ: colonne}}
+    """
+    champs = []
+    for ecriture in ecritures:
+        for champ in ecriture:
+            if champ not in champs:
+                champs.append(champ)
+
+    colonnes = {}
+    for champ in champs:
+        valeurs = [ecriture.get(champ) for ecriture in ecritures]
+        if champ in COLONNES_DICTIONNAIRE:
+            colonnes[champ] = _colonne_dictionnaire(valeurs)
+        elif champ in COLONNES_DATE:
+            colonnes[champ] = _colonne_dates(valeurs)
+        elif champ in COLONNES_BOOLEENNES:
+            colonnes[champ] = [1 if valeur else 0 for valeur in valeurs]
+        else:
+            colonnes[champ] = valeurs
+
+    return {'nb': len(ecritures), 'colonnes': colonnes}
+
+
+def dashboard_en_colonnes(payload):
+    """Payload du dashboard avec les écritures au format colonnes (le reste inchangé)"""
+    colonnes = dict(payload)
+    colonnes['format'] = 'colonnes'
+    colonnes['ecritures'] = ecritures_en_colonnes(payload.get('ecritures') or [])
+    return colonnes
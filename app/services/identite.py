@@ -0,0 +1,132 @@
+import threading
+import time
+
+from flask import g, has_app_context, session
+from sqlalchemy.orm import make_transient_to_detached
+
+from app.models import db
+from app.models.organization import Organization
+from app.models.societe import Societe
+from app.models.user import User
+
+
+def _instantane(instance):
+    """Valeurs des colonnes d'une instance, utilisables hors de la session qui l'a chargée"""
+    return {attribut.key: getattr(instance, attribut.key)
+            for attribut in db.inspect(instance).mapper.column_attrs}
+
+
+def _rattacher(modele, valeurs):
+    """Instance persistante reconstruite depuis un instantané, rattachée à la session sans requête"""
+    instance = modele(**valeurs)
+    make_transient_to_detached(instance)
+    return db.session.merge(instance, load=False)
+
+
+class IdentiteCache:
+    """
+    Identité de la requête : utilisateur connecté, organisation et sociétés accessibles
+
+    Chargées au plus une fois par requête (flask.g). Avec une durée de vie > 0, elles sont aussi
+    gardées entre les requêtes (instantanés des colonnes, rattachés à la session de chaque requête) ;
+    les sociétés d'une organisation sont invalidées à la création ou à la suppression d'une société.
+    """
+
+    def __init__(self, ttl=0):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def init_app(self, app):
+        """Lit la durée de vie (secondes) du cache entre les requêtes depuis la configuration"""
+        self.ttl = app.config.get('IDENTITE_CACHE_TTL', self.ttl)
+
+    def _instances(self, cle, modele, requete):
+        """Résultat de `requete()` (liste d'instances), en cache pour la requête et éventuellement au-delà"""
+        par_requete = g.setdefault('_identite', {})
+        if cle in par_requete:
+            return par_requete[cle]
+
+        instances = None
+        if self.ttl > 0:
+            maintenant = time.monotonic()
+            with self._lock:
+                entree = self._entries.get(cle)
+                if entree and entree[0] > maintenant:
+                    self.hits += 1
+                    instances = [_rattacher(modele, valeurs) for valeurs in entree[1]]
+                else:
+                    self.misses += 1
+
+        if instances is None:
+            instances = requete()
+            if self.ttl > 0:
+                instantanes = [_instantane(instance) for instance in instances]
+                with self._lock:
+                    # Les entrées expirées sont retirées à chaque écriture
+                    for perimee in [c for c, (expiration, _) in self._entries.items() if expiration <= maintenant]:
+                        del self._entries[perimee]
+                    self._entries[cle] = (maintenant + self.ttl, instantanes)
+
+        par_requete[cle] = instances
+        return instances
+
+    def _par_identifiant(self, modele, identifiant):
+        """Instance d'un modèle par clé primaire (None si elle n'existe pas)"""
+        instances = self._instances(
+            (modele.__tablename__, identifiant), modele,
+            lambda: [instance for instance in [db.session.get(modele, identifiant)] if instance is not None]
+        )
+        return instances[0] if instances else None
+
+    def utilisateur(self):
+        """Utilisateur connecté (None hors session)"""
+        if 'user_id' not in session:
+            return None
+        return self._par_identifiant(User, session['user_id'])
+
+    def organisation(self):
+        """Organisation de l'utilisateur connecté (None hors session)"""
+        if 'organization_id' not in session:
+            return None
+        return self._par_identifiant(Organization, session['organization_id'])
+
+    def societes(self):
+        """Sociétés de l'organisation de l'utilisateur connecté, par ordre de création"""
+        if 'organization_id' not in session:
+            return []
+        organization_id = session['organization_id']
+        return self._instances(
+            ('societes', organization_id), Societe,
+            lambda: Societe.query.filter_by(organization_id=organization_id).order_by(Societe.id).all()
+        )
+
+    def societe(self, societe_id):
+        """Société si elle appartient à l'organisation de l'utilisateur connecté, sinon None"""
+        try:
+            societe_id = int(societe_id)
+        except (TypeError, ValueError):
+            return None
+        return next((societe for societe in self.societes() if societe.id == societe_id), None)
+
+    def premiere_societe(self):
+        """Première société de l'organisation de l'utilisateur connecté (None s'il n'y en a pas)"""
+        societes = self.societes()
+        return societes[0] if societes else None
+
+    def invalider_organisation(self, organization_id):
+        """Oublie les sociétés d'une organisation (société créée ou supprimée)"""
+        with self._lock:
+            self._entries.pop(('societes', organization_id), None)
+        if has_app_context():
+            g.get('_identite', {}).pop(('societes', organization_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# Instance partagée par toute l'application
+identite_cache = IdentiteCache()
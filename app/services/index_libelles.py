@@ -0,0 +1,315 @@
+import json
+import struct
+import threading
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+
+
+class IndexSousChaines:
+    """
+    Tableau des suffixes des libellés normalisés d'un FEC
+
+    Les libellés distincts sont concaténés (séparés par un retour à la ligne, absent des
+    libellés normalisés) et les positions de tous les suffixes sont triées selon leurs
+    LONGUEUR_CLE premiers caractères. Les suffixes qui commencent par un motif forment
+    alors un intervalle contigu, trouvé par dichotomie en O(|motif| log N) : la recherche
+    a exactement la sémantique de `motif in libelle`.
+    """
+
+    SEPARATEUR = '\n'
+    LONGUEUR_CLE = 24
+    VERSION = 2
+    # Nombre maximal de motifs dont le résultat est mémorisé
+    MAX_MOTIFS_MEMORISES = 4096
+
+    def __init__(self, libelles, identifiants=None):
+        # Les libellés répétés (frais bancaires, prélèvements récurrents) ne sont indexés qu'une fois
+        distincts = {}
+        rangs = array('I', (distincts.setdefault(libelle or '', len(distincts)) for libelle in libelles))
+
+        texte = self.SEPARATEUR.join(distincts) + self.SEPARATEUR
+        suffixes = self.trier_suffixes(texte, self.LONGUEUR_CLE, self.SEPARATEUR)
+        self._initialiser(list(distincts), rangs, identifiants, suffixes)
+
+    @staticmethod
+    def trier_suffixes(texte, longueur_cle, separateur):
+        """
+        Positions des suffixes du texte (hors séparateurs), triées selon leurs premiers caractères
+
+        Tri par doublement de préfixe : les premiers caractères de chaque suffixe sont d'abord
+        codés dans un entier, puis le rang de chaque suffixe selon ses h premiers caractères
+        est combiné au rang du suffixe qui commence h caractères plus loin, ce qui donne le
+        rang selon 2h caractères, jusqu'à au moins `longueur_cle`. Chaque tour
+        ne manipule que des tableaux d'entiers (aucune sous-chaîne n'est créée) ; l'ordre
+        obtenu raffine l'ordre sur les `longueur_cle` premiers caractères, seul utilisé
+        par la recherche.
+        """
+        # Caractères numérotés de 1 à σ dans l'ordre (0 est réservé à la fin du texte, plus petite
+        # qu'un caractère) : les p premiers caractères d'un suffixe tiennent alors dans un entier
+        points = np.frombuffer(texte.encode('utf-32-le'), dtype=np.uint32)
+        alphabet, codes = np.unique(points, return_inverse=True)
+        codes = codes.astype(np.int64) + 1
+        base = len(alphabet) + 1
+        n = len(codes)
+
+        # Rang initial : les h premiers caractères, avec base ** h < 2 ** 62
+        h = 1
+        while h < longueur_cle and base ** (h + 1) < 2 ** 62:
+            h += 1
+        cles = np.zeros(n, dtype=np.int64)
+        for decalage in range(h):
+            cles *= base
+            cles[:n - decalage] += codes[decalage:]
+
+        while True:
+            ordre = np.argsort(cles)
+            # Rang dense de chaque clé (les clés égales partagent leur rang), calculé en place
+            triees = cles[ordre]
+            nouveaux = np.empty(n, dtype=np.int64)
+            nouveaux[0] = 1
+            np.not_equal(triees[1:], triees[:-1], out=nouveaux[1:])
+            del triees
+            np.cumsum(nouveaux, out=nouveaux)
+            nb_rangs = int(nouveaux[-1])
+            rangs = cles
+            rangs[ordre] = nouveaux
+            del cles, nouveaux
+            if h >= longueur_cle or nb_rangs == n:
+                break
+            # Rang selon 2h caractères : (rang selon h, rang du suffixe h caractères plus loin)
+            cles = rangs * (nb_rangs + 1)
+            cles[:n - h] += rangs[h:]
+            del rangs
+            h *= 2
+
+        separateur_code = int(np.searchsorted(alphabet, ord(separateur))) + 1
+        ordre = ordre[codes[ordre] != separateur_code]
+        suffixes = array('I')
+        suffixes.frombytes(ordre.astype(np.uint32).tobytes())
+        return suffixes
+
+    def _initialiser(self, distincts, rangs, identifiants, suffixes):
+        self.identifiants = list(identifiants) if identifiants is not None else list(range(len(rangs)))
+        self.nb_documents = len(rangs)
+        self.texte = self.SEPARATEUR.join(distincts) + self.SEPARATEUR
+        self.suffixes = suffixes
+        self.rangs = rangs
+
+        # Position de début de chaque libellé distinct dans le texte concaténé
+        self.debuts = array('I')
+        position = 0
+        for libelle in distincts:
+            self.debuts.append(position)
+            position += len(libelle) + 1
+
+        # Libellé distinct -> rangs des documents qui le portent
+        self.documents_par_libelle = [[] for _ in distincts]
+        for document, rang in enumerate(rangs):
+            self.documents_par_libelle[rang].append(document)
+
+        self._documents_par_motif = {}
+
+    def documents_contenant(self, motif):
+        """Rangs (croissants) des libellés contenant le motif"""
+        if motif in self._documents_par_motif:
+            return self._documents_par_motif[motif]
+
+        if not motif:
+            documents = list(range(self.nb_documents))
+        elif self.SEPARATEUR in motif:
+            documents = []
+        else:
+            texte = self.texte
+            k = min(len(motif), self.LONGUEUR_CLE)
+            cle = motif[:k]
+            debut = bisect_left(self.suffixes, cle, key=lambda i: texte[i:i + k])
+            fin = bisect_right(self.suffixes, cle, key=lambda i: texte[i:i + k], lo=debut)
+            positions = self.suffixes[debut:fin]
+            if len(motif) > k:
+                positions = [p for p in positions if texte.startswith(motif, p)]
+            libelles = {bisect_right(self.debuts, p) - 1 for p in positions}
+            documents = sorted(document for libelle in libelles for document in self.documents_par_libelle[libelle])
+
+        if len(self._documents_par_motif) < self.MAX_MOTIFS_MEMORISES:
+            self._documents_par_motif[motif] = documents
+        return documents
+
+    def identifiants_contenant(self, motif):
+        """Identifiants des libellés contenant le motif"""
+        return [self.identifiants[rang] for rang in self.documents_contenant(motif)]
+
+    def serialiser(self):
+        """Forme compacte stockée dans FecFile.index_libelles"""
+        entete = json.dumps({'version': self.VERSION, 'identifiants': self.identifiants}).encode('utf-8')
+        corps = self.texte.encode('utf-8')
+        return zlib.compress(
+            struct.pack('<III', len(entete), len(corps), len(self.rangs))
+            + entete + corps + self.rangs.tobytes() + self.suffixes.tobytes()
+        )
+
+    @classmethod
+    def charger(cls, donnees):
+        """Reconstruit l'index depuis sa forme sérialisée (None si format inconnu)"""
+        brut = zlib.decompress(donnees)
+        debut = struct.calcsize('<III')
+        if len(brut) < debut:
+            return None
+        taille_entete, taille_corps, nb_documents = struct.unpack_from('<III', brut)
+        try:
+            entete = json.loads(brut[debut:debut + taille_entete].decode('utf-8'))
+        except ValueError:
+            return None
+        if not isinstance(entete, dict) or entete.get('version') != cls.VERSION:
+            return None
+
+        debut += taille_entete
+        texte = brut[debut:debut + taille_corps].decode('utf-8')
+        debut += taille_corps
+        rangs = array('I')
+        rangs.frombytes(brut[debut:debut + nb_documents * rangs.itemsize])
+        suffixes = array('I')
+        suffixes.frombytes(brut[debut + nb_documents * rangs.itemsize:])
+
+        index = cls.__new__(cls)
+        index._initialiser(texte.split(cls.SEPARATEUR)[:-1], rangs, entete['identifiants'], suffixes)
+        return index
+
+
+class IndexProgressif:
+    """
+    Recherche par sous-chaîne sur une liste de libellés construite à la volée
+
+    Les premiers motifs sont cherchés par simple parcours ; le tableau des suffixes
+    n'est construit qu'au-delà de SEUIL_CONSTRUCTION motifs distincts, quand son coût
+    est amorti par les recherches suivantes.
+    """
+
+    SEUIL_CONSTRUCTION = 48
+
+    def __init__(self, libelles):
+        self.libelles = [libelle or '' for libelle in libelles]
+        self.index = None
+        self._documents_par_motif = {}
+
+    def documents_contenant(self, motif):
+        """Rangs (croissants) des libellés contenant le motif"""
+        if self.index is not None:
+            return self.index.documents_contenant(motif)
+        if motif in self._documents_par_motif:
+            return self._documents_par_motif[motif]
+
+        if len(self._documents_par_motif) >= self.SEUIL_CONSTRUCTION:
+            self.index = IndexSousChaines(self.libelles)
+            self._documents_par_motif = {}
+            return self.index.documents_contenant(motif)
+
+        documents = [rang for rang, libelle in enumerate(self.libelles) if motif in libelle]
+        self._documents_par_motif[motif] = documents
+        return documents
+
+
+def construire_index_fec(fec_file_id):
+    """Construit l'index des libellés normalisés des écritures d'un FEC (ordre des identifiants)"""
+    from app.models import db
+    from app.models.ecriture_bancaire import EcritureBancaire
+    from app.utils.texte import normaliser_libelle
+
+    lignes = db.session.query(
+        EcritureBancaire.id,
+        EcritureBancaire.ecriture_lib_norm,
+        EcritureBancaire.ecriture_lib
+    ).filter_by(fec_file_id=fec_file_id).order_by(EcritureBancaire.id).all()
+
+    return IndexSousChaines(
+        [lib_norm or normaliser_libelle(lib) for _, lib_norm, lib in lignes],
+        identifiants=[ecriture_id for ecriture_id, _, _ in lignes]
+    )
+
+
+class CacheIndexLibelles:
+    """
+    Cache LRU en mémoire des index de FEC, chargés depuis la base ou construits à la première
+    recherche (jamais pendant l'import : la construction est différée hors de l'envoi du fichier)
+    """
+
+    def __init__(self, max_entries=8):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def init_app(self, app):
+        """Lit la taille maximale du cache depuis la configuration"""
+        self.max_entries = app.config.get('INDEX_LIBELLES_MAX_ENTRIES', self.max_entries)
+
+    @contextmanager
+    def sans_construction(self):
+        """Dans ce bloc (fil courant), index_pour_fec ne construit pas d'index absent et renvoie None"""
+        precedent = getattr(self._local, 'sans_construction', False)
+        self._local.sans_construction = True
+        try:
+            yield
+        finally:
+            self._local.sans_construction = precedent
+
+    def index_pour_fec(self, fec_file_id):
+        """
+        Index du FEC : mémoire, puis colonne FecFile.index_libelles, puis construction
+        (enregistrée dans FecFile.index_libelles pour les autres processus)
+
+        Returns:
+            IndexSousChaines, ou None s'il faudrait le construire dans un bloc sans_construction
+        """
+        with self._lock:
+            if fec_file_id in self._entries:
+                self._entries.move_to_end(fec_file_id)
+                return self._entries[fec_file_id]
+
+        from app.models import db
+        from app.models.fec_file import FecFile
+
+        donnees = db.session.query(FecFile.index_libelles).filter_by(id=fec_file_id).scalar()
+        index = IndexSousChaines.charger(donnees) if donnees else None
+        if index is None:
+            if getattr(self._local, 'sans_construction', False):
+                return None
+            index = construire_index_fec(fec_file_id)
+            _enregistrer_index(fec_file_id, index)
+
+        with self._lock:
+            self._entries[fec_file_id] = index
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return index
+
+    def invalidate_fec(self, fec_file_id):
+        with self._lock:
+            self._entries.pop(fec_file_id, None)
+
+
+def _enregistrer_index(fec_file_id, index):
+    """
+    Enregistre l'index construit dans FecFile.index_libelles, par une connexion distincte de la
+    session (la transaction de la requête n'est ni validée ni modifiée). Un échec n'empêche pas
+    d'utiliser l'index : il sera reconstruit par le prochain processus qui en a besoin.
+    """
+    from app.models import db
+    from app.models.fec_file import FecFile
+
+    table = FecFile.__table__
+    try:
+        with db.engine.begin() as connexion:
+            connexion.execute(
+                table.update().where(table.c.id == fec_file_id).values(index_libelles=index.serialiser())
+            )
+    except Exception as e:
+        print(f"⚠️ Index des libellés du FEC {fec_file_id} non enregistré: {e}")
+
+
+# Instance partagée par toute l'application
+index_libelles_cache = CacheIndexLibelles()
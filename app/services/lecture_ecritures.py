@@ -0,0 +1,60 @@
+from dataclasses import dataclass
+from datetime import date
+from decimal import Decimal
+from typing import Optional
+
+from app.models import db
+from app.models.ecriture_bancaire import EcritureBancaire
+
+
+@dataclass
+class EcritureLecture:
+    """
+    Écriture bancaire en lecture seule : les seules colonnes lues par le dashboard,
+    les statistiques, les règles et les suggestions
+
+    S'utilise comme un EcritureBancaire (mêmes noms d'attributs) sans en avoir le coût :
+    pas de suivi par la session (identity map), pas de colonnes inutiles, __slots__.
+    """
+    __slots__ = (
+        'id', 'fec_file_id', 'journal_code', 'journal_lib', 'ecriture_num', 'ecriture_date',
+        'piece_ref', 'ecriture_lib', 'ecriture_lib_norm', 'montant', 'sens',
+        'compte_final', 'libelle_final', 'compte_contrepartie', 'libelle_contrepartie'
+    )
+
+    id: int
+    fec_file_id: int
+    journal_code: str
+    journal_lib: str
+    ecriture_num: str
+    ecriture_date: date
+    piece_ref: Optional[str]
+    ecriture_lib: str
+    ecriture_lib_norm: Optional[str]
+    montant: Decimal
+    sens: str
+    compte_final: str
+    libelle_final: str
+    compte_contrepartie: Optional[str]
+    libelle_contrepartie: Optional[str]
+
+
+COLONNES_LECTURE = tuple(getattr(EcritureBancaire, champ) for champ in EcritureLecture.__slots__)
+
+
+def ecritures_lecture(fec_file_id, comptes=None):
+    """
+    Écritures d'un FEC en lecture seule, par ordre d'identifiant
+
+    Une seule requête sur les colonnes de COLONNES_LECTURE, dont les lignes sont converties
+    directement en EcritureLecture sans passer par l'ORM.
+
+    Args:
+        fec_file_id (int): FEC lu
+        comptes (iterable): restreint aux écritures de ces comptes de contrepartie (None = toutes)
+    """
+    requete = db.select(*COLONNES_LECTURE).where(EcritureBancaire.fec_file_id == fec_file_id)
+    if comptes is not None:
+        requete = requete.where(EcritureBancaire.compte_contrepartie.in_(sorted(comptes)))
+    requete = requete.order_by(EcritureBancaire.id)
+    return [EcritureLecture(*ligne) for ligne in db.session.execute(requete)]
@@ -0,0 +1,96 @@
+from array import array
+from collections import Counter
+
+
+class MatriceNgrammes:
+    """
+    Matrice creuse documents × n-grams de mots (format CSR), avec identifiants entiers
+
+    Chaque mot reçoit un identifiant et ses propriétés (longueur, numérique, mot vide)
+    ne sont évaluées qu'une fois ; un n-gram est identifié par le tuple des identifiants
+    de ses mots. Les fréquences documentaires sont les sommes des colonnes et la colonne
+    d'un n-gram (ses documents, triés) sert de signature exacte de couverture.
+
+    Filtres identiques à RuleSuggester.extract_ngrams_all : n-grams sans mot court
+    (< 3 caractères) ni numérique, ne commençant ni ne finissant par un mot vide.
+    """
+
+    def __init__(self, libelles, stop_words, n_max=4, min_df=1):
+        self.nb_documents = len(libelles)
+        self.min_df = min_df
+
+        vocabulaire = {}
+        self.mots = []
+        valides = []
+        vides = []
+
+        self._ngrammes = {}
+        self._cles = []
+
+        # CSR : colonnes (n-grams distincts) du document d dans indices[indptr[d]:indptr[d + 1]]
+        self.indptr = array('I', [0])
+        self.indices = array('I')
+
+        for libelle in libelles:
+            ids = []
+            for mot in libelle.split():
+                t = vocabulaire.get(mot)
+                if t is None:
+                    t = vocabulaire[mot] = len(self.mots)
+                    self.mots.append(mot)
+                    valides.append(len(mot) >= 3 and not mot.isdigit())
+                    vides.append(mot.lower() in stop_words)
+                ids.append(t)
+
+            colonnes = set()
+            nb_mots = len(ids)
+            for i in range(nb_mots):
+                premier = ids[i]
+                if not valides[premier] or vides[premier]:
+                    continue
+                for j in range(i, min(nb_mots, i + n_max)):
+                    dernier = ids[j]
+                    if not valides[dernier]:
+                        break
+                    if vides[dernier]:
+                        continue
+                    cle = tuple(ids[i:j + 1])
+                    colonne = self._ngrammes.get(cle)
+                    if colonne is None:
+                        colonne = self._ngrammes[cle] = len(self._cles)
+                        self._cles.append(cle)
+                    colonnes.add(colonne)
+
+            self.indices.extend(sorted(colonnes))
+            self.indptr.append(len(self.indices))
+
+        # Fréquences documentaires : somme de chaque colonne
+        self.df = array('I', bytes(4 * len(self._cles)))
+        for colonne in self.indices:
+            self.df[colonne] += 1
+
+        # CSC restreinte aux n-grams retenus : documents (croissants) de chaque colonne
+        self._colonnes = {c: array('I') for c, df in enumerate(self.df) if df >= min_df}
+        for document in range(self.nb_documents):
+            for colonne in self.indices[self.indptr[document]:self.indptr[document + 1]]:
+                documents = self._colonnes.get(colonne)
+                if documents is not None:
+                    documents.append(document)
+
+        self._colonne_par_texte = {self.texte(c): c for c in self._colonnes}
+
+    def texte(self, colonne):
+        """N-gram (mots séparés par une espace) d'une colonne"""
+        return ' '.join(self.mots[t] for t in self._cles[colonne])
+
+    def frequences(self):
+        """Counter {n-gram: fréquence documentaire} des n-grams retenus (df >= min_df)"""
+        return Counter({texte: self.df[colonne] for texte, colonne in self._colonne_par_texte.items()})
+
+    def documents(self, ngram):
+        """Rangs (croissants) des documents contenant le n-gram retenu"""
+        return self._colonnes[self._colonne_par_texte[ngram]]
+
+    def signature(self, ngram):
+        """Signature exacte de l'ensemble des documents couverts par le n-gram"""
+        return self.documents(ngram).tobytes()
@@ -0,0 +1,149 @@
+import base64
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+from sqlalchemy import and_, or_
+
+from app.models.ecriture_bancaire import EcritureBancaire
+
+# Colonnes de tri autorisées (chacune départagée par l'id, dernière colonne des index)
+COLONNES_TRI = {
+    'date': EcritureBancaire.ecriture_date,
+    'montant': EcritureBancaire.montant,
+    'libelle': EcritureBancaire.ecriture_lib,
+    'id': EcritureBancaire.id,
+}
+
+LIMITE_MAX = 500
+# Au-delà, le filtre par identifiants (recherche) est appliqué en Python plutôt qu'en SQL (IN)
+MAX_IDENTIFIANTS_SQL = 900
+
+
+class CurseurInvalide(ValueError):
+    """Curseur de pagination illisible ou incompatible avec le tri demandé"""
+
+
+def _valeur_serialisable(valeur):
+    if isinstance(valeur, (date, datetime)):
+        return valeur.isoformat()
+    if isinstance(valeur, Decimal):
+        return str(valeur)
+    return valeur
+
+
+def encoder_curseur(tri, ecriture):
+    """Curseur opaque désignant la position d'une écriture dans l'ordre de tri"""
+    valeur = _valeur_serialisable(getattr(ecriture, COLONNES_TRI[tri].key))
+    brut = json.dumps([tri, valeur, ecriture.id], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(brut).decode('ascii')
+
+
+def decoder_curseur(tri, curseur):
+    """(valeur de tri, id) du curseur ; CurseurInvalide si le curseur ou sa valeur est illisible"""
+    try:
+        tri_curseur, valeur, ecriture_id = json.loads(base64.urlsafe_b64decode(curseur.encode('ascii')))
+        if tri_curseur != tri:
+            raise CurseurInvalide('Curseur obtenu avec un autre tri')
+        if tri == 'date':
+            valeur = date.fromisoformat(valeur)
+        elif tri == 'montant':
+            valeur = Decimal(valeur)
+            if not valeur.is_finite():
+                raise CurseurInvalide('Curseur invalide')
+        elif tri == 'libelle' and not isinstance(valeur, str):
+            raise CurseurInvalide('Curseur invalide')
+        return valeur, int(ecriture_id)
+    except CurseurInvalide:
+        raise
+    except (ValueError, TypeError, ArithmeticError) as e:
+        raise CurseurInvalide('Curseur invalide') from e
+
+
+def page_ecritures(fec_file_id, filtres=None, tri='date', ordre='asc', curseur=None, limite=100,
+                   ecritures_couvertes=None, identifiants=None):
+    """
+    Page d'écritures d'un FEC, filtrée et triée, paginée par curseur (keyset)
+
+    Les filtres compte, journal et dates sont appliqués en SQL et servis par les index
+    (fec_file_id, colonne, ..., id). Les filtres qui reposent sur des ensembles calculés
+    côté application (écritures couvertes par les règles, identifiants trouvés par la
+    recherche dans l'index des libellés) sont appliqués au fil de lots de lignes lus dans
+    l'ordre de l'index.
+
+    Args:
+        fec_file_id (int): FEC interrogé
+        filtres (dict): compte, journal, date_debut, date_fin (date), couverture ('couvertes' ou 'non_couvertes')
+        tri (str): clé de COLONNES_TRI
+        ordre (str): 'asc' ou 'desc'
+        curseur (str): curseur renvoyé par la page précédente
+        limite (int): nombre d'écritures par page (au plus LIMITE_MAX)
+        ecritures_couvertes (set): identifiants couverts, requis pour le filtre couverture
+        identifiants (set): restreint la page à ces identifiants (None = pas de restriction)
+
+    Returns:
+        tuple: (écritures de la page, curseur de la page suivante ou None)
+    """
+    filtres = filtres or {}
+    colonne = COLONNES_TRI[tri]
+    descendant = ordre == 'desc'
+    limite = max(1, min(limite, LIMITE_MAX))
+
+    requete = EcritureBancaire.query.filter(EcritureBancaire.fec_file_id == fec_file_id)
+    if filtres.get('compte'):
+        requete = requete.filter(EcritureBancaire.compte_contrepartie == filtres['compte'])
+    if filtres.get('journal'):
+        requete = requete.filter(EcritureBancaire.journal_code == filtres['journal'])
+    if filtres.get('date_debut'):
+        requete = requete.filter(EcritureBancaire.ecriture_date >= filtres['date_debut'])
+    if filtres.get('date_fin'):
+        requete = requete.filter(EcritureBancaire.ecriture_date <= filtres['date_fin'])
+    if identifiants is not None and len(identifiants) <= MAX_IDENTIFIANTS_SQL:
+        requete = requete.filter(EcritureBancaire.id.in_(sorted(identifiants)))
+        identifiants = None
+
+    if descendant:
+        requete = requete.order_by(colonne.desc(), EcritureBancaire.id.desc())
+    else:
+        requete = requete.order_by(colonne.asc(), EcritureBancaire.id.asc())
+
+    couverture = filtres.get('couverture')
+
+    def retenue(ecriture):
+        if identifiants is not None and ecriture.id not in identifiants:
+            return False
+        if couverture == 'couvertes':
+            return ecriture.id in ecritures_couvertes
+        if couverture == 'non_couvertes':
+            return ecriture.id not in ecritures_couvertes
+        return True
+
+    filtre_applicatif = identifiants is not None or couverture in ('couvertes', 'non_couvertes')
+
+    def apres(valeur, ecriture_id):
+        if tri == 'id':
+            return EcritureBancaire.id < ecriture_id if descendant else EcritureBancaire.id > ecriture_id
+        if descendant:
+            return or_(colonne < valeur, and_(colonne == valeur, EcritureBancaire.id < ecriture_id))
+        return or_(colonne > valeur, and_(colonne == valeur, EcritureBancaire.id > ecriture_id))
+
+    position = decoder_curseur(tri, curseur) if curseur else None
+    ecritures = []
+    taille_lot = limite + 1
+    while len(ecritures) <= limite:
+        lot_requete = requete.filter(apres(*position)) if position else requete
+        lot = lot_requete.limit(taille_lot).all()
+        for ecriture in lot:
+            if not filtre_applicatif or retenue(ecriture):
+                ecritures.append(ecriture)
+                if len(ecritures) > limite:
+                    break
+        if len(lot) < taille_lot:
+            break
+        position = (getattr(lot[-1], colonne.key), lot[-1].id)
+        # Filtre sélectif : lots de plus en plus grands pour limiter le nombre de requêtes
+        taille_lot = min(taille_lot * 2, 5000)
+
+    if len(ecritures) > limite:
+        return ecritures[:limite], encoder_curseur(tri, ecritures[limite - 1])
+    return ecritures, None
@@ -1,6 +1,104 @@
+from collections import defaultdict
+
+from app.services.index_libelles import IndexProgressif, index_libelles_cache
+from app.utils.texte import normaliser_libelle, libelle_normalise
+
+
+class IndexComptes:
+    """Vue des écritures indexée par compte de contrepartie (construite une seule fois par jeu d'écritures)"""
+
+    def __init__(self, ecritures, get_compte_contrepartie):
+        self.ecritures_par_compte = defaultdict(list)
+        self.compte_par_ecriture = {}
+
+        for ecriture in ecritures:
+            compte = get_compte_contrepartie(ecriture)
+            self.ecritures_par_compte[compte].append(ecriture)
+            self.compte_par_ecriture[ecriture.id] = compte
+
+        self.totaux = {compte: len(liste) for compte, liste in self.ecritures_par_compte.items()}
+
+    def compte_de(self, ecriture):
+        """Compte de contrepartie d'une écriture de l'index"""
+        return self.compte_par_ecriture[ecriture.id]
+
+    def total(self, compte):
+        """Nombre d'écritures du compte"""
+        return self.totaux.get(compte, 0)
+
+
+class IndexLibelles:
+    """
+    Recherche par sous-chaîne dans une liste d'écritures
+
+    Réutilise l'index du FEC quand toutes les écritures viennent du même FEC (et qu'il est
+    disponible), sinon indexe les libellés de la liste.
+    """
+
+    def __init__(self, ecritures):
+        self._positions = None
+        self.index = None
+
+        fec_ids = {getattr(ecriture, 'fec_file_id', None) for ecriture in ecritures}
+        index = None
+        if len(fec_ids) == 1 and None not in fec_ids:
+            index = index_libelles_cache.index_pour_fec(fec_ids.pop())
+        if index is not None:
+            position_par_id = {ecriture.id: position for position, ecriture in enumerate(ecritures)}
+            if len(position_par_id) == len(ecritures) and position_par_id.keys() <= set(index.identifiants):
+                # Rang dans l'index du FEC -> position dans la liste (None si absente de la liste)
+                self._positions = [position_par_id.get(ecriture_id) for ecriture_id in index.identifiants]
+                self.index = index
+
+        if self.index is None:
+            self.index = IndexProgressif([libelle_normalise(ecriture) for ecriture in ecritures])
+
+    def positions_contenant(self, motif):
+        """Positions (croissantes) dans la liste des écritures dont le libellé contient le motif"""
+        rangs = self.index.documents_contenant(motif)
+        if self._positions is None:
+            return rangs
+        return sorted(p for p in (self._positions[rang] for rang in rangs) if p is not None)
+
+
+class ResultatAffectation:
+    """Résultat de l'évaluation ordonnée des règles : une règle gagnante par écriture"""
+
+    def __init__(self):
+        # ecriture_id -> règle gagnante
+        self.affectations = {}
+        # ecriture_id -> règles qui matchent aussi mais sont masquées par la gagnante
+        self.masquees = defaultdict(list)
+
+    @property
+    def ecritures_couvertes(self):
+        """Identifiants des écritures affectées à une règle"""
+        return set(self.affectations)
+
+    @property
+    def conflits(self):
+        """Écritures dont une règle masquée vise un autre compte que la règle gagnante"""
+        return {
+            ecriture_id
+            for ecriture_id, regles in self.masquees.items()
+            if any(regle.compte_destination != self.affectations[ecriture_id].compte_destination
+                   for regle in regles)
+        }
+
+    def regle_de(self, ecriture):
+        """Règle gagnante d'une écriture (None si non couverte)"""
+        return self.affectations.get(ecriture.id)
+
+
 class RegleTester:
     """Service pour tester les règles d'affectation sur les écritures bancaires"""
 
+    def __init__(self):
+        # (liste d'écritures, IndexComptes) du dernier jeu d'écritures indexé
+        self._index_comptes = None
+        # (liste d'écritures, IndexLibelles) du dernier jeu d'écritures indexé
+        self._index_libelles = None
+
     def test_regle(self, regle_data, ecritures):
         """
         Teste une règle sur une liste d'écritures bancaires
@@ -14,12 +112,19 @@ class RegleTester:
         """
         matching_ecritures = []
 
-        # Extraire les critères de la règle
-        mots_cles = [mot.strip().lower() for mot in regle_data.get('mots_cles', [])]
+        # Extraire les critères de la règle (mots-clés normalisés comme les libellés stockés)
+        mots_cles = [normaliser_libelle(mot) for mot in regle_data.get('mots_cles', [])]
         journal_code = regle_data.get('journal_code')
         criteres_montant = regle_data.get('criteres_montant')
 
-        for ecriture in ecritures:
+        # Seules les écritures contenant l'un des mots-clés sont examinées
+        index = self.index_libelles(ecritures)
+        positions = set()
+        for mot_cle in mots_cles:
+            positions.update(index.positions_contenant(mot_cle))
+
+        for position in sorted(positions):
+            ecriture = ecritures[position]
             if self._ecriture_matches_regle(ecriture, mots_cles, journal_code, criteres_montant):
                 matching_ecritures.append(ecriture)
 
@@ -44,6 +149,66 @@ class RegleTester:
 
         return self.test_regle(regle_data, ecritures)
 
+    def cle_priorite(self, regle):
+        """
+        Clé de tri des règles : priorité décroissante, puis spécificité décroissante
+        (nombre de critères, longueur du mot-clé le plus long), puis ancienneté
+        """
+        nb_criteres = (1 if regle.journal_code else 0) + (1 if regle.criteres_montant else 0)
+        longueur_mot_cle = max((len(normaliser_libelle(mot)) for mot in regle.mots_cles or []), default=0)
+        return (-(regle.priorite or 0), -nb_criteres, -longueur_mot_cle, regle.id or 0)
+
+    def affecter_ecritures(self, regles, ecritures):
+        """
+        Évalue les règles actives dans l'ordre de priorité : chaque écriture est
+        affectée à la première règle qui la couvre, les autres règles qui la couvrent
+        sont conservées comme correspondances masquées.
+
+        Chaque mot-clé distinct est recherché une fois dans l'index des libellés ;
+        seules les écritures qui en contiennent au moins un sont examinées.
+
+        Args:
+            regles (list): Objets RegleAffectation (les règles inactives sont ignorées)
+            ecritures (list): Liste des objets EcritureBancaire
+
+        Returns:
+            ResultatAffectation: affectations et correspondances masquées
+        """
+        resultat = ResultatAffectation()
+        regles_ordonnees = sorted((r for r in regles if r.is_active), key=self.cle_priorite)
+        if not regles_ordonnees:
+            return resultat
+
+        mots_cles_distincts = {}
+        criteres = []
+        for regle in regles_ordonnees:
+            indices = []
+            for mot in regle.mots_cles or []:
+                indices.append(mots_cles_distincts.setdefault(normaliser_libelle(mot), len(mots_cles_distincts)))
+            criteres.append((regle, indices, regle.journal_code, regle.criteres_montant))
+
+        index = self.index_libelles(ecritures)
+        positions_par_mot_cle = [set(index.positions_contenant(mot_cle)) for mot_cle in mots_cles_distincts]
+
+        for position in sorted(set().union(*positions_par_mot_cle)):
+            ecriture = ecritures[position]
+            presences = [position in positions for positions in positions_par_mot_cle]
+
+            for regle, indices, journal_code, criteres_montant in criteres:
+                if not any(presences[i] for i in indices):
+                    continue
+                if journal_code and ecriture.journal_code != journal_code:
+                    continue
+                if criteres_montant and not self._test_critere_montant(ecriture.montant, criteres_montant):
+                    continue
+
+                if ecriture.id in resultat.affectations:
+                    resultat.masquees[ecriture.id].append(regle)
+                else:
+                    resultat.affectations[ecriture.id] = regle
+
+        return resultat
+
     def _ecriture_matches_regle(self, ecriture, mots_cles, journal_code, criteres_montant):
         """
         Vérifie si une écriture match une règle
@@ -61,8 +226,8 @@ class RegleTester:
         if not mots_cles:
             return False
 
-        libelle_lower = ecriture.ecriture_lib.lower()
-        mot_cle_match = any(mot_cle in libelle_lower for mot_cle in mots_cles)
+        libelle_norm = libelle_normalise(ecriture)
+        mot_cle_match = any(mot_cle in libelle_norm for mot_cle in mots_cles)
 
         if not mot_cle_match:
             return False
@@ -172,14 +337,14 @@ class RegleTester:
                 'detail_collisions': []
             }
 
-        # 2. Séparer les matches par compte
+        # 2. Séparer les matches par compte (lecture dans l'index, O(matches))
+        index = self.index_comptes(ecritures)
         matches_compte_selectionne = []
         matches_autres_comptes = []
         detail_collisions = []
 
         for ecriture in nouvelles_matches:
-            # Déterminer le compte de contrepartie
-            compte_contrepartie = self._get_compte_contrepartie(ecriture)
+            compte_contrepartie = index.compte_de(ecriture)
 
             if compte_contrepartie == compte_selectionne:
                 matches_compte_selectionne.append(ecriture)
@@ -212,15 +377,37 @@ class RegleTester:
     def _get_compte_contrepartie(self, ecriture):
         """
         Détermine le compte de contrepartie d'une écriture bancaire
+
+        Le compte est calculé à l'import (contrepartie principale de l'écriture)
+        et stocké dans compte_contrepartie.
         """
-        # Si l'écriture elle-même n'est pas 512*, utiliser son compte final
+        if getattr(ecriture, 'compte_contrepartie', None):
+            return ecriture.compte_contrepartie
+
+        # Lignes importées avant l'ajout de la colonne
         if not ecriture.compte_final.startswith('512'):
             return ecriture.compte_final
 
-        # Sinon, cette logique devrait être améliorée pour trouver la vraie contrepartie
-        # Pour l'instant, on utilise un placeholder
         return "AUTRE"
 
+    def index_comptes(self, ecritures):
+        """
+        Retourne l'index par compte des écritures, construit au premier appel
+        puis réutilisé tant que la même liste d'écritures est testée
+        """
+        if self._index_comptes is None or self._index_comptes[0] is not ecritures:
+            self._index_comptes = (ecritures, IndexComptes(ecritures, self._get_compte_contrepartie))
+        return self._index_comptes[1]
+
+    def index_libelles(self, ecritures):
+        """
+        Retourne l'index des libellés des écritures, construit (ou chargé) au premier appel
+        puis réutilisé tant que la même liste d'écritures est testée
+        """
+        if self._index_libelles is None or self._index_libelles[0] is not ecritures:
+            self._index_libelles = (ecritures, IndexLibelles(ecritures))
+        return self._index_libelles[1]
+
     def test_regle_avec_collision(self, regle_data, ecritures, compte_selectionne, regles_existantes):
         """
         Test complet d'une règle avec calcul de collision
@@ -228,24 +415,85 @@ class RegleTester:
         Returns:
             dict: Résultats complets incluant collision
         """
-        # Test basique de la règle
-        matches = self.test_regle(regle_data, ecritures)
+        return self.test_regles_batch([regle_data], ecritures, compte_selectionne)[0]
 
-        # Calcul de collision
-        collision_info = self.calculer_collision_pourcentage(
-            regle_data, regles_existantes, ecritures, compte_selectionne
-        )
+    def test_regles_batch(self, regles_data, ecritures, compte_selectionne):
+        """
+        Teste plusieurs règles candidates en un seul passage sur les écritures
 
-        # Statistiques globales
-        total_ecritures_compte = len([e for e in ecritures
-                                      if self._get_compte_contrepartie(e) == compte_selectionne])
+        Les mots-clés distincts de toutes les candidates sont recherchés une fois dans
+        l'index des libellés, puis chaque candidate combine ses résultats avec ses
+        critères de journal et de montant.
 
-        return {
-            'nb_matches_total': len(matches),
-            'nb_matches_compte': collision_info['transactions_compte_selectionne'],
-            'nb_matches_autres': collision_info['transactions_autres_comptes'],
-            'pourcentage_collision': collision_info['pourcentage_collision'],
-            'pourcentage_couverture': (collision_info['transactions_compte_selectionne'] / total_ecritures_compte * 100)
-            if total_ecritures_compte > 0 else 0,
-            'detail_collisions': collision_info['detail_collisions']
-        }
\ No newline at end of file
+        Args:
+            regles_data (list): Configurations des règles candidates (même format que test_regle)
+            ecritures (list): Liste des objets EcritureBancaire
+            compte_selectionne (str): Le compte pour lequel on calcule couverture et collision
+
+        Returns:
+            list: Un résultat par candidate, au format de test_regle_avec_collision
+        """
+        candidates = []
+        mots_cles_distincts = {}
+        for regle_data in regles_data:
+            mots_cles = [normaliser_libelle(mot) for mot in regle_data.get('mots_cles', [])]
+            for mot_cle in mots_cles:
+                mots_cles_distincts.setdefault(mot_cle, len(mots_cles_distincts))
+            candidates.append({
+                'mots_cles': [mots_cles_distincts[mot_cle] for mot_cle in mots_cles],
+                'journal_code': regle_data.get('journal_code'),
+                'criteres_montant': regle_data.get('criteres_montant'),
+                'nb_matches_compte': 0,
+                'nb_matches_autres': 0,
+                'detail_collisions': []
+            })
+
+        # Totaux par compte et compte de chaque écriture : lus dans l'index, sans second parcours
+        index = self.index_comptes(ecritures)
+        total_ecritures_compte = index.total(compte_selectionne)
+
+        index_libelles = self.index_libelles(ecritures)
+        positions_par_mot_cle = [set(index_libelles.positions_contenant(mot_cle)) for mot_cle in mots_cles_distincts]
+
+        for position in sorted(set().union(*positions_par_mot_cle)):
+            ecriture = ecritures[position]
+            presences = [position in positions for positions in positions_par_mot_cle]
+
+            compte_contrepartie = index.compte_de(ecriture)
+
+            for candidate in candidates:
+                if not any(presences[i] for i in candidate['mots_cles']):
+                    continue
+                if candidate['journal_code'] and ecriture.journal_code != candidate['journal_code']:
+                    continue
+                if candidate['criteres_montant'] and not self._test_critere_montant(
+                        ecriture.montant, candidate['criteres_montant']):
+                    continue
+
+                if compte_contrepartie == compte_selectionne:
+                    candidate['nb_matches_compte'] += 1
+                else:
+                    candidate['nb_matches_autres'] += 1
+                    candidate['detail_collisions'].append({
+                        'compte': compte_contrepartie,
+                        'libelle': ecriture.ecriture_lib,
+                        'montant': float(ecriture.montant)
+                    })
+
+        resultats = []
+        for candidate in candidates:
+            nb_matches_compte = candidate['nb_matches_compte']
+            nb_matches_autres = candidate['nb_matches_autres']
+            pourcentage_collision = (nb_matches_autres / nb_matches_compte * 100) if nb_matches_compte > 0 else 0.0
+
+            resultats.append({
+                'nb_matches_total': nb_matches_compte + nb_matches_autres,
+                'nb_matches_compte': nb_matches_compte,
+                'nb_matches_autres': nb_matches_autres,
+                'pourcentage_collision': round(pourcentage_collision, 1),
+                'pourcentage_couverture': (nb_matches_compte / total_ecritures_compte * 100)
+                if total_ecritures_compte > 0 else 0,
+                'detail_collisions': candidate['detail_collisions']
+            })
+
+        return resultats
@@ -1,12 +1,156 @@
 import re
-from collections import Counter
+import time
+from collections import Counter, defaultdict
+from functools import lru_cache
 from typing import List, Dict, Optional, Set, Counter as TypingCounter
 
+from app.services.index_libelles import IndexProgressif
+from app.services.ngrammes import MatriceNgrammes
+from app.utils.texte import normaliser_libelle
+
+try:
+    from unidecode import unidecode
+except ImportError:
+    unidecode = None
+
+
+@lru_cache(maxsize=65536)
+def normaliser_pour_comparaison(text: str) -> str:
+    """Normalisation unifiée pour comparaisons (collision, fuzzy), mémorisée par texte"""
+    if not text:
+        return ""
+    if unidecode is not None:
+        normalized = unidecode(text.upper()).strip()
+    else:
+        normalized = text.upper().strip()
+    # Supprimer caractères spéciaux mais garder espaces et tirets
+    normalized = re.sub(r'[^\w\s-]', ' ', normalized)
+    normalized = re.sub(r'\s+', ' ', normalized).strip()
+    return normalized
+
+
+def compte_de_transaction(trans: Dict) -> Optional[str]:
+    """Compte de contrepartie d'une transaction (hors comptes de banque 512)"""
+    if trans.get('compte_contrepartie'):
+        return trans['compte_contrepartie']
+    if trans.get('compte_final') and not trans['compte_final'].startswith('512'):
+        return trans['compte_final']
+    if trans.get('compte_num') and not trans['compte_num'].startswith('512'):
+        return trans['compte_num']
+    return None
+
+
+class CorpusSuggestion:
+    """
+    Pré-calculs partagés par toutes les analyses de comptes d'une même société
+
+    Les libellés sont normalisés une seule fois, les transactions partitionnées par compte
+    et un index par sous-chaînes permet de ne tester une règle que sur les libellés
+    qui contiennent ses mots-clés.
+    """
+
+    def __init__(self, transactions: List[Dict], suggester: 'RuleSuggester'):
+        self.transactions = transactions
+        self.suggester = suggester
+        self.libelles_norm = []
+        self.partitions = defaultdict(list)
+
+        for i, trans in enumerate(transactions):
+            libelle = suggester.libelle_norm(trans)
+            trans.setdefault('ecriture_lib_norm', libelle)
+            self.libelles_norm.append(libelle)
+            self.partitions[trans.get('compte_contrepartie')].append(i)
+
+        self.index = IndexProgressif(self.libelles_norm)
+        self._libelles_comparaison = None
+
+    @property
+    def comptes(self) -> List[str]:
+        return sorted(compte for compte in self.partitions if compte)
+
+    def transactions_compte(self, compte: str) -> List[Dict]:
+        return [self.transactions[i] for i in self.partitions.get(compte, [])]
+
+    def _preparer_comparaison(self):
+        """Libellés normalisés pour comparaison (fuzzy) et leur index, calculés au premier besoin"""
+        if self._libelles_comparaison is None:
+            self._comptes_comparaison = [compte_de_transaction(trans) for trans in self.transactions]
+            self._libelles_comparaison = [self.suggester.normalize_for_comparison(trans['ecriture_lib'])
+                                          for trans in self.transactions]
+            self._index_comparaison = IndexProgressif(self._libelles_comparaison)
+            self._nb_par_compte = Counter(c for c in self._comptes_comparaison if c)
+            self._collisions = {}
+
+    def libelles_comparaison_hors_compte(self, compte: str) -> List[str]:
+        """Libellés normalisés pour comparaison (fuzzy) des transactions des autres comptes"""
+        self._preparer_comparaison()
+        return [libelle for trans_compte, libelle in zip(self._comptes_comparaison, self._libelles_comparaison)
+                if trans_compte and trans_compte != compte]
+
+    def nb_hors_compte(self, compte: str) -> int:
+        """Nombre de transactions rattachées à un autre compte"""
+        self._preparer_comparaison()
+        return sum(self._nb_par_compte.values()) - self._nb_par_compte.get(compte, 0)
+
+    def collisions_hors_compte(self, compte: str, mot_cle_norm: str) -> int:
+        """Nombre de libellés (forme de comparaison) des autres comptes contenant le mot-clé, mémorisé"""
+        self._preparer_comparaison()
+        cle = (compte, mot_cle_norm)
+        if cle not in self._collisions:
+            comptes = self._comptes_comparaison
+            self._collisions[cle] = sum(
+                1 for rang in self._index_comparaison.documents_contenant(mot_cle_norm)
+                if comptes[rang] and comptes[rang] != compte
+            )
+        return self._collisions[cle]
+
+    def documents_contenant(self, motif: str) -> List[int]:
+        return self.index.documents_contenant(motif)
+
+    def transactions_contenant(self, *motifs: str) -> List[Dict]:
+        """Transactions contenant tous les motifs, dans l'ordre d'origine"""
+        documents = self.documents_contenant(motifs[0])
+        for motif in motifs[1:]:
+            autres = set(self.documents_contenant(motif))
+            documents = [i for i in documents if i in autres]
+        return [self.transactions[i] for i in documents]
+
+
+class BudgetRecherche:
+    """
+    Budget de temps d'une recherche de règles (mode « à tout moment »)
+
+    Les sources de candidats coûteuses (fuzzy, n-grams, combinaisons de mots) demandent
+    l'autorisation au budget avant de s'exécuter. Une fois l'échéance passée elles sont
+    ignorées : la recherche rend les meilleures règles trouvées jusque-là et n'est plus
+    exhaustive.
+    """
+
+    def __init__(self, secondes: Optional[float] = None):
+        self.secondes = secondes
+        self.echeance = time.monotonic() + secondes if secondes is not None else None
+        self.etapes_ignorees = []
+
+    @property
+    def exhaustif(self) -> bool:
+        """Vrai si aucune source de candidats n'a été ignorée faute de temps"""
+        return not self.etapes_ignorees
+
+    def epuise(self) -> bool:
+        return self.echeance is not None and time.monotonic() >= self.echeance
+
+    def autorise(self, etape: str) -> bool:
+        """Autorise une étape coûteuse, ou la note comme ignorée si le budget est épuisé"""
+        if self.epuise():
+            self.etapes_ignorees.append(etape)
+            return False
+        return True
+
 
 class RuleSuggester:
     """Algorithme Affectia pour suggérer des règles d'affectation des transactions bancaires"""
 
-    def __init__(self, debug: bool = False):
+    def __init__(self, debug: bool = False, taille_echantillon: int = 0):
         # Mots vides étendus (français + termes financiers génériques)
         self.stop_words = {
             'de', 'du', 'des', 'le', 'la', 'les', 'un', 'une', 'et', 'ou', 'pour', 'par', 'sur', 'avec', 'sans',
@@ -17,18 +161,41 @@ class RuleSuggester:
         self.min_occurrences = 3
         # Mode débogage (verbose) désactivé par défaut
         self.debug = debug
+        # Au-delà de ce nombre de transactions, les candidats d'un compte sont extraits d'un
+        # échantillon stratifié puis vérifiés sur toutes ses transactions (0 = désactivé)
+        self.taille_echantillon = taille_echantillon
+        # Nombre de candidats issus de l'échantillon vérifiés exactement
+        self.candidats_verifies = 10
+        # Dernier corpus construit (réutilisé tant que la liste de transactions est la même)
+        self._corpus = None
+        # (liste de transactions, IndexProgressif) de la dernière liste indexée
+        self._index_transactions = None
 
     def normalize_text(self, text: str) -> str:
-        """Normalise un texte (majuscules, suppression des accents)"""
-        if not text:
-            return ""
-        text = text.upper()
-        accents = {'À': 'A', 'Á': 'A', 'Â': 'A', 'Ã': 'A', 'Ä': 'A', 'Ç': 'C', 'È': 'E', 'É': 'E', 'Ê': 'E', 'Ë': 'E',
-                   'Ì': 'I', 'Í': 'I', 'Î': 'I', 'Ï': 'I', 'Ñ': 'N', 'Ò': 'O', 'Ó': 'O', 'Ô': 'O', 'Õ': 'O', 'Ö': 'O',
-                   'Ù': 'U', 'Ú': 'U', 'Û': 'U', 'Ü': 'U', 'Ý': 'Y'}
-        for accent, normal in accents.items():
-            text = text.replace(accent, normal)
-        return text
+        """Normalise un texte (majuscules, suppression des accents, espaces réduits)"""
+        return normaliser_libelle(text)
+
+    def normalize_for_comparison(self, text: str) -> str:
+        """Normalisation unifiée pour comparaisons (collision, fuzzy)"""
+        return normaliser_pour_comparaison(text)
+
+    def corpus_pour(self, all_transactions: List[Dict]) -> CorpusSuggestion:
+        """Corpus (libellés normalisés + index de collisions) de la liste, construit une seule fois"""
+        if self._corpus is None or self._corpus.transactions is not all_transactions:
+            self._corpus = CorpusSuggestion(all_transactions, self)
+        return self._corpus
+
+    def index_pour(self, transactions: List[Dict]) -> IndexProgressif:
+        """Index par sous-chaînes des libellés normalisés de la liste, construit une seule fois"""
+        if self._corpus is not None and self._corpus.transactions is transactions:
+            return self._corpus.index
+        if self._index_transactions is None or self._index_transactions[0] is not transactions:
+            self._index_transactions = (transactions, IndexProgressif([self.libelle_norm(t) for t in transactions]))
+        return self._index_transactions[1]
+
+    def libelle_norm(self, trans: Dict) -> str:
+        """Libellé normalisé d'une transaction, lu depuis 'ecriture_lib_norm' (calculé à l'import) si présent"""
+        return trans.get('ecriture_lib_norm') or normaliser_libelle(trans['ecriture_lib'])
 
     def extract_ngrams(self, text: str, max_length: int = 5) -> Set[str]:
         """Extrait tous les n-grams uniques de 1 à max_length mots d'un texte"""
@@ -43,7 +210,8 @@ class RuleSuggester:
                 ngrams_set.add(ngram)
         return ngrams_set
 
-    def extract_ngrams_all(self, libelles: List[str], n_max: int = 4, min_df: int = 3, max_set: int = 50) -> tuple[
+    def extract_ngrams_all(self, libelles: List[str], n_max: int = 4, min_df: int = 3, max_set: int = 50,
+                           normalized: bool = False) -> tuple[
         dict[str, set[int] | tuple[int, int]], TypingCounter]:
         """
         Extrait tous les n-grams de tous les libellés avec optimisation mémoire
@@ -53,6 +221,7 @@ class RuleSuggester:
             n_max: Nombre maximum de mots par n-gram
             min_df: Fréquence documentaire minimale pour retenir un n-gram
             max_set: Seuil au-dessus duquel on ne stocke que le compteur (pas les indices)
+            normalized: True si les libellés sont déjà normalisés (ecriture_lib_norm)
 
         Returns:
             tuple: (ngram_indices_dict, df_counter)
@@ -60,65 +229,28 @@ class RuleSuggester:
                 - df_counter: Counter des fréquences documentaires
         """
         # Cache de normalisation pour éviter les appels redondants
-        normalized_libelles = [self.normalize_text(libelle) for libelle in libelles]
-
-        ngram_indices = {}
-        df_counter = Counter()
-
-        for doc_idx, libelle_norm in enumerate(normalized_libelles):
-            words = libelle_norm.split()
-
-            # Extraire n-grams de ce document
-            doc_ngrams = set()
-            for n in range(1, min(len(words) + 1, n_max + 1)):
-                for i in range(len(words) - n + 1):
-                    ngram_words = words[i:i + n]
-
-                    # Filtrer uniquement les tokens courts ou numériques
-                    if any(len(w) < 3 or w.isdigit() for w in ngram_words):
-                        continue
-
-                    # Ignorer n-grams entièrement composés de mots vides
-                    if all(w.lower() in self.stop_words for w in ngram_words):
-                        continue
-
-                    # Filtrer n-grams commençant ou finissant par un stop-word
-                    if ngram_words[0].lower() in self.stop_words or ngram_words[-1].lower() in self.stop_words:
-                        continue
+        if normalized:
+            normalized_libelles = libelles
+        else:
+            normalized_libelles = [self.normalize_text(libelle) for libelle in libelles]
 
-                    ngram = ' '.join(ngram_words)
-                    doc_ngrams.add(ngram)
-
-            # Mettre à jour les compteurs pour ce document
-            for ngram in doc_ngrams:
-                df_counter[ngram] += 1
-
-                # Gestion optimisée des indices
-                if ngram not in ngram_indices:
-                    ngram_indices[ngram] = {doc_idx}
-                elif isinstance(ngram_indices[ngram], set):
-                    ngram_indices[ngram].add(doc_idx)
-                    # Conversion en compteur si trop fréquent, mais conserver un échantillon
-                    if len(ngram_indices[ngram]) > max_set:
-                        sample_idx = next(iter(ngram_indices[ngram]))
-                        ngram_indices[ngram] = (sample_idx, len(ngram_indices[ngram]))  # (échantillon, count)
-                else:
-                    # Déjà un compteur, incrémenter
-                    ngram_indices[ngram] = (ngram_indices[ngram][0], ngram_indices[ngram][1] + 1)
+        matrice = MatriceNgrammes(normalized_libelles, self.stop_words, n_max=n_max, min_df=min_df)
 
-        # Filtrer par fréquence documentaire minimale
+        # Filtrer par fréquence documentaire minimale (déjà appliqué par la matrice)
         filtered_ngrams = {}
-        filtered_df = Counter()
+        filtered_df = matrice.frequences()
 
-        for ngram, df in df_counter.items():
-            if df >= min_df:
-                filtered_ngrams[ngram] = ngram_indices[ngram]
-                filtered_df[ngram] = df
+        for ngram, df in filtered_df.items():
+            documents = matrice.documents(ngram)
+            # Au-delà de max_set, seul le compteur est conservé (avec un échantillon)
+            filtered_ngrams[ngram] = set(documents) if df <= max_set else (documents[0], df)
 
         return filtered_ngrams, filtered_df
 
     def find_account_specific_patterns(self, compte: str, transactions: List[Dict],
-                                       all_transactions: List[Dict] = None) -> List[Dict]:
+                                       all_transactions: List[Dict] = None,
+                                       corpus: Optional['CorpusSuggestion'] = None,
+                                       budget: Optional[BudgetRecherche] = None) -> List[Dict]:
         """Trouve les motifs spécifiques selon le type de compte avec critères automatiques"""
         if self.debug:
             print(f"🔍 AFFECTIA : Analyse spécifique pour le compte {compte}")
@@ -131,9 +263,9 @@ class RuleSuggester:
         if compte.startswith('164'):
             rules = self._analyze_emprunt_account(compte, transactions)
         elif compte.startswith('401') or compte.startswith('411'):
-            rules = self._analyze_tiers_account(compte, transactions, all_transactions)
+            rules = self._analyze_tiers_account(compte, transactions, all_transactions, corpus=corpus, budget=budget)
         elif compte.startswith('421') or compte.startswith('42'):
-            rules = self._analyze_personnel_account(compte, transactions)
+            rules = self._analyze_personnel_account(compte, transactions, budget=budget)
         elif compte.startswith('431'):
             rules = self._analyze_urssaf_account(compte, transactions)
         elif compte.startswith('4421'):
@@ -148,6 +280,66 @@ class RuleSuggester:
         # 🎯 Appliquer les critères automatiques à TOUTES les règles générées
         return self._apply_automatic_criteria(rules, auto_criteria)
 
+    def echantillon_stratifie(self, transactions: List[Dict], taille: int) -> List[Dict]:
+        """
+        Échantillon déterministe d'environ `taille` transactions, stratifié par journal, signe
+        du montant et premier mot du libellé normalisé
+
+        Chaque strate reçoit une part proportionnelle à son effectif (au moins une transaction),
+        prélevée à pas régulier ; les plus grandes strates sont servies d'abord et les
+        transactions gardent leur ordre d'origine.
+        """
+        strates = defaultdict(list)
+        for i, trans in enumerate(transactions):
+            mots = self.libelle_norm(trans).split()
+            strates[(trans.get('journal_code'), trans.get('montant', 0) >= 0, mots[0] if mots else '')].append(i)
+
+        total = len(transactions)
+        rangs = []
+        for indices in sorted(strates.values(), key=len, reverse=True):
+            if len(rangs) >= taille:
+                break
+            quota = min(len(indices), max(1, round(taille * len(indices) / total)))
+            pas = len(indices) / quota
+            rangs.extend(indices[int(k * pas)] for k in range(quota))
+        return [transactions[i] for i in sorted(rangs)]
+
+    def _candidats_par_echantillon(self, compte: str, transactions: List[Dict], all_transactions: List[Dict],
+                                   corpus: Optional[CorpusSuggestion] = None,
+                                   budget: Optional[BudgetRecherche] = None) -> List[Dict]:
+        """
+        Candidats extraits d'un échantillon stratifié du compte, puis vérifiés exactement
+
+        Les motifs (n-grams, combinaisons de mots, fuzzy) sont cherchés sur l'échantillon ; les
+        `candidats_verifies` meilleurs voient ensuite leur couverture recomptée sur toutes les
+        transactions du compte via l'index par sous-chaînes, et leurs critères journal/montant
+        recalculés. Les collisions sont vérifiées ensuite sur le corpus complet, comme en mode
+        exhaustif.
+        """
+        echantillon = self.echantillon_stratifie(transactions, self.taille_echantillon)
+        if self.debug:
+            print(f"🧪 AFFECTIA : Échantillon de {len(echantillon)}/{len(transactions)} transactions pour {compte}")
+
+        candidats = self.find_account_specific_patterns(compte, echantillon, all_transactions, corpus=corpus,
+                                                        budget=budget)
+        candidats.sort(key=lambda r: -r['transactions_couvertes'])
+
+        index = self.index_pour(transactions)
+        verifies = []
+        for rule in candidats[:self.candidats_verifies]:
+            documents = index.documents_contenant(rule['mot_cle_1'])
+            if 'mot_cle_2' in rule:
+                autres = set(index.documents_contenant(rule['mot_cle_2']))
+                documents = [i for i in documents if i in autres]
+            if not documents:
+                continue
+            # Les critères déduits de l'échantillon sont recalculés sur toutes les transactions
+            rule = {cle: valeur for cle, valeur in rule.items() if cle not in ('journal', 'montant')}
+            rule['transactions_couvertes'] = len(documents)
+            verifies.append(rule)
+
+        return self._apply_automatic_criteria(verifies, self._detect_automatic_criteria(transactions))
+
     def _detect_automatic_criteria(self, transactions: List[Dict]) -> Dict:
         """Détecte les critères automatiques applicables à toutes les transactions"""
         if not transactions:
@@ -189,7 +381,7 @@ class RuleSuggester:
         number_patterns = Counter()
         journal_pattern = None
         for trans in transactions:
-            libelle = self.normalize_text(trans['ecriture_lib'])
+            libelle = self.libelle_norm(trans)
             # Extraire les séquences de chiffres (longueur >= 6) présentes (chaque séquence comptée une fois par libellé)
             for num in set(re.findall(r'\d{6,}', libelle)):
                 number_patterns[num] += 1
@@ -211,7 +403,8 @@ class RuleSuggester:
         return self._add_journal_and_amount_criteria(rules, transactions)
 
     def _analyze_tiers_account(self, compte: str, transactions: List[Dict], all_transactions: List[Dict] = None,
-                               compte_libelle=None) -> \
+                               compte_libelle=None, corpus: Optional['CorpusSuggestion'] = None,
+                               budget: Optional[BudgetRecherche] = None) -> \
     List[Dict]:
         """Analyse spécifique pour les comptes fournisseurs/clients (401/411)"""
         import logging
@@ -228,8 +421,10 @@ class RuleSuggester:
             if self.debug:
                 logger.debug(f"⚠️ AFFECTIA : RapidFuzz non disponible, fuzzy matching désactivé")
 
-        # Dictionnaire pour éviter les doublons (clé = mot_cle_1)
-        candidates_dict = {}
+        # Candidats proposés, par créneau dans l'ordre de la recherche exhaustive : une recherche
+        # fuzzy différée en mode budgété remplit plus tard le créneau réservé à sa place, et le
+        # dictionnaire des candidats (clé = mot_cle_1) est constitué à la fin dans cet ordre
+        propositions = []
 
         # Racines génériques étendues avec pluriels et variantes
         generic_roots = {
@@ -242,19 +437,7 @@ class RuleSuggester:
             'corp', 'corporation', 'sarl', 'sas', 'eurl', 'sa', 'ltd', 'inc', 'co', 'cie'
         }
 
-        def normalize_for_comparison(text):
-            """Normalisation unifiée pour comparaisons (collision, fuzzy)"""
-            if not text:
-                return ""
-            try:
-                from unidecode import unidecode
-                normalized = unidecode(text.upper()).strip()
-            except ImportError:
-                normalized = text.upper().strip()
-            # Supprimer caractères spéciaux mais garder espaces et tirets
-            normalized = re.sub(r'[^\w\s-]', ' ', normalized)
-            normalized = re.sub(r'\s+', ' ', normalized).strip()
-            return normalized
+        normalize_for_comparison = self.normalize_for_comparison
 
         def is_generic_word(mot_cle):
             """Vérifie si un mot est générique (avec variantes et pluriels)"""
@@ -299,50 +482,48 @@ class RuleSuggester:
                         libelle_to_transactions[word] = []
                     libelle_to_transactions[word].append(i)
 
-        # 2. Pré-calcul pour détection collision (autres comptes)
-        other_libelles_norm = []
-        if all_transactions:
-            for trans in all_transactions:
-                trans_compte = None
-
-                # Identifier le compte de la transaction
-                if trans.get('compte_contrepartie'):
-                    trans_compte = trans['compte_contrepartie']
-                elif trans.get('compte_final') and not trans['compte_final'].startswith('512'):
-                    trans_compte = trans['compte_final']
-                elif trans.get('compte_num') and not trans['compte_num'].startswith('512'):
-                    trans_compte = trans['compte_num']
+        # Index par sous-chaînes des mêmes libellés
+        index_courant = IndexProgressif(current_libelles_norm)
 
-                # Ne garder que les autres comptes
-                if trans_compte and trans_compte != compte:
-                    other_libelles_norm.append(normalize_for_comparison(trans['ecriture_lib']))
+        # 2. Pré-calcul pour détection collision (autres comptes) : libellés normalisés et indexés
+        # une seule fois pour toute la société, comptages mémorisés par mot-clé
+        if corpus is None and all_transactions:
+            corpus = self.corpus_pour(all_transactions)
+        total_other = corpus.nb_hors_compte(compte) if corpus is not None else 0
 
         def find_matching_transactions_fast(mot_cle_norm):
             """Trouve rapidement les transactions contenant le mot-clé (via index)"""
             matching_indices = set()
 
-            # Chercher dans l'index inverse
-            if mot_cle_norm in libelle_to_transactions:
-                matching_indices.update(libelle_to_transactions[mot_cle_norm])
+            # Mot du libellé contenant le mot-clé : recherche par sous-chaîne
+            if len(mot_cle_norm) >= 3:
+                if ' ' not in mot_cle_norm:
+                    matching_indices.update(index_courant.documents_contenant(mot_cle_norm))
+            else:
+                for word, indices in libelle_to_transactions.items():
+                    if mot_cle_norm in word:
+                        matching_indices.update(indices)
 
-            # Recherche par inclusion (fallback pour mots composés)
-            for word, indices in libelle_to_transactions.items():
-                if mot_cle_norm in word or word in mot_cle_norm:
-                    matching_indices.update(indices)
+            # Mot du libellé contenu dans le mot-clé (mots composés) : sous-chaînes du mot-clé
+            longueur = len(mot_cle_norm)
+            for debut in range(longueur):
+                for fin in range(debut + 3, longueur + 1):
+                    indices = libelle_to_transactions.get(mot_cle_norm[debut:fin])
+                    if indices:
+                        matching_indices.update(indices)
 
-            return [transactions[i] for i in matching_indices]
+            return [transactions[i] for i in sorted(matching_indices)]
 
         def check_collision_optimized(mot_cle):
             """Détection collision optimisée avec normalisation uniforme"""
-            if not other_libelles_norm:
+            if not total_other:
                 return False, 0, 0.0
 
             # Normaliser le mot-clé pour comparaison
             mot_cle_norm = normalize_for_comparison(mot_cle)
 
             # Compter collisions avec normalisation
-            collision_count = sum(1 for libelle in other_libelles_norm if mot_cle_norm in libelle)
-            total_other = len(other_libelles_norm)
+            collision_count = corpus.collisions_hors_compte(compte, mot_cle_norm)
             collision_ratio = collision_count / total_other if total_other > 0 else 0.0
 
             # Seuils adaptatifs
@@ -377,8 +558,8 @@ class RuleSuggester:
 
             return final_penalty
 
-        def add_candidate(mot_cle, trans_count, trans_matched, match_type, source_desc):
-            """Ajoute un candidat avec scoring optimisé"""
+        def add_candidate(mot_cle, trans_count, trans_matched, match_type, source_desc, creneau=None):
+            """Propose un candidat avec scoring optimisé (dans `creneau`, ou à la suite)"""
             coverage = trans_count / len(transactions)
             specificity_score = calculate_specificity_score(mot_cle, coverage)
 
@@ -392,23 +573,46 @@ class RuleSuggester:
             # Log collision significative seulement
             if self.debug and has_collision and collision_ratio >= 0.05:
                 logger.debug(
-                    f"⚠️ AFFECTIA : Collision '{mot_cle}' - {collision_count}/{len(other_libelles_norm)} ({collision_ratio:.1%}) - Pénalité: {collision_penalty:.2f}")
-
-            if mot_cle not in candidates_dict or candidates_dict[mot_cle]["composite_score"] < composite_score:
-                candidates_dict[mot_cle] = {
-                    "mot_cle_1": mot_cle,
-                    "transactions_couvertes": trans_count,
-                    "transactions_matched": trans_matched,
-                    "coverage_score": coverage,
-                    "specificity_score": specificity_score,
-                    "composite_score": composite_score,
-                    "collision": has_collision,
-                    "collision_count": collision_count,
-                    "collision_ratio": collision_ratio,
-                    "collision_penalty": collision_penalty,
-                    "match_type": match_type,
-                    "source": source_desc
-                }
+                    f"⚠️ AFFECTIA : Collision '{mot_cle}' - {collision_count}/{total_other} ({collision_ratio:.1%}) - Pénalité: {collision_penalty:.2f}")
+
+            candidat = {
+                "mot_cle_1": mot_cle,
+                "transactions_couvertes": trans_count,
+                "transactions_matched": trans_matched,
+                "coverage_score": coverage,
+                "specificity_score": specificity_score,
+                "composite_score": composite_score,
+                "collision": has_collision,
+                "collision_count": collision_count,
+                "collision_ratio": collision_ratio,
+                "collision_penalty": collision_penalty,
+                "match_type": match_type,
+                "source": source_desc
+            }
+            if creneau is None:
+                creneau = []
+                propositions.append(creneau)
+            creneau.append((candidat, False))
+
+        def fuzzy_from_compte(word, word_norm, exact_matches, creneau=None):
+            """Candidat fuzzy (RapidFuzz) pour un mot du libellé du compte"""
+            # Utiliser RapidFuzz.process pour optimiser (mêmes choix pour tous les mots)
+            fuzzy_results = process.extract(
+                word_norm,
+                current_libelles_norm,
+                scorer=fuzz.partial_ratio,
+                limit=len(current_libelles_norm),
+                score_cutoff=max(70, 100 - len(word) * 3)
+            )
+
+            fuzzy_matches = [transactions[idx] for result, score, idx in fuzzy_results]
+
+            if len(fuzzy_matches) >= self.min_occurrences and len(fuzzy_matches) > len(exact_matches):
+                add_candidate(word, len(fuzzy_matches), fuzzy_matches, "fuzzy_from_compte",
+                              "libellé compte (fuzzy)", creneau)
+
+        # Recherches fuzzy sur le libellé du compte, évaluées en dernier en mode budgété
+        fuzzy_differes = []
 
         # ÉTAPE 1 : Analyser le libellé du compte
         compte_libelle = transactions[0].get('compte_libelle', '') if transactions else ''
@@ -432,8 +636,8 @@ class RuleSuggester:
                     # Bonus spécial pour les mots du libellé de compte : score forcé à 100% si couverture parfaite
                     coverage = len(exact_matches) / len(transactions)
                     if coverage == 1.0:  # Couverture parfaite = 100%
-                        # Score maximum garanti pour éviter la pénalisation
-                        candidates_dict[word] = {
+                        # Score maximum garanti pour éviter la pénalisation (remplace tout candidat du même mot)
+                        propositions.append([({
                             "mot_cle_1": word,
                             "transactions_couvertes": len(exact_matches),
                             "transactions_matched": exact_matches,
@@ -446,7 +650,7 @@ class RuleSuggester:
                             "collision_penalty": 1.0,
                             "match_type": "exact_from_compte_perfect",
                             "source": "libellé compte (couverture parfaite)"
-                        }
+                        }, True)])
                         if self.debug:
                             logger.debug(
                                 f"🎯 AFFECTIA : Mot du compte '{word}' avec couverture parfaite - score maximum garanti")
@@ -454,36 +658,22 @@ class RuleSuggester:
                         add_candidate(word, len(exact_matches), exact_matches, "exact_from_compte",
                                       "libellé compte")
 
-                # Test fuzzy optimisé avec RapidFuzz
+                # Test fuzzy optimisé avec RapidFuzz (différé après les sources peu coûteuses si budget)
                 if fuzzy_available and len(exact_matches) < len(
                         transactions) * 0.8:  # Fuzzy seulement si exact insuffisant
-                    choices = [(libelle, i) for i, libelle in enumerate(current_libelles_norm)]
-                    word_norm_clean = normalize_for_comparison(word)
-
-                    # Utiliser RapidFuzz.process pour optimiser
-                    fuzzy_results = process.extract(
-                        word_norm_clean,
-                        [choice[0] for choice in choices],
-                        scorer=fuzz.partial_ratio,
-                        limit=len(choices),
-                        score_cutoff=max(70, 100 - len(word) * 3)
-                    )
-
-                    fuzzy_matches = []
-                    for result, score, idx in fuzzy_results:
-                        original_idx = choices[idx][1]
-                        fuzzy_matches.append(transactions[original_idx])
-
-                    if len(fuzzy_matches) >= self.min_occurrences and len(fuzzy_matches) > len(exact_matches):
-                        add_candidate(word, len(fuzzy_matches), fuzzy_matches, "fuzzy_from_compte",
-                                      "libellé compte (fuzzy)")
+                    if budget is None:
+                        fuzzy_from_compte(word, word_norm, exact_matches)
+                    else:
+                        creneau = []
+                        propositions.append(creneau)
+                        fuzzy_differes.append((word, word_norm, exact_matches, creneau))
 
         # ÉTAPE 2 : Patterns spéciaux (domaines, tirets)
         domain_patterns = Counter()
         company_names = Counter()
 
         for trans in transactions:
-            original_text = trans['ecriture_lib'].upper()
+            original_text = self.libelle_norm(trans)
 
             # Domaines web
             domains = re.findall(r'\b(\w{3,})\.(COM|FR|US|NET|ORG|CO|BE|DE|IT|ES)\b', original_text)
@@ -499,48 +689,66 @@ class RuleSuggester:
         # Ajouter patterns aux candidats
         for pattern, count in domain_patterns.items():
             if count >= self.min_occurrences:
-                matching_transactions = [t for t in transactions if pattern in t['ecriture_lib'].upper()]
+                matching_transactions = [t for t in transactions if pattern in self.libelle_norm(t)]
                 add_candidate(pattern, count, matching_transactions, "domain_pattern", "domaine web")
 
+        noms_avec_tirets = False
         for pattern, count in company_names.items():
             if count >= self.min_occurrences:
-                matching_transactions = [t for t in transactions if pattern in t['ecriture_lib'].upper()]
+                matching_transactions = [t for t in transactions if pattern in self.libelle_norm(t)]
                 add_candidate(pattern, count, matching_transactions, "hyphenated_name", "nom avec tirets")
-
-                # ÉTAPE 3 : N-grams avec fuzzy
-                all_libelles = [t['ecriture_lib'] for t in transactions]
-                if all_libelles:
-                    # Utiliser la nouvelle méthode extract_ngrams_all
-                    ngrams_dict, df_counter = self.extract_ngrams_all(
-                        all_libelles,
-                        n_max=4,
-                        min_df=len(transactions),  # N-grams présents dans TOUTES les transactions
-                        max_set=50
-                    )
-
-                    # Les n-grams sont déjà filtrés par min_df=len(transactions)
-                    common_ngrams = set(ngrams_dict.keys())
-
-                    # Ajouter n-grams
-                    for ngram in common_ngrams:
-                        add_candidate(ngram, len(transactions), transactions, "ngram_exact", "n-gram commun")
-
-            # Fuzzy n-grams avec compte
-            if fuzzy_available and len(compte_libelle) >= 3 and common_ngrams:
-                compte_norm = normalize_for_comparison(compte_libelle)
-                ngrams_list = list(common_ngrams)
-
-                # Utiliser RapidFuzz pour optimiser
-                fuzzy_ngram_results = process.extract(
-                    compte_norm,
-                    ngrams_list,
-                    scorer=fuzz.token_set_ratio,
-                    limit=3,
-                    score_cutoff=70
-                )
-
-                for ngram, score, _ in fuzzy_ngram_results:
-                    add_candidate(ngram, len(transactions), transactions, "ngram_fuzzy", f"n-gram fuzzy ({score})")
+                noms_avec_tirets = True
+
+        # ÉTAPE 3 : N-grams avec fuzzy (comptes aux noms avec tirets), une seule fois par compte
+        common_ngrams = set()
+        all_libelles = [self.libelle_norm(t) for t in transactions] if noms_avec_tirets else []
+        if all_libelles and (budget is None or budget.autorise('n-grams communs')):
+            # Utiliser la nouvelle méthode extract_ngrams_all
+            ngrams_dict, df_counter = self.extract_ngrams_all(
+                all_libelles,
+                n_max=4,
+                min_df=len(transactions),  # N-grams présents dans TOUTES les transactions
+                max_set=50,
+                normalized=True
+            )
+
+            # Les n-grams sont déjà filtrés par min_df=len(transactions)
+            common_ngrams = set(ngrams_dict.keys())
+
+            # Ajouter n-grams
+            for ngram in common_ngrams:
+                add_candidate(ngram, len(transactions), transactions, "ngram_exact", "n-gram commun")
+
+        # Fuzzy n-grams avec compte
+        if fuzzy_available and len(compte_libelle) >= 3 and common_ngrams and (
+                budget is None or budget.autorise('n-grams fuzzy')):
+            compte_norm = normalize_for_comparison(compte_libelle)
+            ngrams_list = list(common_ngrams)
+
+            # Utiliser RapidFuzz pour optimiser
+            fuzzy_ngram_results = process.extract(
+                compte_norm,
+                ngrams_list,
+                scorer=fuzz.token_set_ratio,
+                limit=3,
+                score_cutoff=70
+            )
+
+            for ngram, score, _ in fuzzy_ngram_results:
+                add_candidate(ngram, len(transactions), transactions, "ngram_fuzzy", f"n-gram fuzzy ({score})")
+
+        # Sources les plus coûteuses, tant que le budget le permet, à la place réservée
+        for word, word_norm, exact_matches, creneau in fuzzy_differes:
+            if budget.autorise('fuzzy libellé compte'):
+                fuzzy_from_compte(word, word_norm, exact_matches, creneau)
+
+        # Dictionnaire sans doublons (clé = mot_cle_1) : le meilleur score l'emporte, à égalité le premier
+        candidates_dict = {}
+        for creneau in propositions:
+            for candidat, prioritaire in creneau:
+                actuel = candidates_dict.get(candidat["mot_cle_1"])
+                if prioritaire or actuel is None or actuel["composite_score"] < candidat["composite_score"]:
+                    candidates_dict[candidat["mot_cle_1"]] = candidat
 
         # SÉLECTION DU MEILLEUR CANDIDAT
         all_candidates = list(candidates_dict.values())
@@ -575,7 +783,8 @@ class RuleSuggester:
 
         return self._add_journal_and_amount_criteria(rules, transactions)
 
-    def _analyze_personnel_account(self, compte: str, transactions: List[Dict]) -> List[Dict]:
+    def _analyze_personnel_account(self, compte: str, transactions: List[Dict],
+                                   budget: Optional[BudgetRecherche] = None) -> List[Dict]:
         """Analyse spécifique pour les comptes de personnel (421/42)"""
         if self.debug:
             print(f"👥 AFFECTIA : Analyse compte personnel {compte}")
@@ -584,7 +793,7 @@ class RuleSuggester:
 
         # Compter tous les mots dans tous les libellés
         all_words = []
-        all_libelles = [self.normalize_text(t['ecriture_lib']) for t in transactions]
+        all_libelles = [self.libelle_norm(t) for t in transactions]
 
         for libelle in all_libelles:
             words = libelle.split()
@@ -609,8 +818,24 @@ class RuleSuggester:
             print(f"🔍 AFFECTIA : Mots fréquents (≥50%) : {[(w, f'{c:.1%}') for w, _, c in frequent_words]}")
 
         candidate_rules = []
+        # Libellés contenant un mot, via l'index par sous-chaînes des libellés du compte
+        index = self.index_pour(transactions)
+
+        # 2. Mots seuls (peu coûteux) évalués avant les combinaisons
+        single_rules = []
+        for word, count, coverage in frequent_words[:3]:  # Élargir aux 3 mots les plus fréquents
+            nb_with_word = len(index.documents_contenant(word))
+            if nb_with_word >= 1:  # Au moins 1 transaction
+                single_rules.append({
+                    "mot_cle_1": word,
+                    "transactions_couvertes": nb_with_word,
+                    "collision": False
+                })
+                if self.debug:
+                    print(
+                        f"✅ AFFECTIA : Règle simple trouvée - '{word}' ({nb_with_word} transactions)")
 
-        # 1. Tester toutes les combinaisons 2 à 2 des mots fréquents
+        # 1. Tester toutes les combinaisons 2 à 2 des mots fréquents, tant que le budget le permet
         tested_combinations = set()
         for i in range(min(len(frequent_words), 6)):  # Élargir aux 6 mots les plus fréquents
             for j in range(i + 1, min(len(frequent_words), 6)):
@@ -628,44 +853,30 @@ class RuleSuggester:
                     continue
                 tested_combinations.add(normalized_combo)
 
+                if budget is not None and not budget.autorise('combinaisons de mots'):
+                    continue
+
                 # Compter les transactions contenant les deux mots
-                transactions_with_both = []
-                for trans in transactions:
-                    libelle = self.normalize_text(trans['ecriture_lib'])
-                    if normalized_combo[0] in libelle and normalized_combo[1] in libelle:
-                        transactions_with_both.append(trans)
+                avec_premier = set(index.documents_contenant(normalized_combo[0]))
+                nb_with_both = sum(1 for rang in index.documents_contenant(normalized_combo[1])
+                                   if rang in avec_premier)
 
-                if len(transactions_with_both) >= 1:  # Au moins 1 transaction (seuil abaissé)
+                if nb_with_both >= 1:  # Au moins 1 transaction (seuil abaissé)
                     candidate_rules.append({
                         "mot_cle_1": normalized_combo[0],
                         "mot_cle_2": normalized_combo[1],
-                        "transactions_couvertes": len(transactions_with_both),
+                        "transactions_couvertes": nb_with_both,
                         "collision": False
                     })
                     if self.debug:
                         print(
-                            f"✅ AFFECTIA : Règle combinée trouvée - '{normalized_combo[0]}' + '{normalized_combo[1]}' ({len(transactions_with_both)} transactions)")
+                            f"✅ AFFECTIA : Règle combinée trouvée - '{normalized_combo[0]}' + '{normalized_combo[1]}' ({nb_with_both} transactions)")
 
-        # 2. Ajouter aussi les mots seuls comme alternatives
-        for word, count, coverage in frequent_words[:3]:  # Élargir aux 3 mots les plus fréquents
-            transactions_with_word = []
-            for trans in transactions:
-                libelle = self.normalize_text(trans['ecriture_lib'])
-                if word in libelle:
-                    transactions_with_word.append(trans)
-
-            if len(transactions_with_word) >= 1:  # Au moins 1 transaction
-                candidate_rules.append({
-                    "mot_cle_1": word,
-                    "transactions_couvertes": len(transactions_with_word),
-                    "collision": False
-                })
-                if self.debug:
-                    print(
-                        f"✅ AFFECTIA : Règle simple trouvée - '{word}' ({len(transactions_with_word)} transactions)")
+        # Les combinaisons restent devant les mots seuls (ordre de départage du tri)
+        candidate_rules.extend(single_rules)
 
         # 3. Recherche classique des n-grams communs comme fallback
-        if not candidate_rules and all_libelles:
+        if not candidate_rules and all_libelles and (budget is None or budget.autorise('n-grams communs')):
             # Extraire tous les n-grams de 1 à 3 mots du premier libellé
             first_ngrams = self.extract_ngrams(all_libelles[0], max_length=3)
             # Garder seulement ceux présents dans TOUS les libellés
@@ -724,7 +935,7 @@ class RuleSuggester:
         # Compte collectif : repérer les noms récurrents dans les libellés (prénoms/noms d'employés)
         name_patterns = Counter()
         for trans in transactions:
-            libelle = self.normalize_text(trans['ecriture_lib'])
+            libelle = self.libelle_norm(trans)
             words = libelle.split()
             # Noms complets (2 mots consécutifs)
             for i in range(len(words) - 1):
@@ -752,7 +963,7 @@ class RuleSuggester:
         patterns = ['URSSAF', 'MALAKOFF', 'KLESIA', 'AGIRC', 'ARRCO', 'POLE EMPLOI', 'CPAM']
         found_rules = []
         for pattern in patterns:
-            count = sum(1 for t in transactions if pattern in self.normalize_text(t['ecriture_lib']))
+            count = sum(1 for t in transactions if pattern in self.libelle_norm(t))
             if count >= self.min_occurrences:
                 found_rules.append({"mot_cle_1": pattern, "transactions_couvertes": count, "collision": False})
                 if self.debug:
@@ -765,7 +976,7 @@ class RuleSuggester:
             print(f"🏛️ AFFECTIA : Analyse compte URSSAF {compte}")
         ur_patterns = Counter()
         for trans in transactions:
-            libelle = self.normalize_text(trans['ecriture_lib'])
+            libelle = self.libelle_norm(trans)
             # Extraire les codes UR avec ou sans espace : "UR123456" ou "UR 123456"
             for code in set(re.findall(r'UR\s*\d{6,}', libelle)):
                 ur_patterns[code] += 1
@@ -792,7 +1003,7 @@ class RuleSuggester:
 
         # Si aucun code "URxxxx" récurrent, chercher simplement "URSSAF"
         if not rules:
-            urssaf_count = sum(1 for t in transactions if 'URSSAF' in self.normalize_text(t['ecriture_lib']))
+            urssaf_count = sum(1 for t in transactions if 'URSSAF' in self.libelle_norm(t))
             if urssaf_count >= self.min_occurrences:
                 rules.append({"mot_cle_1": "URSSAF", "transactions_couvertes": urssaf_count, "collision": False})
                 if self.debug:
@@ -803,7 +1014,7 @@ class RuleSuggester:
         """Analyse spécifique pour le compte Prélèvement À la Source (4421)"""
         if self.debug:
             print(f"📋 AFFECTIA : Analyse compte PAS {compte}")
-        pas_count = sum(1 for t in transactions if 'PASDSN' in self.normalize_text(t['ecriture_lib']))
+        pas_count = sum(1 for t in transactions if 'PASDSN' in self.libelle_norm(t))
         rules = []
         if pas_count >= self.min_occurrences:
             rules.append({"mot_cle_1": "PASDSN", "transactions_couvertes": pas_count, "collision": False})
@@ -818,7 +1029,7 @@ class RuleSuggester:
         patterns = ['3517SCA12', '3310CA3', 'TVA']
         found_rules = []
         for pattern in patterns:
-            count = sum(1 for t in transactions if pattern in self.normalize_text(t['ecriture_lib']))
+            count = sum(1 for t in transactions if pattern in self.libelle_norm(t))
             if count >= self.min_occurrences:
                 found_rules.append({"mot_cle_1": pattern, "transactions_couvertes": count, "collision": False})
                 if self.debug:
@@ -832,7 +1043,7 @@ class RuleSuggester:
         patterns = ['CFE', 'CVAE']
         found_rules = []
         for pattern in patterns:
-            count = sum(1 for t in transactions if pattern in self.normalize_text(t['ecriture_lib']))
+            count = sum(1 for t in transactions if pattern in self.libelle_norm(t))
             if count >= self.min_occurrences:
                 found_rules.append({"mot_cle_1": pattern, "transactions_couvertes": count, "collision": False})
                 if self.debug:
@@ -848,30 +1059,10 @@ class RuleSuggester:
                 print(f"⚠️ AFFECTIA : Pas assez de transactions ({len(transactions)} < {self.min_occurrences})")
             return []
 
-        # Utiliser la nouvelle méthode extract_ngrams_all
-        all_libelles = [t['ecriture_lib'] for t in transactions]
-        ngrams_dict, df_counter = self.extract_ngrams_all(
-            all_libelles,
-            n_max=5,
-            min_df=self.min_occurrences,
-            max_set=50
-        )
-
-        def _get_signature_for_dedup(indices_data):
-            """
-            Retourne un hashable représentant l'ensemble exact de transactions ou,
-            à défaut, un tuple (count, hash_sample) qui réduit les collisions.
-            """
-            if isinstance(indices_data, set):
-                # Utiliser frozenset pour hashing fiable
-                return frozenset(indices_data)
-            elif isinstance(indices_data, tuple):
-                sample_idx, total = indices_data
-                # Hash léger, réduit les collisions 'même count'
-                return (total, sample_idx % 97)
-            else:
-                # int simple
-                return (indices_data, None)
+        # Matrice documents × n-grams : fréquences et couvertures exactes
+        all_libelles = [self.libelle_norm(t) for t in transactions]
+        matrice = MatriceNgrammes(all_libelles, self.stop_words, n_max=5, min_df=self.min_occurrences)
+        df_counter = matrice.frequences()
 
         # Trier par fréquence puis longueur avec ordre stable
         frequent_ngrams = list(df_counter.most_common())
@@ -879,18 +1070,14 @@ class RuleSuggester:
 
         selected_ngrams = []
         for ngram, count in frequent_ngrams[:10]:  # considérer jusqu'aux 10 motifs les plus fréquents
-            # Obtenir signature pour déduplication
-            indices_data = ngrams_dict.get(ngram)
-            trans_signature = _get_signature_for_dedup(indices_data)
+            # Signature exacte de l'ensemble des transactions couvertes
+            trans_signature = matrice.signature(ngram)
 
             # Vérifier si ce motif est redondant avec un motif déjà sélectionné
             redundant = False
             for sel_ng, _ in selected_ngrams:
-                sel_indices_data = ngrams_dict.get(sel_ng)
-                sel_signature = _get_signature_for_dedup(sel_indices_data)
-
-                # Comparaison de signatures (set complet ou count)
-                if trans_signature == sel_signature:
+                # Même couverture exacte
+                if trans_signature == matrice.signature(sel_ng):
                     # Si même couverture, garder le motif le plus long
                     if len(ngram) > len(sel_ng):
                         selected_ngrams = [(ng, cnt) for ng, cnt in selected_ngrams if ng != sel_ng]
@@ -904,7 +1091,7 @@ class RuleSuggester:
         rules = []
         for ngram, count in selected_ngrams[:3]:
             # Transactions du compte contenant ce n-gram
-            matching_transactions = [t for t in transactions if ngram in self.normalize_text(t['ecriture_lib'])]
+            matching_transactions = [t for t in transactions if ngram in self.libelle_norm(t)]
             if not matching_transactions:
                 continue
             journals = {t['journal_code'] for t in matching_transactions}
@@ -945,13 +1132,14 @@ class RuleSuggester:
     def _add_journal_and_amount_criteria(self, rules: List[Dict], transactions: List[Dict]) -> List[Dict]:
         """Ajoute les critères de journal et de montant aux règles quand c'est possible"""
         enhanced_rules = []
+        index = self.index_pour(transactions)
         for rule in rules:
-            matching_transactions = []
-            for trans in transactions:
-                libelle = self.normalize_text(trans['ecriture_lib'])
-                # Vérifier que le libellé contient mot_cle_1 (et mot_cle_2 le cas échéant)
-                if rule["mot_cle_1"] in libelle and ("mot_cle_2" not in rule or rule["mot_cle_2"] in libelle):
-                    matching_transactions.append(trans)
+            # Transactions dont le libellé contient mot_cle_1 (et mot_cle_2 le cas échéant)
+            documents = index.documents_contenant(rule["mot_cle_1"])
+            if "mot_cle_2" in rule:
+                autres = set(index.documents_contenant(rule["mot_cle_2"]))
+                documents = [i for i in documents if i in autres]
+            matching_transactions = [transactions[i] for i in documents]
             if not matching_transactions:
                 continue
             journals = {t['journal_code'] for t in matching_transactions}
@@ -963,18 +1151,21 @@ class RuleSuggester:
             enhanced_rules.append(rule)
         return enhanced_rules
 
-    def check_collisions(self, rules: List[Dict], compte: str, all_transactions: List[Dict]) -> List[Dict]:
+    def check_collisions(self, rules: List[Dict], compte: str, all_transactions: List[Dict],
+                         corpus: Optional[CorpusSuggestion] = None) -> List[Dict]:
         """Vérifie qu'aucune règle ne s'applique à un autre compte (collisions)"""
         if self.debug:
             print(f"🔍 AFFECTIA : Vérification des collisions pour {len(rules)} règle(s) du compte {compte}")
+        corpus = corpus or self.corpus_pour(all_transactions)
         validated_rules = []
         for rule in rules:
             collision = False
             collision_details = []
-            for trans in all_transactions:
+            motifs = [rule['mot_cle_1']] + ([rule['mot_cle_2']] if 'mot_cle_2' in rule else [])
+            for trans in corpus.transactions_contenant(*motifs):
                 if trans['compte_contrepartie'] == compte:
                     continue  # ignorer les transactions du compte cible lui-même
-                libelle = self.normalize_text(trans['ecriture_lib'])
+                libelle = self.libelle_norm(trans)
 
                 # Vérifier mot_cle_1
                 if rule['mot_cle_1'] not in libelle:
@@ -1026,25 +1217,31 @@ class RuleSuggester:
                 print(f"❌ AFFECTIA : Règle {rule_desc} écartée (collision)")
         return validated_rules
 
-    def enhance_rules_with_second_keyword(self, rules: List[Dict], compte: str, transactions: List[Dict], all_transactions: List[Dict]) -> List[Dict]:
+    def enhance_rules_with_second_keyword(self, rules: List[Dict], compte: str, transactions: List[Dict], all_transactions: List[Dict],
+                                          corpus: Optional[CorpusSuggestion] = None,
+                                          budget: Optional[BudgetRecherche] = None) -> List[Dict]:
         """Ajoute un mot_cle_2 aux règles en collision pour les rendre plus spécifiques"""
         if self.debug:
             print(f"🔧 AFFECTIA : Amélioration des règles avec second mot-clé pour le compte {compte}")
+        corpus = corpus or self.corpus_pour(all_transactions)
         improved_rules = []
         for rule in rules:
             if not rule.get('collision', False):
                 improved_rules.append(rule)
                 continue
+            # Une règle en collision non améliorée est écartée, comme après un échec
+            if budget is not None and not budget.autorise('second mot-clé'):
+                continue
             if self.debug:
                 print(f"🔧 AFFECTIA : Tentative d'amélioration pour la règle '{rule['mot_cle_1']}'")
             # Transactions du compte cible contenant mot_cle_1
-            matching_transactions = [t for t in transactions if rule['mot_cle_1'] in self.normalize_text(t['ecriture_lib'])]
+            matching_transactions = [t for t in transactions if rule['mot_cle_1'] in self.libelle_norm(t)]
             if not matching_transactions:
                 continue
             # Mots communs à tous ces libellés (hors mot_cle_1)
-            common_words = set(self.normalize_text(matching_transactions[0]['ecriture_lib']).split())
+            common_words = set(self.libelle_norm(matching_transactions[0]).split())
             for trans in matching_transactions[1:]:
-                common_words &= set(self.normalize_text(trans['ecriture_lib']).split())
+                common_words &= set(self.libelle_norm(trans).split())
             motcle1_parts = set(rule['mot_cle_1'].split())
             candidate_words = [w for w in common_words if len(w) >= 3 and not w.isdigit() and w not in motcle1_parts]
             best_rule = None
@@ -1055,10 +1252,10 @@ class RuleSuggester:
                 test_rule['collision'] = False
                 # Tester la règle combinée sur toutes les transactions hors compte cible
                 collision = False
-                for trans in all_transactions:
+                for trans in corpus.transactions_contenant(test_rule['mot_cle_1'], test_rule['mot_cle_2']):
                     if trans['compte_contrepartie'] == compte:
                         continue
-                    libelle = self.normalize_text(trans['ecriture_lib'])
+                    libelle = self.libelle_norm(trans)
                     if test_rule['mot_cle_1'] in libelle and test_rule['mot_cle_2'] in libelle:
                         # Vérifier aussi les autres critères (journal, montant)
                         if 'journal' in test_rule and trans['journal_code'] != test_rule['journal']:
@@ -1092,9 +1289,17 @@ class RuleSuggester:
                     print(f"❌ AFFECTIA : Échec de l'amélioration pour la règle '{rule['mot_cle_1']}'")
         return improved_rules
 
-    def suggest_rules_for_account(self, compte: str, transactions: List[Dict], all_transactions: List[Dict]) -> List[
-        Dict]:
-        """Analyse un compte et suggère jusqu'à 3 règles d'affectation basées sur ses transactions"""
+    def suggest_rules_for_account(self, compte: str, transactions: List[Dict], all_transactions: List[Dict],
+                                  corpus: Optional[CorpusSuggestion] = None,
+                                  budget: Optional[BudgetRecherche] = None) -> List[Dict]:
+        """
+        Analyse un compte et suggère jusqu'à 3 règles d'affectation basées sur ses transactions
+
+        Avec un `budget`, les sources de candidats peu coûteuses sont évaluées d'abord et les
+        plus coûteuses seulement tant qu'il reste du temps : la durée de l'analyse est bornée
+        quelle que soit la taille du compte et `budget.exhaustif` indique si la recherche a été
+        complète (sinon les règles rendues sont les meilleures trouvées dans le temps imparti).
+        """
         if self.debug:
             print(f"\n🚀 AFFECTIA : Début de l'analyse du compte {compte} ({len(transactions)} transactions)")
 
@@ -1104,14 +1309,20 @@ class RuleSuggester:
                 print(f"⚠️ AFFECTIA : Pas assez de transactions pour le compte {compte}")
             return []
 
-        # 1. Motifs spécifiques selon le type de compte
-        candidate_rules = self.find_account_specific_patterns(compte, transactions, all_transactions)
+        # 1. Motifs spécifiques selon le type de compte (sur un échantillon pour les très gros comptes)
+        if self.taille_echantillon and len(transactions) > self.taille_echantillon:
+            candidate_rules = self._candidats_par_echantillon(compte, transactions, all_transactions, corpus=corpus,
+                                                              budget=budget)
+        else:
+            candidate_rules = self.find_account_specific_patterns(compte, transactions, all_transactions,
+                                                                  corpus=corpus, budget=budget)
         # 2. Ajout des critères journal et montant aux règles candidates
         candidate_rules = self._add_journal_and_amount_criteria(candidate_rules, transactions)
         # 3. Vérification de l'unicité des règles (collisions inter-comptes)
-        candidate_rules = self.check_collisions(candidate_rules, compte, all_transactions)
+        candidate_rules = self.check_collisions(candidate_rules, compte, all_transactions, corpus=corpus)
         # 4. Amélioration des règles en collision avec un deuxième mot-clé (si possible)
-        candidate_rules = self.enhance_rules_with_second_keyword(candidate_rules, compte, transactions, all_transactions)
+        candidate_rules = self.enhance_rules_with_second_keyword(candidate_rules, compte, transactions, all_transactions,
+                                                                 corpus=corpus, budget=budget)
         # 5. Ne conserver que les règles sans collision
         valid_rules = [rule for rule in candidate_rules if not rule.get('collision', False)]
 
@@ -1164,4 +1375,33 @@ class RuleSuggester:
         final_rules = valid_rules[:3]
         if self.debug:
             print(f"🎯 AFFECTIA : {len(final_rules)} règle(s) suggérée(s) pour le compte {compte}")
+            if budget is not None and not budget.exhaustif:
+                print(f"⏱️ AFFECTIA : Budget épuisé, étapes ignorées : {sorted(set(budget.etapes_ignorees))}")
         return final_rules
+
+    def suggest_rules_for_all_accounts(self, all_transactions: List[Dict], comptes: Optional[List[str]] = None,
+                                       workers: int = 0) -> Dict[str, List[Dict]]:
+        """
+        Suggère des règles pour tous les comptes d'une société en une seule passe
+
+        Les pré-calculs (normalisation, partition par compte, index des libellés) sont faits une fois
+        puis partagés entre les comptes. Avec `workers` > 1, les comptes sont répartis sur un pool
+        de processus (voir suggestion_pool) ; le résultat est identique à l'exécution séquentielle.
+        """
+        if comptes is None:
+            comptes = sorted({t.get('compte_contrepartie') for t in all_transactions if t.get('compte_contrepartie')})
+        else:
+            comptes = sorted(comptes)
+
+        if workers and workers > 1 and len(comptes) > 1:
+            from app.services.suggestion_pool import suggerer_tous_comptes
+            return suggerer_tous_comptes(all_transactions, comptes, workers=workers, debug=self.debug,
+                                         taille_echantillon=self.taille_echantillon)
+
+        corpus = self.corpus_pour(all_transactions)
+
+        return {
+            compte: self.suggest_rules_for_account(compte, corpus.transactions_compte(compte), all_transactions,
+                                                   corpus=corpus)
+            for compte in comptes
+        }
@@ -0,0 +1,163 @@
+import threading
+from collections import OrderedDict
+
+from app.utils.texte import normaliser_libelle
+
+
+class SuggestionCache:
+    """
+    Cache LRU des suggestions de règles par (FEC, compte), avec leurs dépendances
+
+    Chaque entrée mémorise :
+    - les règles suggérées et l'empreinte du corpus (écritures du FEC) qui les a produites ;
+    - les écritures du compte ;
+    - la couverture de ces écritures par les règles existantes, les règles qui la fournissent
+      et l'empreinte de ces règles (coverage_cache.empreinte_regles).
+
+    Les suggestions ne dépendent que des écritures. La couverture n'est servie que si
+    l'empreinte des règles n'a pas changé, y compris quand les règles ont été modifiées par
+    un autre processus ; dans ce processus, une modification de règle invalide en plus
+    directement la couverture des comptes dont une écriture contient un mot-clé de la règle,
+    ou qui étaient couverts par elle.
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """Lit la taille maximale du cache depuis la configuration"""
+        self.max_entries = app.config.get('SUGGESTION_CACHE_MAX_ENTRIES', self.max_entries)
+
+    @staticmethod
+    def empreinte_corpus(ecritures):
+        """Empreinte des écritures d'un FEC : change dès qu'une écriture est ajoutée ou retirée"""
+        ids = [ecriture.id for ecriture in ecritures]
+        return len(ids), max(ids, default=0), sum(ids)
+
+    def _entree(self, fec_file_id, compte):
+        cle = (fec_file_id, compte)
+        entree = self._entries.get(cle)
+        if entree is not None:
+            self._entries.move_to_end(cle)
+        return entree
+
+    def suggestions(self, fec_file_id, compte, empreinte):
+        """Règles suggérées en cache pour le compte (None si absentes ou corpus modifié)"""
+        with self._lock:
+            entree = self._entree(fec_file_id, compte)
+            if entree is None or entree['suggestions'] is None or entree['empreinte'] != empreinte:
+                return None
+            return entree['suggestions']
+
+    def enregistrer_suggestions(self, societe_id, fec_file_id, compte, empreinte, suggestions, ecriture_ids):
+        with self._lock:
+            entree = self._entree(fec_file_id, compte)
+            if entree is None or entree['empreinte'] != empreinte:
+                entree = self._nouvelle_entree(societe_id, fec_file_id, compte, empreinte)
+            entree['suggestions'] = suggestions
+            entree['ecritures'] = frozenset(ecriture_ids)
+
+    def couverture(self, fec_file_id, compte, empreinte, empreinte_regles):
+        """
+        Identifiants des écritures du compte couvertes par une règle (None si à recalculer :
+        corpus modifié ou règles de la société différentes de celles qui l'ont produite)
+        """
+        with self._lock:
+            entree = self._entree(fec_file_id, compte)
+            if (entree is None or entree['couverture'] is None or entree['empreinte'] != empreinte
+                    or entree['empreinte_regles'] != empreinte_regles):
+                return None
+            return entree['couverture']
+
+    def enregistrer_couverture(self, societe_id, fec_file_id, compte, empreinte, empreinte_regles,
+                               ecriture_ids, ecritures_couvertes, regles_couvrantes):
+        with self._lock:
+            entree = self._entree(fec_file_id, compte)
+            if entree is None or entree['empreinte'] != empreinte:
+                entree = self._nouvelle_entree(societe_id, fec_file_id, compte, empreinte)
+            entree['ecritures'] = frozenset(ecriture_ids)
+            entree['couverture'] = frozenset(ecritures_couvertes)
+            entree['empreinte_regles'] = empreinte_regles
+            entree['regles_couvrantes'] = frozenset(regles_couvrantes)
+
+    def _nouvelle_entree(self, societe_id, fec_file_id, compte, empreinte):
+        entree = {
+            'societe_id': societe_id,
+            'empreinte': empreinte,
+            'suggestions': None,
+            'ecritures': frozenset(),
+            'couverture': None,
+            'empreinte_regles': None,
+            'regles_couvrantes': frozenset()
+        }
+        self._entries[(fec_file_id, compte)] = entree
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return entree
+
+    def invalider_regles(self, societe_id, regles):
+        """
+        Invalide la couverture des comptes touchés par des règles créées, modifiées ou supprimées
+
+        Raccourci local : la couverture d'une entrée n'est de toute façon servie que pour la même
+        empreinte des règles (voir couverture).
+
+        Args:
+            societe_id (int): Société des règles
+            regles (list): Tuples (regle_id, mots_cles) ; regle_id peut être None
+        """
+        from app.services.index_libelles import index_libelles_cache
+
+        with self._lock:
+            entrees = [(cle, entree) for cle, entree in self._entries.items()
+                       if entree['societe_id'] == societe_id and entree['couverture'] is not None]
+        if not entrees:
+            return
+
+        regle_ids = {regle_id for regle_id, _ in regles if regle_id is not None}
+        mots_cles = set()
+        for _, mots in regles:
+            if isinstance(mots, str):
+                mots = mots.split(',')
+            mots_cles.update(normaliser_libelle(mot) for mot in mots or [] if mot and mot.strip())
+
+        # Écritures contenant un mot-clé des règles, par FEC (recherche dans l'index du FEC)
+        ecritures_touchees = {}
+        for fec_file_id in {cle[0] for cle, _ in entrees}:
+            index = index_libelles_cache.index_pour_fec(fec_file_id)
+            touchees = set()
+            for mot_cle in mots_cles:
+                touchees.update(index.identifiants_contenant(mot_cle))
+            ecritures_touchees[fec_file_id] = touchees
+
+        with self._lock:
+            for cle, entree in entrees:
+                if self._entries.get(cle) is not entree:
+                    continue
+                if entree['regles_couvrantes'] & regle_ids or not entree['ecritures'].isdisjoint(
+                        ecritures_touchees[cle[0]]):
+                    entree['couverture'] = None
+                    entree['empreinte_regles'] = None
+                    entree['regles_couvrantes'] = frozenset()
+
+    def invalidate_societe(self, societe_id):
+        """Supprime toutes les entrées d'une société"""
+        with self._lock:
+            for cle in [c for c, entree in self._entries.items() if entree['societe_id'] == societe_id]:
+                del self._entries[cle]
+
+    def invalidate_fec(self, fec_file_id):
+        """Supprime toutes les entrées calculées pour un FEC"""
+        with self._lock:
+            for cle in [c for c in self._entries if c[0] == fec_file_id]:
+                del self._entries[cle]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# Instance partagée par toute l'application
+suggestion_cache = SuggestionCache()
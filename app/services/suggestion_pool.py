@@ -0,0 +1,155 @@
+import itertools
+import multiprocessing
+import os
+import threading
+from array import array
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from app.services.rule_suggester import CorpusSuggestion, RuleSuggester
+
+
+class InstantaneCorpus:
+    """
+    Représentation en colonnes des transactions d'une société, peu coûteuse à transmettre
+
+    Chaque clé des dictionnaires de transactions devient une colonne. Les colonnes à
+    faible cardinalité (journal, compte, libellé du compte) sont encodées par dictionnaire
+    (valeurs distinctes + codes entiers) et les montants stockés en tableau de flottants.
+    Les transactions reconstruites sont identiques aux originales.
+    """
+
+    _ABSENTE = None
+
+    def __init__(self, transactions):
+        self.nb_transactions = len(transactions)
+        cles = []
+        for trans in transactions:
+            for cle in trans:
+                if cle not in cles:
+                    cles.append(cle)
+
+        self.colonnes = {}
+        for cle in cles:
+            presences = array('b', (1 if cle in trans else 0 for trans in transactions))
+            valeurs = [trans.get(cle) for trans in transactions]
+            self.colonnes[cle] = (presences if not all(presences) else None, self._encoder(valeurs))
+
+    @staticmethod
+    def _encoder(valeurs):
+        if valeurs and all(type(v) is float for v in valeurs):
+            return 'flottants', array('d', valeurs)
+
+        distinctes = {}
+        for valeur in valeurs:
+            try:
+                distinctes.setdefault(valeur, len(distinctes))
+            except TypeError:
+                return 'brut', valeurs
+        if len(distinctes) <= len(valeurs) // 2:
+            return 'dictionnaire', (list(distinctes), array('I', (distinctes[v] for v in valeurs)))
+        return 'brut', valeurs
+
+    @staticmethod
+    def _decoder(encodage):
+        nature, donnees = encodage
+        if nature == 'flottants':
+            return list(donnees)
+        if nature == 'dictionnaire':
+            distinctes, codes = donnees
+            return [distinctes[code] for code in codes]
+        return donnees
+
+    def transactions(self):
+        """Reconstruit la liste des dictionnaires de transactions"""
+        transactions = [{} for _ in range(self.nb_transactions)]
+        for cle, (presences, encodage) in self.colonnes.items():
+            for i, valeur in enumerate(self._decoder(encodage)):
+                if presences is None or presences[i]:
+                    transactions[i][cle] = valeur
+        return transactions
+
+
+# Instantanés des appels en cours, par clé d'appel : hérités par fork, jamais partagés entre appels
+_instantanes = {}
+_instantanes_lock = threading.Lock()
+_numeros_appel = itertools.count()
+
+# Corpus du processus de calcul (construit par l'initialiseur)
+_corpus = None
+
+
+def _initialiser_processus(instantane, cle_appel, debug, taille_echantillon=0):
+    """
+    Construit le corpus une fois par processus à partir de l'instantané reçu, ou à défaut
+    de celui de l'appel `cle_appel` hérité par fork
+    """
+    global _corpus
+    if instantane is None:
+        instantane = _instantanes[cle_appel]
+    _corpus = CorpusSuggestion(instantane.transactions(),
+                               RuleSuggester(debug=debug, taille_echantillon=taille_echantillon))
+
+
+def _suggerer_compte(compte):
+    corpus = _corpus
+    return compte, corpus.suggester.suggest_rules_for_account(
+        compte, corpus.transactions_compte(compte), corpus.transactions, corpus=corpus)
+
+
+def _contexte_processus():
+    """
+    Méthode de démarrage des processus : fork seulement depuis un processus à un seul fil
+    (un fork depuis un serveur multi-fils peut hériter de verrous tenus par les autres fils),
+    sinon forkserver (ou la méthode par défaut de la plateforme), qui reçoit l'instantané en argument
+
+    Returns:
+        tuple: (contexte multiprocessing, vrai si l'instantané est hérité par fork)
+    """
+    methodes = multiprocessing.get_all_start_methods()
+    if 'fork' in methodes and threading.active_count() == 1:
+        return multiprocessing.get_context('fork'), True
+    if 'forkserver' in methodes:
+        return multiprocessing.get_context('forkserver'), False
+    return multiprocessing.get_context(), False
+
+
+def suggerer_tous_comptes(transactions, comptes, workers=None, debug=False, taille_echantillon=0):
+    """
+    Répartit l'analyse des comptes sur un pool de processus
+
+    Depuis un processus à un seul fil, l'instantané du corpus est hérité par fork (aucune
+    sérialisation) ; depuis un serveur multi-fils, il est transmis une fois par processus via
+    l'initialiseur (voir _contexte_processus). Chaque appel a son propre instantané : des appels
+    simultanés ne se le disputent pas. Les comptes les plus volumineux sont soumis en premier
+    (ordonnancement LPT) et les résultats fusionnés dans l'ordre des comptes : la sortie est
+    identique à l'exécution séquentielle.
+    """
+    comptes = sorted(comptes)
+    workers = min(workers or os.cpu_count() or 1, len(comptes))
+
+    volumes = {}
+    for trans in transactions:
+        compte = trans.get('compte_contrepartie')
+        volumes[compte] = volumes.get(compte, 0) + 1
+    ordre_lpt = sorted(comptes, key=lambda compte: (-volumes.get(compte, 0), compte))
+
+    instantane = InstantaneCorpus(transactions)
+    contexte, par_fork = _contexte_processus()
+    cle_appel = next(_numeros_appel)
+    if par_fork:
+        with _instantanes_lock:
+            _instantanes[cle_appel] = instantane
+        initargs = (None, cle_appel, debug, taille_echantillon)
+    else:
+        initargs = (instantane, cle_appel, debug, taille_echantillon)
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=contexte,
+                                 initializer=_initialiser_processus, initargs=initargs) as executor:
+            futures = [executor.submit(_suggerer_compte, compte) for compte in ordre_lpt]
+            resultats = dict(future.result() for future in as_completed(futures))
+    finally:
+        with _instantanes_lock:
+            _instantanes.pop(cle_appel, None)
+
+    return {compte: resultats[compte] for compte in comptes}
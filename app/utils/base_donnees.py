@@ -0,0 +1,150 @@
+import threading
+import time
+from functools import wraps
+
+from flask import current_app
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+
+from app.models import db
+
+# Bornes (ms) de l'histogramme des attentes de connexion
+BORNES_ATTENTE_MS = (1, 5, 10, 50, 100, 500, 1000, 5000)
+
+
+class MesuresPool:
+    """Temps d'attente des demandes de connexion au pool (checkout)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reinitialiser()
+
+    def reinitialiser(self):
+        with self._lock:
+            self.nb_demandes = 0
+            self.nb_echecs = 0
+            self.attente_totale_ms = 0.0
+            self.attente_max_ms = 0.0
+            self.histogramme = [0] * (len(BORNES_ATTENTE_MS) + 1)
+
+    def enregistrer(self, attente_ms, succes=True):
+        """Ajoute une demande de connexion (échec = délai DB_POOL_TIMEOUT dépassé)"""
+        tranche = next((i for i, borne in enumerate(BORNES_ATTENTE_MS) if attente_ms <= borne),
+                       len(BORNES_ATTENTE_MS))
+        with self._lock:
+            self.nb_demandes += 1
+            self.nb_echecs += 0 if succes else 1
+            self.attente_totale_ms += attente_ms
+            self.attente_max_ms = max(self.attente_max_ms, attente_ms)
+            self.histogramme[tranche] += 1
+
+    def en_dict(self):
+        with self._lock:
+            libelles = [f"<={borne}ms" for borne in BORNES_ATTENTE_MS] + [f">{BORNES_ATTENTE_MS[-1]}ms"]
+            return {
+                'nb_demandes': self.nb_demandes,
+                'nb_echecs': self.nb_echecs,
+                'attente_moyenne_ms': round(self.attente_totale_ms / self.nb_demandes, 3) if self.nb_demandes else 0,
+                'attente_max_ms': round(self.attente_max_ms, 3),
+                'histogramme': dict(zip(libelles, self.histogramme))
+            }
+
+
+class PoolMesure(QueuePool):
+    """
+    QueuePool qui mesure la durée de chaque demande de connexion
+
+    La mesure entoure connect(), méthode publique du pool : elle comprend l'attente d'une
+    connexion libre, l'ouverture d'une nouvelle connexion et la vérification pre_ping.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.mesures = MesuresPool()
+
+    def connect(self):
+        debut = time.perf_counter()
+        succes = False
+        try:
+            connexion = super().connect()
+            succes = True
+            return connexion
+        finally:
+            self.mesures.enregistrer((time.perf_counter() - debut) * 1000, succes)
+
+
+def options_moteur(config, uri=None):
+    """
+    Options du moteur SQLAlchemy (SQLALCHEMY_ENGINE_OPTIONS) d'après la configuration DB_*
+
+    Seules les bases PostgreSQL sont concernées : les autres gardent les options par défaut.
+    Derrière PgBouncer (mode transaction), aucun paramètre de démarrage n'est envoyé : la durée
+    maximale par défaut des requêtes se règle alors sur le rôle (ALTER ROLE ... SET statement_timeout).
+
+    Args:
+        config: configuration de l'application
+        uri (str): base concernée (défaut : SQLALCHEMY_DATABASE_URI), par exemple le réplica
+    """
+    url = make_url(uri or config['SQLALCHEMY_DATABASE_URI'])
+    if url.get_backend_name() != 'postgresql':
+        return {}
+
+    options = {
+        'poolclass': PoolMesure,
+        'pool_size': config.get('DB_POOL_SIZE', 10),
+        'max_overflow': config.get('DB_MAX_OVERFLOW', 5),
+        'pool_timeout': config.get('DB_POOL_TIMEOUT', 10),
+        'pool_recycle': config.get('DB_POOL_RECYCLE', 1800),
+        'pool_pre_ping': config.get('DB_POOL_PRE_PING', True),
+    }
+
+    connect_args = {}
+    if config.get('DB_PGBOUNCER'):
+        # psycopg 3 prépare les requêtes répétées côté serveur, ce que PgBouncer ne suit pas
+        if url.get_driver_name() == 'psycopg':
+            connect_args['prepare_threshold'] = None
+    elif config.get('DB_STATEMENT_TIMEOUT_MS'):
+        connect_args['options'] = f"-c statement_timeout={int(config['DB_STATEMENT_TIMEOUT_MS'])}"
+
+    if connect_args:
+        options['connect_args'] = connect_args
+    return options
+
+
+def metriques_pool():
+    """État du pool de connexions et temps d'attente des demandes de connexion"""
+    pool = db.engine.pool
+    metriques = {'pool': type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        metriques.update({
+            'taille': pool.size(),
+            'connexions_utilisees': pool.checkedout(),
+            'connexions_libres': pool.checkedin(),
+            'debordement': pool.overflow(),
+        })
+    if isinstance(pool, PoolMesure):
+        metriques['attente'] = pool.mesures.en_dict()
+    return metriques
+
+
+def delai_requetes(cle_config):
+    """
+    Décorateur de route : limite la durée des requêtes SQL de la route (PostgreSQL uniquement)
+
+    La limite, lue dans la configuration sous `cle_config` (ms, 0 = aucune), est posée par
+    SET LOCAL : elle vaut jusqu'à la fin de la transaction en cours et reste compatible avec
+    PgBouncer en mode transaction.
+    """
+    def decorateur(vue):
+        @wraps(vue)
+        def vue_limitee(*args, **kwargs):
+            delai_ms = current_app.config.get(cle_config, 0)
+            if delai_ms and db.engine.dialect.name == 'postgresql':
+                db.session.execute(
+                    text("SELECT set_config('statement_timeout', :delai, true)"),
+                    {'delai': str(int(delai_ms))}
+                )
+            return vue(*args, **kwargs)
+        return vue_limitee
+    return decorateur
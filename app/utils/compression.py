@@ -0,0 +1,64 @@
+import gzip
+
+from flask import current_app, make_response, request
+
+# Dépendance optionnelle (voir requirements.txt) : sans elle, seul gzip est proposé
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# En dessous, la compression coûte plus qu'elle ne fait gagner
+TAILLE_MIN_COMPRESSION = 1024
+
+
+def encodages_disponibles():
+    """Encodages de contenu pris en charge, par ordre de préférence à qualité égale"""
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def encodage_negocie():
+    """
+    Encodage à appliquer à la réponse d'après l'en-tête Accept-Encoding : 'br', 'gzip' ou None
+
+    L'encodage de plus forte qualité est retenu ; à qualité égale brotli est préféré
+    (s'il est installé), car plus compact que gzip sur du JSON.
+    """
+    meilleur, meilleure_qualite = None, 0
+    for encodage in encodages_disponibles():
+        qualite = request.accept_encodings.quality(encodage)
+        if qualite > meilleure_qualite:
+            meilleur, meilleure_qualite = encodage, qualite
+    return meilleur
+
+
+def compresser(donnees, encodage):
+    """
+    Compresse des octets selon l'encodage négocié
+
+    Returns:
+        tuple: (octets, encodage effectivement appliqué ou None si non compressé)
+    """
+    if encodage is None or len(donnees) < TAILLE_MIN_COMPRESSION:
+        return donnees, None
+    if encodage == 'br':
+        return brotli.compress(donnees, quality=5), 'br'
+    return gzip.compress(donnees, compresslevel=6), 'gzip'
+
+
+def corps_json(payload, encodage):
+    """Sérialise le payload en JSON (sérialiseur de l'application) puis le compresse"""
+    return compresser(current_app.json.dumps_octets(payload), encodage)
+
+
+def reponse_json_compressee(corps, encodage, etag=None):
+    """Réponse JSON à partir d'un corps déjà sérialisé et éventuellement compressé (voir corps_json)"""
+    response = make_response(corps)
+    response.mimetype = 'application/json'
+    if encodage:
+        response.headers['Content-Encoding'] = encodage
+    response.vary.add('Accept-Encoding')
+    if etag:
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+    return response
@@ -0,0 +1,90 @@
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from functools import lru_cache
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Formats des dates dans les réponses JSON (ceux qu'affiche l'interface)
+FORMAT_DATE = '%d/%m/%Y'
+FORMAT_DATETIME = '%d/%m/%Y %H:%M'
+
+
+@lru_cache(maxsize=4096)
+def _texte_date(valeur):
+    # Un FEC ne compte que quelques centaines de dates distinctes : strftime une fois par date
+    return valeur.strftime(FORMAT_DATE)
+
+
+def _valeur_json(obj):
+    """Conversion des types non natifs : Decimal en nombre, dates au format de l'interface"""
+    type_obj = type(obj)
+    if type_obj is Decimal:
+        return float(obj)
+    if type_obj is date:
+        return _texte_date(obj)
+    if isinstance(obj, datetime):
+        return obj.strftime(FORMAT_DATETIME)
+    if isinstance(obj, date):
+        return obj.strftime(FORMAT_DATE)
+    if isinstance(obj, Decimal):
+        return float(obj)
+    return DefaultJSONProvider.default(obj)
+
+
+class AffectiaJSONProvider(DefaultJSONProvider):
+    """
+    Sérialiseur JSON de l'application (jsonify, current_app.json)
+
+    Decimal, date et datetime sont sérialisés directement : les routes peuvent renvoyer
+    les valeurs des modèles sans conversion ligne par ligne (float(), strftime()).
+    orjson est utilisé s'il est installé, sinon le module json de la bibliothèque standard ;
+    les deux produisent le même JSON (à l'échappement des caractères non ASCII près).
+    """
+
+    default = staticmethod(_valeur_json)
+
+    def _options_orjson(self, kwargs):
+        """Options orjson équivalentes aux arguments, ou None si orjson ne sait pas les appliquer"""
+        if orjson is None or kwargs.get('indent') not in (None, 2) or 'cls' in kwargs \
+                or kwargs.get('separators') not in (None, (',', ':')) or 'default' in kwargs:
+            return None
+        options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if kwargs.get('sort_keys', self.sort_keys):
+            options |= orjson.OPT_SORT_KEYS
+        if kwargs.get('indent') == 2:
+            options |= orjson.OPT_INDENT_2
+        return options
+
+    def dumps_octets(self, obj, **kwargs):
+        """Sérialise en octets UTF-8 (évite l'aller-retour par une chaîne avec orjson)"""
+        options = self._options_orjson(kwargs)
+        if options is not None:
+            try:
+                return orjson.dumps(obj, default=_valeur_json, option=options)
+            except TypeError:
+                # Valeur hors du domaine d'orjson (entier de plus de 64 bits...) : sérialisation standard
+                pass
+        kwargs.setdefault('default', self.default)
+        kwargs.setdefault('ensure_ascii', self.ensure_ascii)
+        kwargs.setdefault('sort_keys', self.sort_keys)
+        return json.dumps(obj, **kwargs).encode('utf-8')
+
+    def dumps(self, obj, **kwargs):
+        return self.dumps_octets(obj, **kwargs).decode('utf-8')
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        dump_args = {}
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            dump_args['indent'] = 2
+        else:
+            dump_args['separators'] = (',', ':')
+        return self._app.response_class(
+            self.dumps_octets(obj, **dump_args) + b'\n', mimetype=self.mimetype
+        )
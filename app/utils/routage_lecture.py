@@ -0,0 +1,65 @@
+import time
+from functools import wraps
+
+from flask import current_app, g, has_app_context, has_request_context, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy.sql.dml import UpdateBase
+
+# Clé de SQLALCHEMY_BINDS du réplica en lecture seule
+CLE_REPLICA = 'replica'
+
+
+def _lecture_sur_replica():
+    """Vrai si la requête HTTP en cours lit sur le réplica (route en lecture seule, aucune écriture)"""
+    return has_request_context() and g.get('lecture_replica', False) and not g.get('ecriture_requete', False)
+
+
+def marquer_ecriture():
+    """
+    Signale une écriture pendant la requête en cours : ses lectures suivantes restent sur la base
+    principale, le réplica ne la contenant pas encore
+    """
+    if has_app_context():
+        g.ecriture_requete = True
+
+
+class SessionRoutee(Session):
+    """
+    Session qui envoie les lectures des routes en lecture seule (décorateur lecture_seule)
+    vers le réplica, et tout le reste vers la base principale
+
+    Les écritures (flush, INSERT/UPDATE/DELETE) vont toujours à la base principale ; après la
+    première, la requête ne lit plus que sur la base principale.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None:
+            if self._flushing or isinstance(clause, UpdateBase):
+                marquer_ecriture()
+            elif _lecture_sur_replica():
+                replica = self._db.engines.get(CLE_REPLICA)
+                if replica is not None:
+                    return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def noter_ecriture_utilisateur():
+    """
+    Ouvre la fenêtre de lecture de ses propres écritures (DB_REPLICA_FENETRE_S) : l'utilisateur
+    qui vient d'importer un FEC ou de modifier ses règles est servi par la base principale
+    le temps que le réplica les reçoive
+    """
+    session['derniere_ecriture'] = time.time()
+
+
+def lecture_seule(vue):
+    """
+    Décorateur de route : les lectures de la route vont au réplica s'il est configuré, sauf
+    dans la fenêtre qui suit une écriture de l'utilisateur (noter_ecriture_utilisateur)
+    """
+    @wraps(vue)
+    def vue_routee(*args, **kwargs):
+        fenetre = current_app.config.get('DB_REPLICA_FENETRE_S', 0)
+        g.lecture_replica = time.time() - session.get('derniere_ecriture', 0) > fenetre
+        return vue(*args, **kwargs)
+    return vue_routee
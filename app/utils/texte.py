@@ -0,0 +1,26 @@
+import re
+import unicodedata
+
+_ESPACES = re.compile(r'\s+')
+
+
+def normaliser_libelle(texte):
+    """
+    Normalise un libellé pour la recherche de mots-clés :
+    majuscules, suppression des accents, espaces multiples réduits à un seul.
+
+    C'est la forme stockée dans EcritureBancaire.ecriture_lib_norm et celle
+    sur laquelle travaillent RegleTester et RuleSuggester.
+    """
+    if not texte:
+        return ""
+    decompose = unicodedata.normalize('NFKD', texte.upper())
+    sans_accents = ''.join(c for c in decompose if not unicodedata.combining(c))
+    return _ESPACES.sub(' ', sans_accents).strip()
+
+
+def libelle_normalise(ecriture):
+    """Libellé normalisé d'une écriture (objet ou dict), recalculé pour les lignes importées avant la colonne"""
+    if isinstance(ecriture, dict):
+        return ecriture.get('ecriture_lib_norm') or normaliser_libelle(ecriture.get('ecriture_lib'))
+    return getattr(ecriture, 'ecriture_lib_norm', None) or normaliser_libelle(ecriture.ecriture_lib)
@@ -0,0 +1,131 @@
+"""
+Benchmark de la sérialisation JSON du payload dashboard-data
+
+Compare, sur des écritures générées en mémoire (aucune base de données requise) :
+- avant : lignes construites avec float() et strftime(), sérialisées par le JSONProvider de Flask ;
+- après : lignes avec les valeurs des modèles (Decimal, date), sérialisées par AffectiaJSONProvider
+  (orjson s'il est installé).
+
+Usage : python benchmark_json.py [--nb 50000] [--repetitions 5]
+"""
+import argparse
+import random
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+from app.models.ecriture_bancaire import EcritureBancaire
+from app.utils import json_provider
+from app.utils.json_provider import AffectiaJSONProvider
+
+LIBELLES = [
+    ('PRLV SEPA FREE MOBILE', '401FREE'), ('CB AMAZON PAYMENTS', '401AMAZ'),
+    ('VIR SALAIRE JEAN DUPONT', '421000'), ('PRLV URSSAF UR 123456789', '431000'),
+    ('CB STATION TOTAL ENERGIES', '606100'), ('FRAIS BANCAIRES', '627000'),
+]
+
+
+def generer_ecritures(nb, graine=1):
+    """Écritures non persistées, semblables à celles d'un FEC importé"""
+    aleatoire = random.Random(graine)
+    debut = date(2024, 1, 1)
+    ecritures = []
+    for i in range(nb):
+        libelle, compte = aleatoire.choice(LIBELLES)
+        ecritures.append(EcritureBancaire(
+            id=i + 1, journal_code=aleatoire.choice(['BQ1', 'BQ2']), journal_lib='Banque',
+            ecriture_num=str(i), ecriture_date=debut + timedelta(days=i % 366),
+            ecriture_lib=f"{libelle} {i % 97}", piece_ref=f"P{i}",
+            montant=Decimal(aleatoire.randint(100, 500000)) / 100, sens=aleatoire.choice('DC'),
+            compte_final='512000', libelle_final='Banque', compte_contrepartie=compte
+        ))
+    return ecritures
+
+
+def lignes_avant(ecritures):
+    return [{
+        'id': ecriture.id,
+        'ecriture_lib': ecriture.ecriture_lib,
+        'journal_code': ecriture.journal_code,
+        'journal_lib': ecriture.journal_lib,
+        'ecriture_date': ecriture.ecriture_date.strftime('%d/%m/%Y'),
+        'ecriture_num': ecriture.ecriture_num,
+        'piece_ref': ecriture.piece_ref,
+        'montant': float(ecriture.montant) if ecriture.sens == 'D' else -float(ecriture.montant),
+        'sens': ecriture.sens,
+        'compte_final': ecriture.compte_final,
+        'libelle_final': ecriture.libelle_final,
+        'compte_contrepartie': ecriture.compte_contrepartie,
+        'couverte_par_regle': ecriture.id % 3 == 0
+    } for ecriture in ecritures]
+
+
+def lignes_apres(ecritures):
+    return [{
+        'id': ecriture.id,
+        'ecriture_lib': ecriture.ecriture_lib,
+        'journal_code': ecriture.journal_code,
+        'journal_lib': ecriture.journal_lib,
+        'ecriture_date': ecriture.ecriture_date,
+        'ecriture_num': ecriture.ecriture_num,
+        'piece_ref': ecriture.piece_ref,
+        'montant': ecriture.montant if ecriture.sens == 'D' else -ecriture.montant,
+        'sens': ecriture.sens,
+        'compte_final': ecriture.compte_final,
+        'libelle_final': ecriture.libelle_final,
+        'compte_contrepartie': ecriture.compte_contrepartie,
+        'couverte_par_regle': ecriture.id % 3 == 0
+    } for ecriture in ecritures]
+
+
+def mesurer(fonction, repetitions):
+    """Meilleur temps (ms) sur plusieurs exécutions"""
+    meilleur = None
+    for _ in range(repetitions):
+        debut = time.perf_counter()
+        resultat = fonction()
+        duree = (time.perf_counter() - debut) * 1000
+        meilleur = duree if meilleur is None else min(meilleur, duree)
+    return meilleur, resultat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--nb', type=int, default=50000, help="nombre d'écritures")
+    parser.add_argument('--repetitions', type=int, default=5)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    fournisseur_flask = DefaultJSONProvider(app)
+    fournisseur_affectia = AffectiaJSONProvider(app)
+    ecritures = generer_ecritures(args.nb)
+
+    with app.app_context():
+        def avant():
+            payload = {'success': True, 'ecritures': lignes_avant(ecritures)}
+            return fournisseur_flask.response(payload).get_data()
+
+        def apres():
+            payload = {'success': True, 'ecritures': lignes_apres(ecritures)}
+            return fournisseur_affectia.response(payload).get_data()
+
+        t_lignes_avant, _ = mesurer(lambda: lignes_avant(ecritures), args.repetitions)
+        t_lignes_apres, _ = mesurer(lambda: lignes_apres(ecritures), args.repetitions)
+        t_avant, corps_avant = mesurer(avant, args.repetitions)
+        t_apres, corps_apres = mesurer(apres, args.repetitions)
+
+    moteur = 'orjson' if json_provider.orjson is not None else 'json (bibliothèque standard)'
+    print(f"📊 dashboard-data, {args.nb} écritures (meilleur temps sur {args.repetitions})")
+    print(f"   Construction des lignes : {t_lignes_avant:8.1f} ms avant, {t_lignes_apres:8.1f} ms après")
+    print(f"   Sérialisation seule     : {t_avant - t_lignes_avant:8.1f} ms avant, "
+          f"{t_apres - t_lignes_apres:8.1f} ms après ({moteur})")
+    print(f"   Lignes + sérialisation  : {t_avant:8.1f} ms avant, {t_apres:8.1f} ms après")
+    print(f"   Accélération            : x{t_avant / t_apres:.1f}")
+    print(f"   Taille du corps         : {len(corps_avant)} octets avant, {len(corps_apres)} octets après")
+
+
+if __name__ == '__main__':
+    main()
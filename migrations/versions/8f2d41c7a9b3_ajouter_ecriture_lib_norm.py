@@ -0,0 +1,61 @@
+"""Ajouter ecriture_lib_norm (libellé normalisé pour les règles)
+
+Revision ID: 8f2d41c7a9b3
+Revises: 3c1230aa6460
+Create Date: 2026-10-19 10:12:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8f2d41c7a9b3'
+down_revision = '3c1230aa6460'
+branch_labels = None
+depends_on = None
+
+# Nombre d'écritures normalisées par lot (une transaction par lot)
+TAILLE_LOT_BACKFILL = 5000
+
+
+def upgrade():
+    with op.batch_alter_table('ecritures_bancaires', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('ecriture_lib_norm', sa.Text(), nullable=True))
+
+    # Remplir la colonne pour les écritures déjà importées, par lots dans l'ordre des identifiants :
+    # mémoire bornée, et chaque lot est une seule instruction UPDATE validée à part (mode
+    # autocommit), sans transaction longue sur toute la table
+    from app.utils.texte import normaliser_libelle
+
+    ecritures = sa.table(
+        'ecritures_bancaires',
+        sa.column('id', sa.Integer),
+        sa.column('ecriture_lib', sa.Text),
+        sa.column('ecriture_lib_norm', sa.Text)
+    )
+
+    with op.get_context().autocommit_block():
+        bind = op.get_bind()
+        dernier_id = 0
+        while True:
+            lignes = bind.execute(
+                sa.select(ecritures.c.id, ecritures.c.ecriture_lib)
+                .where(ecritures.c.id > dernier_id)
+                .order_by(ecritures.c.id)
+                .limit(TAILLE_LOT_BACKFILL)
+            ).fetchall()
+            if not lignes:
+                break
+            normalises = {ligne.id: normaliser_libelle(ligne.ecriture_lib) for ligne in lignes}
+            bind.execute(
+                ecritures.update()
+                .where(ecritures.c.id.in_(list(normalises)))
+                .values(ecriture_lib_norm=sa.case(normalises, value=ecritures.c.id))
+            )
+            dernier_id = lignes[-1].id
+
+
+def downgrade():
+    with op.batch_alter_table('ecritures_bancaires', schema=None) as batch_op:
+        batch_op.drop_column('ecriture_lib_norm')
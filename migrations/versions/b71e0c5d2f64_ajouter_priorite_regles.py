@@ -0,0 +1,26 @@
+"""Ajouter priorite aux règles d'affectation
+
+Revision ID: b71e0c5d2f64
+Revises: 8f2d41c7a9b3
+Create Date: 2026-10-19 11:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b71e0c5d2f64'
+down_revision = '8f2d41c7a9b3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('regles_affectation', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('priorite', sa.Integer(), nullable=False, server_default='0'))
+
+
+def downgrade():
+    with op.batch_alter_table('regles_affectation', schema=None) as batch_op:
+        batch_op.drop_column('priorite')
@@ -0,0 +1,27 @@
+"""Ajouter l'index des libellés aux fichiers FEC
+
+Revision ID: d4a9e2b17c30
+Revises: b71e0c5d2f64
+Create Date: 2026-10-19 14:05:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd4a9e2b17c30'
+down_revision = 'b71e0c5d2f64'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Les FEC déjà importés sont indexés à la première recherche (CacheIndexLibelles)
+    with op.batch_alter_table('fec_files', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('index_libelles', sa.LargeBinary(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('fec_files', schema=None) as batch_op:
+        batch_op.drop_column('index_libelles')
@@ -0,0 +1,33 @@
+"""Index composites pour la pagination filtrée des écritures
+
+Revision ID: e6b3f81a4d52
+Revises: d4a9e2b17c30
+Create Date: 2026-10-19 18:20:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'e6b3f81a4d52'
+down_revision = 'd4a9e2b17c30'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Chaque index se termine par id : le curseur (valeur de tri, id) est une borne d'index
+    with op.batch_alter_table('ecritures_bancaires', schema=None) as batch_op:
+        batch_op.create_index('ix_ecritures_fec_date', ['fec_file_id', 'ecriture_date', 'id'])
+        batch_op.create_index('ix_ecritures_fec_compte_date',
+                              ['fec_file_id', 'compte_contrepartie', 'ecriture_date', 'id'])
+        batch_op.create_index('ix_ecritures_fec_journal_date', ['fec_file_id', 'journal_code', 'ecriture_date', 'id'])
+        batch_op.create_index('ix_ecritures_fec_montant', ['fec_file_id', 'montant', 'id'])
+
+
+def downgrade():
+    with op.batch_alter_table('ecritures_bancaires', schema=None) as batch_op:
+        batch_op.drop_index('ix_ecritures_fec_montant')
+        batch_op.drop_index('ix_ecritures_fec_journal_date')
+        batch_op.drop_index('ix_ecritures_fec_compte_date')
+        batch_op.drop_index('ix_ecritures_fec_date')
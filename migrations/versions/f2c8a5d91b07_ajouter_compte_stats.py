@@ -0,0 +1,44 @@
+"""Ajouter la table compte_stats (agrégats par compte de contrepartie)
+
+Revision ID: f2c8a5d91b07
+Revises: e6b3f81a4d52
+Create Date: 2026-10-19 21:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2c8a5d91b07'
+down_revision = 'e6b3f81a4d52'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Les FEC déjà importés sont agrégés à la première lecture de la table des comptes
+    op.create_table(
+        'compte_stats',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('fec_file_id', sa.Integer(), nullable=False),
+        sa.Column('compte', sa.String(length=20), nullable=False),
+        sa.Column('libelle', sa.String(length=200), nullable=False),
+        sa.Column('nb_transactions', sa.Integer(), nullable=False),
+        sa.Column('montant_debit', sa.Numeric(precision=18, scale=2), nullable=False),
+        sa.Column('montant_credit', sa.Numeric(precision=18, scale=2), nullable=False),
+        sa.Column('nb_couvertes', sa.Integer(), nullable=False),
+        sa.Column('empreinte_regles', sa.String(length=40), nullable=True),
+        sa.ForeignKeyConstraint(['fec_file_id'], ['fec_files.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('fec_file_id', 'compte', name='uq_compte_stats_fec_compte')
+    )
+    with op.batch_alter_table('compte_stats', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_compte_stats_fec_file_id'), ['fec_file_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('compte_stats', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_compte_stats_fec_file_id'))
+
+    op.drop_table('compte_stats')
@@ -0,0 +1,25 @@
+import pytest
+from sqlalchemy.pool import StaticPool
+
+from config.database import Config
+
+
+@pytest.fixture
+def app(monkeypatch):
+    """Application sur une base SQLite en mémoire (une seule connexion partagée)"""
+    monkeypatch.setattr(Config, 'SQLALCHEMY_DATABASE_URI', 'sqlite://')
+    monkeypatch.setattr(Config, 'SQLALCHEMY_ENGINE_OPTIONS', {
+        'poolclass': StaticPool,
+        'connect_args': {'check_same_thread': False}
+    }, raising=False)
+
+    from app import create_app
+    from app.models import db
+
+    app = create_app()
+    app.config['TESTING'] = True
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
@@ -0,0 +1,74 @@
+import random
+
+import pytest
+
+from app.services.index_libelles import IndexProgressif, IndexSousChaines
+
+# Petit alphabet : beaucoup de répétitions et de préfixes communs entre suffixes
+ALPHABET = 'AB É-1'
+
+
+def libelles_aleatoires(graine, nb, longueur_max):
+    aleatoire = random.Random(graine)
+    libelles = [''.join(aleatoire.choice(ALPHABET) for _ in range(aleatoire.randint(0, longueur_max)))
+                for _ in range(nb)]
+    # Libellés répétés (dédoublonnés par l'index) et libellé vide
+    libelles += aleatoire.sample(libelles, nb // 4) + ['']
+    aleatoire.shuffle(libelles)
+    return libelles
+
+
+def motifs_aleatoires(graine, libelles, nb):
+    aleatoire = random.Random(graine)
+    motifs = ['', 'A', 'É', 'ZZZ', '\n', 'A\nB']
+    for _ in range(nb):
+        libelle = aleatoire.choice([libelle for libelle in libelles if libelle])
+        debut = aleatoire.randrange(len(libelle))
+        motifs.append(libelle[debut:debut + aleatoire.randint(1, len(libelle) - debut)])
+        motifs.append(''.join(aleatoire.choice(ALPHABET) for _ in range(aleatoire.randint(1, 4))))
+    return motifs
+
+
+@pytest.mark.parametrize('graine, nb, longueur_max', [
+    (1, 60, 8),
+    (2, 200, 20),
+    # Libellés plus longs que LONGUEUR_CLE : motifs longs départagés au-delà de la clé
+    (3, 80, 3 * IndexSousChaines.LONGUEUR_CLE),
+])
+def test_identifiants_contenant_comme_recherche_naive(graine, nb, longueur_max):
+    libelles = libelles_aleatoires(graine, nb, longueur_max)
+    identifiants = [1000 + 7 * i for i in range(len(libelles))]
+    index = IndexSousChaines(libelles, identifiants)
+
+    for motif in motifs_aleatoires(graine, libelles, 80):
+        attendus = [identifiant for identifiant, libelle in zip(identifiants, libelles) if motif in libelle]
+        assert index.identifiants_contenant(motif) == attendus, motif
+
+
+def test_motif_long_partageant_la_cle():
+    cle = 'A' * IndexSousChaines.LONGUEUR_CLE
+    libelles = [cle + 'B', cle + 'C', 'X' + cle + 'B', cle]
+    index = IndexSousChaines(libelles)
+
+    assert index.identifiants_contenant(cle + 'B') == [0, 2]
+    assert index.identifiants_contenant(cle) == [0, 1, 2, 3]
+    assert index.identifiants_contenant(cle + 'D') == []
+
+
+def test_index_recharge_identique():
+    libelles = libelles_aleatoires(4, 120, 30)
+    index = IndexSousChaines(libelles, list(range(5, 5 + len(libelles))))
+    recharge = IndexSousChaines.charger(index.serialiser())
+
+    for motif in motifs_aleatoires(4, libelles, 40):
+        assert recharge.identifiants_contenant(motif) == index.identifiants_contenant(motif)
+
+
+def test_index_progressif_comme_recherche_naive():
+    libelles = libelles_aleatoires(5, 150, 20)
+    index = IndexProgressif(libelles)
+
+    # Assez de motifs pour passer du parcours des libellés à l'index des suffixes
+    for motif in motifs_aleatoires(5, libelles, 60):
+        attendus = [rang for rang, libelle in enumerate(libelles) if motif in libelle]
+        assert index.documents_contenant(motif) == attendus, motif
@@ -0,0 +1,174 @@
+import base64
+import json
+import random
+from datetime import date, timedelta
+from decimal import Decimal
+
+import pytest
+
+from app.models import db
+from app.models.ecriture_bancaire import EcritureBancaire
+from app.models.fec_file import FecFile
+from app.models.organization import Organization
+from app.models.societe import Societe
+from app.services import pagination_ecritures
+from app.services.pagination_ecritures import COLONNES_TRI, CurseurInvalide, decoder_curseur, page_ecritures
+
+COMPTES = ['401000', '606100', '627000']
+JOURNAUX = ['BQ1', 'BQ2']
+LIBELLES = ['PRLV EDF', 'CB CARREFOUR', 'VIR SALAIRE', 'FRAIS']
+
+
+def creer_fec():
+    organisation = Organization(nom='Cabinet', type_org='cabinet')
+    db.session.add(organisation)
+    db.session.flush()
+    societe = Societe(nom='Société', organization_id=organisation.id)
+    db.session.add(societe)
+    db.session.flush()
+    fec = FecFile(nom_fichier='fec.txt', nom_original='fec.txt', taille_fichier=1, nb_lignes_total=1,
+                  nb_lignes_bancaires=1, societe_id=societe.id)
+    db.session.add(fec)
+    db.session.flush()
+    return fec
+
+
+def ajouter_ecritures(fec, aleatoire, nb):
+    """Écritures aux dates, montants et libellés très répétés : beaucoup d'égalités à départager"""
+    for numero in range(nb):
+        montant = Decimal(aleatoire.choice([1000, 2550, 4000])) / 100
+        libelle = aleatoire.choice(LIBELLES)
+        db.session.add(EcritureBancaire(
+            journal_code=aleatoire.choice(JOURNAUX), journal_lib='Banque', ecriture_num=str(numero),
+            ecriture_date=date(2024, 1, 1) + timedelta(days=aleatoire.randrange(4)),
+            compte_num='512000', compte_lib='Banque', ecriture_lib=libelle, ecriture_lib_norm=libelle,
+            debit=montant, credit=0, compte_final='512000', libelle_final=libelle, montant=montant,
+            sens='D', fec_file_id=fec.id, compte_contrepartie=aleatoire.choice(COMPTES)
+        ))
+    db.session.commit()
+
+
+def toutes_les_pages(fec_file_id, limite, curseur=None, **options):
+    """Identifiants de toutes les pages (à partir du curseur), en suivant les curseurs"""
+    identifiants = []
+    while True:
+        ecritures, curseur = page_ecritures(fec_file_id, curseur=curseur, limite=limite, **options)
+        assert len(ecritures) <= limite
+        page = [ecriture.id for ecriture in ecritures]
+        # Une écriture répétée ferait boucler la pagination
+        assert set(page).isdisjoint(identifiants)
+        identifiants += page
+        if curseur is None:
+            return identifiants
+        assert len(ecritures) == limite
+
+
+def reference(fec_file_id, filtres=None, tri='date', ordre='asc', ecritures_couvertes=None, identifiants=None):
+    """Ordre attendu, calculé en Python sur toutes les écritures du FEC"""
+    filtres = filtres or {}
+    retenues = []
+    for ecriture in EcritureBancaire.query.filter_by(fec_file_id=fec_file_id):
+        if filtres.get('compte') and ecriture.compte_contrepartie != filtres['compte']:
+            continue
+        if filtres.get('journal') and ecriture.journal_code != filtres['journal']:
+            continue
+        if filtres.get('couverture') == 'couvertes' and ecriture.id not in ecritures_couvertes:
+            continue
+        if filtres.get('couverture') == 'non_couvertes' and ecriture.id in ecritures_couvertes:
+            continue
+        if identifiants is not None and ecriture.id not in identifiants:
+            continue
+        retenues.append(ecriture)
+    retenues.sort(key=lambda ecriture: (getattr(ecriture, COLONNES_TRI[tri].key), ecriture.id),
+                  reverse=ordre == 'desc')
+    return [ecriture.id for ecriture in retenues]
+
+
+@pytest.fixture
+def fec(app):
+    fec = creer_fec()
+    ajouter_ecritures(fec, random.Random(42), 120)
+    return fec
+
+
+@pytest.mark.parametrize('tri', sorted(COLONNES_TRI))
+@pytest.mark.parametrize('ordre', ['asc', 'desc'])
+@pytest.mark.parametrize('limite', [1, 7, 50, 500])
+def test_pages_comme_tri_complet(fec, tri, ordre, limite):
+    assert toutes_les_pages(fec.id, limite, tri=tri, ordre=ordre) == reference(fec.id, tri=tri, ordre=ordre)
+
+
+@pytest.mark.parametrize('tri', ['date', 'montant'])
+@pytest.mark.parametrize('ordre', ['asc', 'desc'])
+@pytest.mark.parametrize('filtres', [
+    {'compte': '606100'},
+    {'journal': 'BQ2', 'couverture': 'couvertes'},
+    {'couverture': 'non_couvertes'},
+    {'compte': '401000', 'couverture': 'couvertes'},
+])
+def test_filtres_applicatifs(fec, tri, ordre, filtres):
+    aleatoire = random.Random(7)
+    tous = [ecriture.id for ecriture in EcritureBancaire.query.filter_by(fec_file_id=fec.id)]
+    # Couverture très sélective : plusieurs lots lus pour remplir une page
+    couvertes = set(aleatoire.sample(tous, 15))
+    options = dict(filtres=filtres, tri=tri, ordre=ordre, ecritures_couvertes=couvertes)
+
+    for limite in (1, 4, 30):
+        assert toutes_les_pages(fec.id, limite, **options) == reference(fec.id, **options)
+
+
+@pytest.mark.parametrize('recherche_en_sql', [True, False])
+@pytest.mark.parametrize('ordre', ['asc', 'desc'])
+def test_filtre_identifiants(fec, monkeypatch, recherche_en_sql, ordre):
+    if not recherche_en_sql:
+        # Filtre par identifiants appliqué en Python, au fil des lots
+        monkeypatch.setattr(pagination_ecritures, 'MAX_IDENTIFIANTS_SQL', 5)
+    aleatoire = random.Random(3)
+    tous = [ecriture.id for ecriture in EcritureBancaire.query.filter_by(fec_file_id=fec.id)]
+    identifiants = set(aleatoire.sample(tous, 40))
+    couvertes = set(aleatoire.sample(tous, 60))
+    options = dict(filtres={'couverture': 'non_couvertes'}, tri='montant', ordre=ordre,
+                   ecritures_couvertes=couvertes, identifiants=identifiants)
+
+    for limite in (1, 3, 100):
+        assert toutes_les_pages(fec.id, limite, **options) == reference(fec.id, **options)
+
+
+@pytest.mark.parametrize('tri', ['date', 'montant'])
+@pytest.mark.parametrize('ordre', ['asc', 'desc'])
+def test_curseur_stable_apres_insertion(fec, tri, ordre):
+    """Les écritures ajoutées après la lecture d'une page ne décalent pas la pagination"""
+    def cle(ecriture):
+        return getattr(ecriture, COLONNES_TRI[tri].key), ecriture.id
+
+    vues = reference(fec.id, tri=tri, ordre=ordre)
+    premiere_page, curseur = page_ecritures(fec.id, tri=tri, ordre=ordre, limite=20)
+    assert [ecriture.id for ecriture in premiere_page] == vues[:20]
+
+    # Nouvelles écritures à égalité avec le curseur, avant et après lui dans l'ordre de tri
+    ajouter_ecritures(fec, random.Random(99), 30)
+
+    restantes = toutes_les_pages(fec.id, 20, curseur=curseur, tri=tri, ordre=ordre)
+
+    # Aucune écriture déjà présente n'est sautée ni répétée
+    assert [ecriture_id for ecriture_id in restantes if ecriture_id in set(vues)] == vues[20:]
+    # Les nouvelles sont servies si elles suivent le curseur (valeur de tri, id), et seulement elles
+    position = cle(premiere_page[-1])
+    toutes = sorted(EcritureBancaire.query.filter_by(fec_file_id=fec.id), key=cle, reverse=ordre == 'desc')
+    attendues = [ecriture.id for ecriture in toutes
+                 if (cle(ecriture) > position if ordre == 'asc' else cle(ecriture) < position)]
+    assert restantes == attendues
+
+
+@pytest.mark.parametrize('tri, valeur', [
+    ('montant', 'abc'),
+    ('montant', 'NaN'),
+    ('montant', [1]),
+    ('date', None),
+    ('date', '2024-13-01'),
+    ('libelle', 3),
+])
+def test_curseur_invalide(tri, valeur):
+    curseur = base64.urlsafe_b64encode(json.dumps([tri, valeur, 1]).encode('utf-8')).decode('ascii')
+    with pytest.raises(CurseurInvalide):
+        decoder_curseur(tri, curseur)